@@ -0,0 +1 @@
+"""Benchmarks of flathunter, run from the repository root (not installed)"""
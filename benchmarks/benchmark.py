@@ -0,0 +1,181 @@
+"""Benchmarks of flathunter's hot paths. Each benchmark times an optimised
+implementation against the one it replaced; the tests in test/ check that both give
+the same results.
+
+Run all benchmarks, or only the named ones, with:
+
+    python -m benchmarks.benchmark [filter] [imports] [immoscout] [parser] [embedded_json]
+"""
+import argparse
+import subprocess
+import sys
+import time
+from typing import Callable, Dict, Tuple
+# pylint counts the test package as standard library
+from test.utils.config import StringConfig
+from test.utils.exposes import synthetic_exposes
+from test.utils.legacy import legacy_filter, uncached_api_url
+from test.utils.pages import immowelt_page, subito_page, vrmimmo_page, wggesucht_page
+
+import yaml
+from bs4 import BeautifulSoup
+
+from flathunter.abstract_crawler import json_loads
+from flathunter.crawler.immobilienscout import Immobilienscout
+from flathunter.crawler.immowelt import Immowelt
+from flathunter.crawler.subito import Subito
+from flathunter.crawler.vrmimmo import VrmImmo
+from flathunter.crawler.wggesucht import WgGesucht
+from flathunter.filter import Filter, ExposeRecord
+from flathunter.utils.html import parse_html
+
+FILTERS = {'excluded_titles': ["wg", "tausch"], 'min_price': 400, 'max_price': 1500,
+           'min_size': 30, 'max_size': 120, 'min_rooms': 1, 'max_rooms': 4,
+           'max_price_per_square': 25}
+
+USER_FILTERS = [{'max_price': price, 'min_rooms': rooms}
+                for price in (800, 1200, 1600) for rooms in (1, 2, 3)]
+
+IMMOSCOUT_SEARCH_URLS = [
+    "https://www.immobilienscout24.de/Suche/de/berlin/berlin/wohnung-mieten"
+    "?numberofrooms=2.0-&price=-1500.0&livingspace=50.0-&sorting=2",
+    "https://www.immobilienscout24.de/Suche/de/hamburg/hamburg/wohnung-mieten"
+    "?equipment=balcony,builtinkitchen&sorting=2",
+    "https://www.immobilienscout24.de/Suche/radius/wohnung-mieten"
+    "?centerofsearchaddress=Berlin;;;;;&geocoordinates=52.51051;13.42762;2.0&sorting=2",
+    "https://www.immobilienscout24.de/Suche/de/bayern/muenchen/haus-kaufen"
+    "?price=-900000.0&pricetype=calculatedtotalrent&sorting=2",
+]
+
+Results = Tuple[str, Dict[str, float]]
+
+
+def seconds(function: Callable[[], object]) -> float:
+    """The time taken by a call of the function, in seconds"""
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+
+def build_filter(filters) -> Filter:
+    """Builds a filter chain as Hunter does, from a filters config section"""
+    return Filter.builder().read_config(StringConfig(yaml.safe_dump({'filters': filters}))) \
+                           .build()
+
+
+def filter_benchmark(count: int = 100_000) -> Results:
+    """Per-expose cost of the filter chain on a synthetic stream of listings, parsing
+       the numeric fields of each expose once (ExposeRecord) versus once per filter"""
+    exposes = list(synthetic_exposes(count))
+    user_filters = [build_filter(filters) for filters in USER_FILTERS]
+    users = len(USER_FILTERS)
+
+    def per_user_parse_once():
+        records = [ExposeRecord.from_expose(expose) for expose in exposes]
+        for filter_set in user_filters:
+            list(filter_set.filter_records(records))
+
+    timings = {
+        'chain, parse per filter':
+            seconds(lambda: list(filter(legacy_filter(FILTERS), exposes))),
+        'chain, parse once':
+            seconds(lambda: list(build_filter(FILTERS).filter(exposes))),
+        f'{users} users, parse per filter':
+            seconds(lambda: [list(filter(legacy_filter(filters), exposes))
+                             for filters in USER_FILTERS]),
+        f'{users} users, parse once': seconds(per_user_parse_once),
+    }
+    return 'µs/expose', {name: total * 1e6 / count for (name, total) in timings.items()}
+
+
+def imports_benchmark(slowest: int = 20) -> Results:
+    """The slowest imports of the configuration module, by cumulative import time as
+       reported by 'python -X importtime'. Crawler modules, and the libraries they
+       depend on, should not be among them"""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import flathunter.config'],
+                            capture_output=True, text=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        (_, cumulative_us, module) = line[len('import time:'):].split('|')
+        times[module.strip()] = int(cumulative_us) / 1000
+    ranked = sorted(times.items(), key=lambda item: item[1], reverse=True)[:slowest]
+    return 'ms', dict(ranked)
+
+
+def immoscout_benchmark(count: int = 10_000) -> Results:
+    """Per-URL cost of turning an ImmobilienScout search URL into an API URL: parsing
+       the URL and validating the pydantic query on every crawl, versus looking up the
+       query compiled on the first crawl"""
+    crawler = Immobilienscout(StringConfig(string=""))
+    urls = [IMMOSCOUT_SEARCH_URLS[crawl % len(IMMOSCOUT_SEARCH_URLS)] for crawl in range(count)]
+    timings = {
+        'validate per crawl': seconds(lambda: [uncached_api_url(crawler, url) for url in urls]),
+        'compile once': seconds(lambda: [crawler.compile_query(url).api_url for url in urls]),
+    }
+    return 'µs/URL', {name: total * 1e6 / count for (name, total) in timings.items()}
+
+
+def parser_benchmark(rounds: int = 20) -> Results:
+    """Per-page cost of extracting exposes from results pages, by building a
+       BeautifulSoup tree ('extract_data') versus querying an lxml tree with compiled
+       XPath expressions ('extract_from_tree')"""
+    config = StringConfig(string="")
+    timings = {}
+    for (crawler, page) in [(WgGesucht(config), wggesucht_page()),
+                            (Immowelt(config), immowelt_page()),
+                            (VrmImmo(config), vrmimmo_page())]:
+        name = crawler.get_name()
+        # pylint: disable=cell-var-from-loop
+        timings[f'{name}, BeautifulSoup'] = seconds(
+            lambda: [crawler.extract_data(BeautifulSoup(page, 'lxml')) for _ in range(rounds)])
+        timings[f'{name}, lxml'] = seconds(
+            lambda: [crawler.extract_from_tree(parse_html(page)) for _ in range(rounds)])
+    return 'ms/page', {name: total * 1000 / rounds for (name, total) in timings.items()}
+
+
+def embedded_json_benchmark(rounds: int = 20) -> Results:
+    """Per-page cost of reading the search state that Subito embeds in its results
+       pages as JSON: finding the script element in a BeautifulSoup tree and decoding
+       it with json, versus scanning the raw HTML for it and decoding it with orjson
+       (or json, if orjson is not installed)"""
+    crawler = Subito(StringConfig(string=""))
+    page = subito_page()
+    timings = {
+        'BeautifulSoup, json': seconds(
+            lambda: [crawler.extract_data(BeautifulSoup(page, 'lxml')) for _ in range(rounds)]),
+        f'scan, {json_loads.__module__}': seconds(
+            lambda: [crawler.extract_embedded_json(page) for _ in range(rounds)]),
+    }
+    return 'ms/page', {name: total * 1000 / rounds for (name, total) in timings.items()}
+
+
+BENCHMARKS = {
+    'filter': filter_benchmark,
+    'imports': imports_benchmark,
+    'immoscout': immoscout_benchmark,
+    'parser': parser_benchmark,
+    'embedded_json': embedded_json_benchmark,
+}
+
+
+def main():
+    """Runs the benchmarks named on the command line, or all of them"""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n', maxsplit=1)[0])
+    parser.add_argument('benchmarks', nargs='*', metavar='benchmark',
+                        help=f"benchmarks to run: {', '.join(BENCHMARKS)} (default: all)")
+    names = parser.parse_args().benchmarks or list(BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(unknown)}")
+    for name in names:
+        (unit, results) = BENCHMARKS[name]()
+        print(f"{name}:")
+        width = max(len(benchmark) for benchmark in results)
+        for (benchmark, value) in results.items():
+            print(f"  {benchmark:>{width}}: {value:9.2f} {unit}")
+
+
+if __name__ == '__main__':
+    main()
@@ -15,7 +15,7 @@ from prompt_toolkit.document import Document
 from prompt_toolkit.validation import Validator, ValidationError
 
 from flathunter.config import YamlConfig
-from flathunter.crawler import immobilienscout
+from flathunter.crawler import immobilienscout, handles_url
 
 
 class ConfigurationAborted(Exception):
@@ -57,9 +57,8 @@ class UrlsValidator(Validator):
             if len(self.urls) == 0:
                 raise ValidationError(cursor_position=0, message="Supply at least one URL")
             return
-        for searcher in self.config.searchers():
-            if re.search(searcher.URL_PATTERN, document.text):
-                return
+        if handles_url(document.text):
+            return
         raise ValidationError(cursor_position=len(document.text),
             message="URL did not match any configured scraper")
 
@@ -32,20 +32,27 @@ def launch_flat_hunt(config, heartbeat: Heartbeat):
     wait_during_period(time_from, time_till)
 
     hunter = Hunter(config, id_watch)
-    hunter.hunt_flats()
-    counter = 0
-
-    while config.loop_is_active():
-        wait_during_period(time_from, time_till)
-
-        counter += 1
-        counter = heartbeat.send_heartbeat(counter)
-        if config.random_jitter_enabled():
-            sleep_period = get_random_time_jitter(config.loop_period_seconds())
-        else:
-            sleep_period = config.loop_period_seconds()
-        time.sleep(sleep_period)
+    # deliver notifications in the background, so that slow notifiers do not hold
+    # up crawling
+    hunter.notification_dispatcher.start()
+    try:
         hunter.hunt_flats()
+        counter = 0
+
+        while config.loop_is_active():
+            wait_during_period(time_from, time_till)
+
+            counter += 1
+            counter = heartbeat.send_heartbeat(counter)
+            if config.random_jitter_enabled():
+                sleep_period = get_random_time_jitter(config.loop_period_seconds())
+            else:
+                sleep_period = config.loop_period_seconds()
+            time.sleep(sleep_period)
+            hunter.hunt_flats()
+    finally:
+        hunter.notification_dispatcher.stop()
+        config.close_browser_pool()
 
 
 def main():
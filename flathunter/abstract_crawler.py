@@ -1,8 +1,9 @@
 """Interface for webcrawlers. Crawler implementations should subclass this"""
 from abc import ABC
+from functools import lru_cache
 import re
 from time import sleep
-from typing import Optional, Any
+from typing import Dict, Iterator, List, Optional, Any, TYPE_CHECKING
 import json
 
 import backoff
@@ -13,18 +14,60 @@ import requests_random_user_agent
 from bs4 import BeautifulSoup
 
 from selenium.common.exceptions import NoSuchElementException, TimeoutException
-from selenium.webdriver import Chrome
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.support.wait import WebDriverWait
 
 from flathunter import proxies
 from flathunter.captcha.captcha_solver import CaptchaUnsolvableError
 from flathunter.logging import logger
 from flathunter.exceptions import ProxyException
-
-
-class Crawler(ABC):
+from flathunter.utils.html import charset, iter_elements, parse_html
+from flathunter.utils.urls import normalize_url
+
+try:
+    # orjson decodes large documents several times faster than json, if installed
+    from orjson import loads as json_loads  # pylint: disable=no-name-in-module
+except ImportError:
+    from json import loads as json_loads
+
+if TYPE_CHECKING:
+    from lxml.html import HtmlElement
+    from selenium.webdriver import Chrome
+    from flathunter.pagination import IncrementalPagination
+
+# Markers of the captchas that can be resolved, in order of precedence
+CAPTCHA_MARKERS = ('initGeetest', 'awswaf-captcha', 'g-recaptcha')
+CAPTCHA_PATTERN = re.compile('|'.join(re.escape(marker) for marker in CAPTCHA_MARKERS))
+
+
+def detect_captcha(page_source: str) -> Optional[str]:
+    """The marker of the captcha on a page, if any, found in a single pass over the
+       page source"""
+    found = set(CAPTCHA_PATTERN.findall(page_source))
+    for marker in CAPTCHA_MARKERS:
+        if marker in found:
+            return marker
+    return None
+
+
+@lru_cache(maxsize=None)
+def _script_pattern(script_id: str) -> re.Pattern:
+    return re.compile(rb'<script\b[^>]*\bid=["\']?' + re.escape(script_id.encode('ascii'))
+                      + rb'(?=["\'\s>])[^>]*>(.*?)</script\s*>', re.DOTALL | re.IGNORECASE)
+
+
+def find_embedded_json(page: bytes, script_id: str) -> Optional[Any]:
+    """The JSON in the script element with the id (such as '__NEXT_DATA__'), found by
+       scanning the raw HTML, without parsing the page. None if the page has no such
+       script, or if it does not hold valid JSON"""
+    match = _script_pattern(script_id).search(page)
+    if match is None:
+        return None
+    try:
+        return json_loads(match[1].strip())
+    except ValueError:
+        return None
+
+
+class Crawler(ABC):  # pylint: disable=too-many-public-methods
     """Defines the Crawler interface"""
 
     URL_PATTERN: re.Pattern
@@ -44,16 +87,79 @@ class Crawler(ABC):
         'Accept-Language': 'en-US,en;q=0.9',
     }
 
+    # Crawlers that implement 'extract_from_tree' set this, so that their results
+    # pages are parsed with lxml instead of into a BeautifulSoup tree
+    FAST_EXTRACTION = False
+
+    # Crawlers for portals that embed the search results as JSON in a script element
+    # set this to the id of the element, and implement 'extract_from_json'
+    EMBEDDED_JSON_ID: Optional[str] = None
+
+    # Crawlers that can extract an expose from each result card of a page as soon as
+    # it has been downloaded implement 'is_result_card' and 'extract_from_card', and
+    # set this. Their results are yielded while the rest of the page downloads
+    STREAMING_EXTRACTION = False
+
+    # Size of the chunks of a streamed page that are parsed at a time
+    STREAM_CHUNK_SIZE = 16 * 1024
+
     def __init__(self, config):
         self.config = config
+        # each crawler has its own cookies and User-Agent, over the shared connection pools
+        self.session = config.http_sessions().new_session()
         if config.captcha_enabled():
             self.captcha_solver = config.get_captcha_solver()
 
+    def canonical_url(self, url: str) -> str:
+        """The search URL in canonical form, without tracking parameters, so that URLs
+           for the same search compare equal. Crawlers for portals that can sort the
+           results also set the sort order to newest first, so that the first page of
+           results holds all new exposes"""
+        return normalize_url(url)
+
+    def prewarm(self):
+        """Prepare resources that take long to set up (such as a browser) in the
+           background, before crawling starts. Does nothing by default"""
+
+    def load_in_browser(self, driver, url: str):
+        """Navigate the browser to the URL"""
+        driver.get(url)
+
+    def performance_log(self, driver) -> List[Dict]:
+        """The entries of the Chrome performance log since the page was loaded"""
+        return driver.get_log('performance')
+
+    def get_soup_from_driver(
+            self,
+            driver,
+            url: str,
+            checkbox: bool = False,
+            afterlogin_string: Optional[str] = None) -> BeautifulSoup:
+        """Loads the URL in the browser, resolves a captcha if there is one, and
+           creates a Soup object from the page. Every read of the page source
+           serializes the whole DOM, so it is only read again after a captcha"""
+        self.load_in_browser(driver, url)
+        page_source = driver.page_source
+        captcha = detect_captcha(page_source)
+        if captcha is None:
+            return BeautifulSoup(page_source, 'lxml')
+        if captcha == 'initGeetest':
+            self.resolve_geetest(driver)
+        elif captcha == 'awswaf-captcha':
+            self.resolve_awsawf(driver)
+        else:
+            self.resolve_recaptcha(driver, checkbox, afterlogin_string or "")
+        return BeautifulSoup(driver.page_source, 'lxml')
+
     # pylint: disable=unused-argument
     def get_page(self, search_url, driver=None, page_no=None) -> BeautifulSoup:
         """Applies a page number to a formatted search URL and fetches the exposes at that page"""
         return self.get_soup_from_url(search_url)
 
+    def get_page_tree(self, search_url) -> 'HtmlElement':
+        """Fetches a page of search results and parses it into an lxml tree"""
+        return parse_html(self.get_html(search_url))
+
     @backoff.on_exception(wait_gen=backoff.constant,
                           exception=TimeoutException,
                           max_tries=3)
@@ -68,17 +174,15 @@ class Crawler(ABC):
         if self.config.use_proxy():
             return self.get_soup_with_proxy(url)
         if driver is not None:
-            driver.get(url)
-            if re.search("initGeetest", driver.page_source):
-                self.resolve_geetest(driver)
-            elif re.search("awswaf-captcha", driver.page_source):
-                self.resolve_awsawf(driver)
-            elif re.search("g-recaptcha", driver.page_source):
-                self.resolve_recaptcha(
-                    driver, checkbox, afterlogin_string or "")
-            return BeautifulSoup(driver.page_source, 'lxml')
-
-        resp = requests.get(url, headers=self.HEADERS, timeout=30)
+            return self.get_soup_from_driver(driver, url, checkbox, afterlogin_string)
+        return BeautifulSoup(self.get_html(url), 'lxml')
+
+    def get_html(self, url: str) -> bytes:
+        """Fetches the HTML at the provided URL, through a proxy if one is configured"""
+        if self.config.use_proxy():
+            return self.get_html_with_proxy(url)
+
+        resp = self.session.get(url, headers=self.HEADERS, timeout=30)
         if resp.status_code not in (200, 405):
             user_agent = 'Unknown'
             if 'User-Agent' in self.HEADERS:
@@ -86,10 +190,21 @@ class Crawler(ABC):
             logger.error("Got response (%i): %s\n%s",
                          resp.status_code, resp.content, user_agent)
 
-        return BeautifulSoup(resp.content, 'lxml')
+        return resp.content
+
+    def get_html_stream(self, url: str) -> requests.Response:
+        """Requests the HTML at the provided URL, without reading the response body"""
+        resp = self.session.get(url, headers=self.HEADERS, timeout=30, stream=True)
+        if resp.status_code not in (200, 405):
+            logger.error("Got response (%i) for %s", resp.status_code, url)
+        return resp
 
     def get_soup_with_proxy(self, url) -> BeautifulSoup:
         """Will try proxies until it's possible to crawl and return a soup"""
+        return BeautifulSoup(self.get_html_with_proxy(url), 'lxml')
+
+    def get_html_with_proxy(self, url) -> bytes:
+        """Will try proxies until it's possible to crawl and return the HTML"""
         resolved = False
         resp = None
 
@@ -97,6 +212,8 @@ class Crawler(ABC):
         while not resolved:
             proxies_list = proxies.get_proxies()
             for proxy in proxies_list:
+                # Every attempt goes through a different proxy, so there is
+                # nothing to gain from the pooled session here
                 try:
                     # Very low proxy read timeout, or it will get stuck on slow proxies
                     resp = requests.get(
@@ -127,36 +244,97 @@ class Crawler(ABC):
             raise ProxyException(
                 "An error occurred while fetching proxies or content")
 
-        return BeautifulSoup(resp.content, 'lxml')
+        return resp.content
 
     def extract_data(self, raw_data):
         """Should be implemented in subclass"""
         raise NotImplementedError
 
     # pylint: disable=unused-argument
-    def get_results(self, search_url, max_pages=None):
-        """Loads the exposes from the site, starting at the provided URL"""
+    def extract_from_tree(self, tree: 'HtmlElement') -> List[Dict]:
+        """Extracts all exposes from an lxml tree of a results page, with the same
+           results as 'extract_data'. Implemented by crawlers with FAST_EXTRACTION,
+           finds no exposes otherwise"""
+        return []
+
+    def extract_from_json(self, data: Any) -> Optional[List[Dict]]:
+        """Extracts all exposes from the JSON embedded in a results page, or returns
+           None if it does not hold the results. Implemented by crawlers with an
+           EMBEDDED_JSON_ID, for which the page is otherwise passed to 'extract_data'"""
+        return None
+
+    def is_result_card(self, element: 'HtmlElement') -> bool:
+        """True for the elements of a results page that 'extract_from_card' takes.
+           Implemented by crawlers with STREAMING_EXTRACTION, no element is a result
+           card otherwise"""
+        return False
+
+    def extract_from_card(self, card: 'HtmlElement') -> Optional[Dict]:
+        """Extracts the expose from a result card, with the same result as
+           'extract_from_tree' for it, or returns None if the card holds no expose.
+           Implemented by crawlers with STREAMING_EXTRACTION"""
+        return None
+
+    def stream_results(self, search_url: str) -> Iterator[Dict]:
+        """Yields the exposes of a results page as the page downloads: the page is
+           parsed in chunks, and each result card is extracted once it is complete"""
+        entries = 0
+        with self.get_html_stream(search_url) as resp:
+            cards = iter_elements(resp.iter_content(self.STREAM_CHUNK_SIZE),
+                                  self.is_result_card,
+                                  encoding=charset(resp.headers.get('Content-Type')))
+            for card in cards:
+                details = self.extract_from_card(card)  # pylint: disable=assignment-from-none
+                if details is not None:
+                    entries += 1
+                    yield details
+        logger.debug('Number of entries found: %d', entries)
+
+    def extract_embedded_json(self, page: bytes) -> List[Dict]:
+        """Extracts all exposes from the JSON embedded in a results page. Pages without
+           it are parsed with BeautifulSoup, and passed to 'extract_data'"""
+        data = find_embedded_json(page, self.EMBEDDED_JSON_ID or '')
+        entries = self.extract_from_json(data) if data is not None else None
+        if entries is None:
+            logger.debug("No results embedded as JSON in the page, parsing the HTML")
+            entries = self.extract_data(BeautifulSoup(page, 'lxml'))
+        return entries
+
+    # pylint: disable=unused-argument
+    def get_results(self, search_url, max_pages=None,
+                    pagination: Optional['IncrementalPagination'] = None):
+        """Loads the exposes from the site, starting at the provided URL. Crawlers that
+           fetch several pages of results stop early if 'pagination' finds that a page
+           only holds known exposes"""
         logger.debug("Got search URL %s", search_url)
 
-        # load first page
-        soup = self.get_page(search_url)
+        if self.STREAMING_EXTRACTION and self.config.stream_results() \
+                and self.config.fast_extraction() and not self.config.use_proxy():
+            return self.stream_results(search_url)
+        if self.EMBEDDED_JSON_ID is not None:
+            entries = self.extract_embedded_json(self.get_html(search_url))
+        elif self.FAST_EXTRACTION and self.config.fast_extraction():
+            entries = self.extract_from_tree(self.get_page_tree(search_url))
+        else:
+            # load first page
+            soup = self.get_page(search_url)
 
-        # get data from first page
-        entries = self.extract_data(soup)
+            # get data from first page
+            entries = self.extract_data(soup)
         logger.debug('Number of found entries: %d', len(entries))
 
         return entries
 
-    def crawl(self, url, max_pages=None):
-        """Load as many exposes as possible from the provided URL"""
-        if re.search(self.URL_PATTERN, url):
-            try:
-                return self.get_results(url, max_pages)
-            except requests.exceptions.ConnectionError:
-                logger.warning(
-                    "Connection to %s failed. Retrying.", url.split('/')[2])
-                return []
-        return []
+    def crawl(self, url, max_pages=None,
+              pagination: Optional['IncrementalPagination'] = None):
+        """Load as many exposes as possible from the provided URL. The URL is one that
+           the crawler router dispatched to this crawler"""
+        try:
+            return self.get_results(url, max_pages, pagination)
+        except requests.exceptions.ConnectionError:
+            logger.warning(
+                "Connection to %s failed. Retrying.", url.split('/')[2])
+            return []
 
     def get_name(self):
         """Returns the name of this crawler"""
@@ -171,12 +349,13 @@ class Crawler(ABC):
                           max_tries=3)
     def resolve_geetest(self, driver):
         """Resolve GeeTest Captcha"""
+        page_source = driver.page_source
         data = re.findall(
             "geetest_validate: obj.geetest_validate,\n.*?data: \"(.*)\"",
-            driver.page_source
+            page_source
         )[0]
         result = re.findall(
-            r"initGeetest\({(.*?)}", driver.page_source, re.DOTALL)
+            r"initGeetest\({(.*?)}", page_source, re.DOTALL)
 
         geetest = re.findall("gt: \"(.*?)\"", result[0])[0]
         challenge = re.findall("challenge: \"(.*?)\"", result[0])[0]
@@ -205,7 +384,7 @@ class Crawler(ABC):
 
         # Intercept background network traffic via log sniffing
         sleep(2)
-        logs = [json.loads(lr["message"])["message"] for lr in driver.get_log("performance")]
+        logs = [json.loads(lr["message"])["message"] for lr in self.performance_log(driver)]
 
         def log_filter(log_):
             return (
@@ -231,17 +410,18 @@ class Crawler(ABC):
         if context is None or iv is None:
             raise CaptchaUnsolvableError("Unable to find captcha data in logs")
 
+        page_source = driver.page_source
         sitekey = re.findall(
-            r"apiKey: \"(.*?)\"", driver.page_source)[0]
+            r"apiKey: \"(.*?)\"", page_source)[0]
 
         challenge = None
-        challenge_matches = re.findall(r'src="([^"]*challenge\.js)"', driver.page_source)
+        challenge_matches = re.findall(r'src="([^"]*challenge\.js)"', page_source)
         for match in challenge_matches:
             logger.debug('Challenge SRC Value: %s', match)
             challenge = match
 
         jsapi = None
-        jsapi_matches = re.findall(r'src="([^"]*jsapi\.js)"', driver.page_source)
+        jsapi_matches = re.findall(r'src="([^"]*jsapi\.js)"', page_source)
         for match in jsapi_matches:
             logger.debug('JsApi SRC Value: %s', match)
             jsapi = match
@@ -315,6 +495,11 @@ class Crawler(ABC):
         driver.switch_to.default_content()
 
     def _wait_for_captcha_resolution(self, driver, checkbox: bool, afterlogin_string=""):
+        # selenium.webdriver is slow to import, and only needed by webdriver crawlers
+        # pylint: disable=import-outside-toplevel
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.support import expected_conditions as EC
+        from selenium.webdriver.support.wait import WebDriverWait
         if checkbox:
             try:
                 WebDriverWait(driver, 120).until(
@@ -333,8 +518,13 @@ class Crawler(ABC):
                 logger.warning(
                     "Selenium.Timeoutexception when waiting for captcha to disappear")
 
-    def _wait_for_iframe(self, driver: Chrome):
+    def _wait_for_iframe(self, driver: 'Chrome'):
         """Wait for iFrame to appear"""
+        # selenium.webdriver is slow to import, and only needed by webdriver crawlers
+        # pylint: disable=import-outside-toplevel
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.support import expected_conditions as EC
+        from selenium.webdriver.support.wait import WebDriverWait
         try:
             iframe = WebDriverWait(driver, 10).until(EC.visibility_of_element_located(
                 (By.CSS_SELECTOR, "iframe[src^='https://www.google.com/recaptcha/api2/anchor?']")))
@@ -348,8 +538,13 @@ class Crawler(ABC):
                 "Timeout waiting for iframe element - no captcha verification necessary?")
             return None
 
-    def _wait_until_iframe_disappears(self, driver: Chrome):
+    def _wait_until_iframe_disappears(self, driver: 'Chrome'):
         """Wait for iFrame to disappear"""
+        # selenium.webdriver is slow to import, and only needed by webdriver crawlers
+        # pylint: disable=import-outside-toplevel
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.support import expected_conditions as EC
+        from selenium.webdriver.support.wait import WebDriverWait
         try:
             WebDriverWait(driver, 10).until(EC.invisibility_of_element(
                 (By.CSS_SELECTOR, "iframe[src^='https://www.google.com/recaptcha/api2/anchor?']")))
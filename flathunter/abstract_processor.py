@@ -1,6 +1,8 @@
 """Abstract class defining the 'Processor' interface"""
 from typing import Dict
 
+from flathunter.utils.batches import BatchedIterator
+
 class Processor:
     """Processor interface. Flathunter runs sequences of exposes through
        a set of processors that stack on each other"""
@@ -10,5 +12,6 @@ class Processor:
         return expose
 
     def process_exposes(self, exposes):
-        """Apply the processor to every expose in the sequence"""
-        return map(self.process_expose, exposes)
+        """Apply the processor to every expose in the sequence. Exposes are passed on
+           one at a time, as soon as they are processed"""
+        return BatchedIterator(exposes, 1, lambda batch: map(self.process_expose, batch))
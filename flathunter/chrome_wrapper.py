@@ -1,14 +1,21 @@
 """Chrome needs some special handling to work out where the correct
 binary is, to attach the correct selenium chromedriver, and to set
-the correct version number"""
+the correct version number. Browsers are expensive to start, so they are
+kept in a pool and shared by the webdriver crawlers"""
+import json
+import os
 import re
 import subprocess
-from typing import List
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
 from sys import platform
 import undetected_chromedriver as uc
+from selenium.common.exceptions import WebDriverException
 
 from flathunter.logging import logger
-from flathunter.exceptions import ChromeNotFound
+from flathunter.exceptions import ChromeNotFound, ConfigException
 
 CHROME_VERSION_REGEXP = re.compile(r'.* (\d+\.\d+\.\d+\.\d+)( .*)?')
 WINDOWS_CHROME_REG_PATH = r'HKEY_CURRENT_USER\Software\Google\Chrome\BLBeacon'
@@ -16,6 +23,37 @@ WINDOWS_CHROME_REG_REGEXP = re.compile(r'\s*version\s*REG_SZ\s*(\d+)\..*')
 CHROME_BINARY_NAMES = ['google-chrome', 'chromium', 'chrome', 'chromium-browser',
                        '/Applications/Google Chrome.app/Contents/MacOS/Google Chrome']
 
+# Always blocked, so that Geetest captchas are not loaded before they can be solved
+CAPTCHA_BLOCKED_URLS = ["https://api.geetest.com/get.*"]
+
+def _extension_patterns(*extensions: str) -> List[str]:
+    """URL patterns for files with the extensions, with or without a query string"""
+    return [pattern for extension in extensions
+            for pattern in (f"*.{extension}", f"*.{extension}?*")]
+
+# URL patterns (in the wildcard syntax of Network.setBlockedURLs) of the kinds of
+# resources that a page can be loaded without
+RESOURCE_PATTERNS: Dict[str, List[str]] = {
+    'images': _extension_patterns('png', 'jpg', 'jpeg', 'gif', 'webp', 'avif', 'svg', 'ico'),
+    'fonts': _extension_patterns('woff', 'woff2', 'ttf', 'otf', 'eot'),
+    'media': _extension_patterns('mp4', 'webm', 'mp3', 'ogg', 'm3u8'),
+    'stylesheets': _extension_patterns('css'),
+    'scripts': _extension_patterns('js'),
+    'trackers': ['*googletagmanager.com/*', '*google-analytics.com/*', '*doubleclick.net/*',
+                 '*googlesyndication.com/*', '*googleadservices.com/*', '*adservice.google.*',
+                 '*amazon-adsystem.com/*', '*facebook.net/*', '*criteo.com/*',
+                 '*criteo.net/*', '*adnxs.com/*', '*hotjar.com/*', '*taboola.com/*',
+                 '*outbrain.com/*', '*scorecardresearch.com/*', '*xiti.com/*'],
+}
+
+# The kinds of resources blocked by each profile. 'document' only loads what is
+# needed to render the HTML of the page
+BLOCKING_PROFILES: Dict[str, List[str]] = {
+    'none': [],
+    'default': ['images', 'fonts', 'media', 'trackers'],
+    'document': ['images', 'fonts', 'media', 'trackers', 'stylesheets', 'scripts'],
+}
+
 def get_command_output(args) -> List[str]:
     """Run a command and return stdout"""
     try:
@@ -78,7 +116,259 @@ def get_chrome_driver(driver_arguments):
         },
     )
 
-    driver.execute_cdp_cmd('Network.setBlockedURLs',
-        {"urls": ["https://api.geetest.com/get.*"]})
+    block_urls(driver, [])
     driver.execute_cdp_cmd('Network.enable', {})
     return driver
+
+def blocked_urls(profile: str, allowed: Iterable[str] = ()) -> List[str]:
+    """URL patterns blocked by a profile, except for the allowed kinds of resources"""
+    if profile not in BLOCKING_PROFILES:
+        raise ConfigException(f"Unknown resource blocking profile: {profile}")
+    allowed = set(allowed)
+    unknown = allowed - set(RESOURCE_PATTERNS)
+    if unknown:
+        raise ConfigException(f"Unknown kinds of resources: {', '.join(sorted(unknown))}")
+    return [pattern for kind in BLOCKING_PROFILES[profile] if kind not in allowed
+            for pattern in RESOURCE_PATTERNS[kind]]
+
+def block_urls(driver, patterns: List[str]):
+    """Block requests for URLs matching the patterns (and the captcha URLs) from now on"""
+    driver.execute_cdp_cmd('Network.setBlockedURLs',
+                           {"urls": CAPTCHA_BLOCKED_URLS + patterns})
+
+def transfer_totals(performance_log: List[Dict]) -> Tuple[int, int]:
+    """Bytes transferred over the network, and requests blocked, according to the
+       entries of the Chrome performance log"""
+    (transferred, blocked) = (0, 0)
+    for entry in performance_log:
+        message = json.loads(entry['message'])['message']
+        if message['method'] == 'Network.loadingFinished':
+            transferred += int(message['params'].get('encodedDataLength', 0))
+        elif message['method'] == 'Network.loadingFailed' \
+                and 'blockedReason' in message['params']:
+            blocked += 1
+    return (transferred, blocked)
+
+
+def browser_rss_mb(driver) -> Optional[float]:
+    """Resident memory of the browser and all of its child processes (renderers,
+       GPU process, ...) in MB, read from /proc. None if it cannot be determined"""
+    pid = getattr(driver, 'browser_pid', None)
+    if pid is None or not os.path.isdir('/proc'):
+        return None
+    (total_kb, pids) = (0, [pid])
+    while pids:
+        pid = pids.pop()
+        try:
+            with open(f'/proc/{pid}/status', encoding='ascii') as status:
+                for line in status:
+                    if line.startswith('VmRSS:'):
+                        total_kb += int(line.split()[1])
+            for task in os.listdir(f'/proc/{pid}/task'):
+                with open(f'/proc/{pid}/task/{task}/children', encoding='ascii') as children:
+                    pids.extend(int(child) for child in children.read().split())
+        except (OSError, ValueError):
+            # the process has exited in the meantime
+            continue
+    return total_kb / 1024 if total_kb > 0 else None
+
+
+class PageLoadStats(NamedTuple):
+    """Pages loaded by the browsers, with the bytes transferred, the requests blocked
+       and the WebDriver commands sent"""
+    pages: int
+    transferred_bytes: int
+    seconds: float
+    blocked_requests: int
+    commands: int
+
+
+class PooledBrowser:
+    """A browser in the pool, with the number of pages it has loaded and of WebDriver
+       commands it has been sent"""
+
+    def __init__(self, driver):
+        self.driver = driver
+        self.pages = 0
+        self.commands = 0
+        # performance log entries read while measuring the last page load
+        self.page_log: List[Dict] = []
+        if hasattr(driver, 'execute'):
+            execute = driver.execute
+
+            def counting_execute(*args, **kwargs):
+                # a browser is only used by the thread that leased it
+                self.commands += 1
+                return execute(*args, **kwargs)
+            driver.execute = counting_execute
+
+
+class BrowserPool: # pylint: disable=too-many-instance-attributes
+    """Hands out browsers to crawlers, starting at most 'max_browsers' of them. A
+       browser is returned to the pool after use, and reused for later pages until
+       it has loaded 'max_pages' pages or its memory use exceeds 'max_rss_mb'; then
+       it is quit and replaced by a fresh one on demand. A browser that was in use
+       when an error occurred is quit as well, as it may be in an unknown state"""
+
+    def __init__(self, factory: Callable[[], Any], max_browsers: int = 1,
+                 max_pages: int = 50, max_rss_mb: float = 0,
+                 measure_rss: Callable[[Any], Optional[float]] = browser_rss_mb):
+        self.factory = factory
+        self.max_pages = max_pages
+        self.max_rss_mb = max_rss_mb
+        self.measure_rss = measure_rss
+        self.slots = threading.BoundedSemaphore(max(1, max_browsers))
+        self.lock = threading.Lock()
+        self.idle: List[PooledBrowser] = []
+        self.warming = False
+        self.closed = False
+        self.leased: Dict[int, PooledBrowser] = {}
+        self.totals = PageLoadStats(0, 0, 0.0, 0, 0)
+        self.last_totals = self.totals
+
+    @contextmanager
+    def lease(self) -> Iterator[Any]:
+        """Borrow a browser for loading a page, waiting for one to become available
+           if all browsers are in use"""
+        with self.slots:
+            browser = self._checkout()
+            commands = browser.commands
+            with self.lock:
+                self.leased[id(browser.driver)] = browser
+            try:
+                yield browser.driver
+            except Exception:
+                self._quit(browser)
+                raise
+            finally:
+                with self.lock:
+                    del self.leased[id(browser.driver)]
+            commands = browser.commands - commands
+            logger.debug("Sent %d WebDriver commands for a page", commands)
+            self._add_to_totals(PageLoadStats(0, 0, 0.0, 0, commands))
+            browser.pages += 1
+            if self._worn_out(browser):
+                self._quit(browser)
+            else:
+                self._checkin(browser)
+
+    def load(self, driver, url: str) -> PageLoadStats:
+        """Load a page in a leased browser, and record the time it took and the bytes
+           transferred for it"""
+        try:
+            # discard the log entries of previous pages
+            driver.get_log('performance')
+        except WebDriverException:
+            logger.debug("Performance log not available", exc_info=True)
+        start = time.monotonic()
+        driver.get(url)
+        seconds = time.monotonic() - start
+        try:
+            page_log = driver.get_log('performance')
+        except WebDriverException:
+            page_log = []
+        with self.lock:
+            self.leased[id(driver)].page_log = page_log
+        (transferred, blocked) = transfer_totals(page_log)
+        logger.debug("Loaded %s in %.2f s: %d kB transferred, %d requests blocked",
+                     url, seconds, transferred / 1024, blocked)
+        stats = PageLoadStats(1, transferred, seconds, blocked, 0)
+        self._add_to_totals(stats)
+        return stats
+
+    def performance_log(self, driver) -> List[Dict]:
+        """The performance log entries of a leased browser since its page was loaded,
+           including those read to measure the page load"""
+        with self.lock:
+            browser = self.leased[id(driver)]
+            (page_log, browser.page_log) = (browser.page_log, [])
+        return page_log + driver.get_log('performance')
+
+    def _add_to_totals(self, stats: PageLoadStats):
+        """Add the statistics of a page load to the totals"""
+        with self.lock:
+            self.totals = PageLoadStats(*(total + value
+                                          for (total, value) in zip(self.totals, stats)))
+
+    def cycle_stats(self) -> PageLoadStats:
+        """Pages loaded, with the bytes transferred, since the previous call"""
+        with self.lock:
+            (totals, last_totals) = (self.totals, self.last_totals)
+            self.last_totals = totals
+        return PageLoadStats(*(total - last for (total, last) in zip(totals, last_totals)))
+
+    def log_cycle_stats(self):
+        """Log the page load statistics since the previous call"""
+        stats = self.cycle_stats()
+        logger.info("Browser: %d pages loaded in %.2f s, %d kB transferred, "
+                    "%d requests blocked, %d WebDriver commands", stats.pages,
+                    stats.seconds, stats.transferred_bytes / 1024,
+                    stats.blocked_requests, stats.commands)
+
+    def prewarm(self):
+        """Start a browser on a background thread, so that it is ready by the time
+           the first page is loaded. Does nothing if a browser is already idle or
+           all browsers are in use"""
+        with self.lock:
+            if self.closed or self.warming or len(self.idle) > 0:
+                return
+            self.warming = True
+        threading.Thread(target=self._warm, name='browser-prewarm', daemon=True).start()
+
+    def close(self):
+        """Quit the idle browsers. Browsers in use are quit when they are returned"""
+        with self.lock:
+            self.closed = True
+            (idle, self.idle) = (self.idle, [])
+        for browser in idle:
+            self._quit(browser)
+
+    def _checkout(self) -> PooledBrowser:
+        """Take an idle browser, or start a new one"""
+        with self.lock:
+            if len(self.idle) > 0:
+                return self.idle.pop()
+        return PooledBrowser(self.factory())
+
+    def _checkin(self, browser: PooledBrowser):
+        """Return a browser to the pool, or quit it if the pool has been closed"""
+        with self.lock:
+            if not self.closed:
+                self.idle.append(browser)
+                return
+        self._quit(browser)
+
+    def _warm(self):
+        """Start a browser and add it to the pool, if there is room for another one"""
+        try:
+            if self.slots.acquire(blocking=False): # pylint: disable=consider-using-with
+                try:
+                    self._checkin(PooledBrowser(self.factory()))
+                finally:
+                    self.slots.release()
+        except Exception: # pylint: disable=broad-exception-caught
+            logger.exception("Error starting a browser in the background")
+        finally:
+            with self.lock:
+                self.warming = False
+
+    def _worn_out(self, browser: PooledBrowser) -> bool:
+        """True if the browser should be replaced by a fresh one"""
+        if 0 < self.max_pages <= browser.pages:
+            logger.debug("Recycling browser after %d pages", browser.pages)
+            return True
+        if self.max_rss_mb > 0:
+            rss = self.measure_rss(browser.driver)
+            if rss is not None and rss > self.max_rss_mb:
+                logger.debug("Recycling browser using %.0f MB after %d pages",
+                             rss, browser.pages)
+                return True
+        return False
+
+    @staticmethod
+    def _quit(browser: PooledBrowser):
+        """Quit a browser, ignoring errors from browsers that have already crashed"""
+        try:
+            browser.driver.quit()
+        except Exception: # pylint: disable=broad-exception-caught
+            logger.warning("Error quitting browser", exc_info=True)
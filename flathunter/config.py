@@ -1,27 +1,26 @@
 """Wrap configuration options as an object"""
 import os
-from typing import Optional, Dict, Any, List, Protocol
+import threading
+from typing import Optional, Dict, Any, List, Protocol, TYPE_CHECKING
 
 import json
 import yaml
 from dotenv import load_dotenv
 
-from flathunter.captcha.captcha_solver import CaptchaSolver
-from flathunter.captcha.imagetyperz_solver import ImageTyperzSolver
-from flathunter.captcha.twocaptcha_solver import TwoCaptchaSolver
-from flathunter.captcha.capmonster_solver import CapmonsterSolver
-from flathunter.crawler.kleinanzeigen import Kleinanzeigen
-from flathunter.crawler.idealista import Idealista
-from flathunter.crawler.immobiliare import Immobiliare
-from flathunter.crawler.immobilienscout import Immobilienscout
-from flathunter.crawler.immowelt import Immowelt
-from flathunter.crawler.wggesucht import WgGesucht
-from flathunter.crawler.vrmimmo import VrmImmo
-from flathunter.crawler.subito import Subito
+from flathunter.crawler import plugins_for
 from flathunter.filter import Filter
+from flathunter.crawler_router import CrawlerRouter
+from flathunter.http_sessions import HttpSessions
+from flathunter.utils.rate_limit import KeyedRateLimiter
 from flathunter.logging import logger
 from flathunter.exceptions import ConfigException
 
+# Crawlers and captcha solvers are imported when they are first needed, as they
+# pull in heavy dependencies such as selenium
+if TYPE_CHECKING:
+    from flathunter.captcha.captcha_solver import CaptchaSolver
+    from flathunter.chrome_wrapper import BrowserPool
+
 load_dotenv()
 
 class Readenv(Protocol):
@@ -112,7 +111,7 @@ def elide(string):
     return f"{string[0:3]}{blanks}{string[-3:]}"
 
 
-class YamlConfig:  # pylint: disable=too-many-public-methods
+class YamlConfig:  # pylint: disable=too-many-public-methods,too-many-instance-attributes
     """Generic config object constructed from nested dictionaries"""
 
     DEFAULT_MESSAGE_FORMAT = """{title}
@@ -127,6 +126,14 @@ Preis: {price}
             config = {}
         self.config = config
         self.__searchers__ = []
+        self.__crawler_router__ = CrawlerRouter([])
+        self.__crawl_urls__: Optional[List[str]] = None
+        self.__http_sessions__ = None
+        self.__http_sessions_lock__ = threading.Lock()
+        self.__telegram_rate_limiter__ = None
+        self.__telegram_rate_limiter_lock__ = threading.Lock()
+        self.__browser_pool__ = None
+        self.__browser_pool_lock__ = threading.Lock()
         self.check_deprecated()
 
     def __iter__(self):
@@ -138,17 +145,11 @@ Preis: {price}
         return self.config[value]
 
     def init_searchers(self):
-        """Initialize search plugins"""
-        self.__searchers__ = [
-            Immobilienscout(self),
-            WgGesucht(self),
-            Kleinanzeigen(self),
-            Immowelt(self),
-            Subito(self),
-            Immobiliare(self),
-            Idealista(self),
-            VrmImmo(self)
-        ]
+        """Initialize the search plugins for the configured target URLs. Only the
+           modules of the crawlers that handle one of the URLs are imported"""
+        self.__searchers__ = [plugin.load()(self) for plugin in plugins_for(self.target_urls())]
+        self.__crawler_router__ = CrawlerRouter(self.__searchers__)
+        self.__crawl_urls__ = self._canonical_target_urls()
 
     def check_deprecated(self):
         """Notifies user of deprecated config items"""
@@ -188,11 +189,101 @@ Preis: {price}
     def set_searchers(self, searchers):
         """Update the active search plugins"""
         self.__searchers__ = searchers
+        self.__crawler_router__ = CrawlerRouter(searchers)
+        self.__crawl_urls__ = self._canonical_target_urls()
+
+    def _canonical_target_urls(self) -> List[str]:
+        """The target URLs in the canonical form of their crawlers (e.g. sorted newest
+           first), without duplicates"""
+        if not _to_bool(self._read_yaml_path('crawl.canonicalize_urls', True)):
+            return self.target_urls()
+        urls: Dict[str, str] = {}
+        for url in self.target_urls():
+            crawler = self.__crawler_router__.crawler_for(url)
+            canonical = url if crawler is None else crawler.canonical_url(url)
+            if canonical in urls:
+                logger.info("Not crawling %s, it is the same search as %s",
+                            url, urls[canonical])
+                continue
+            if canonical != url:
+                logger.info("Crawling %s as %s", url, canonical)
+            urls[canonical] = url
+        return list(urls)
 
     def searchers(self):
         """Get the list of search plugins"""
         return self.__searchers__
 
+    def crawler_router(self) -> CrawlerRouter:
+        """Router from URLs to the search plugins that handle them"""
+        return self.__crawler_router__
+
+    def http_sessions(self) -> HttpSessions:
+        """Pooled HTTP sessions, created on first use and shared by all users of the config"""
+        with self.__http_sessions_lock__:
+            if self.__http_sessions__ is None:
+                self.__http_sessions__ = HttpSessions(
+                    pool_connections=int(self._read_yaml_path('http.pool_connections', 10)),
+                    pool_maxsize=int(self._read_yaml_path('http.pool_maxsize', 10)),
+                    max_retries=int(self._read_yaml_path('http.max_retries', 2)),
+                    backoff_factor=float(self._read_yaml_path('http.backoff_factor', 0.5)),
+                    keep_alive=_to_bool(self._read_yaml_path('http.keep_alive', True)),
+                    max_requests_per_host=int(
+                        self._read_yaml_path('http.max_requests_per_host', 4)))
+            return self.__http_sessions__
+
+    def http_session(self):
+        """The pooled HTTP session shared by the notifiers and the Google Maps client.
+           Crawlers have sessions of their own"""
+        return self.http_sessions().session
+
+    def browser_pool(self) -> 'BrowserPool':
+        """Pooled Chrome browsers for the webdriver crawlers, created on first use and
+           shared by all users of the config"""
+        # pylint: disable=import-outside-toplevel
+        from flathunter.chrome_wrapper import BrowserPool, get_chrome_driver
+        with self.__browser_pool_lock__:
+            if self.__browser_pool__ is None:
+                driver_arguments = self.captcha_driver_arguments()
+                self.__browser_pool__ = BrowserPool(
+                    lambda: get_chrome_driver(driver_arguments),
+                    max_browsers=int(self._read_yaml_path('webdriver.max_browsers', 1)),
+                    max_pages=int(self._read_yaml_path('webdriver.max_pages_per_browser', 50)),
+                    max_rss_mb=float(self._read_yaml_path('webdriver.max_rss_mb', 1024)))
+            return self.__browser_pool__
+
+    def browser_pool_started(self) -> bool:
+        """True if the browser pool has been created"""
+        return self.__browser_pool__ is not None
+
+    def webdriver_blocking_profile(self) -> str:
+        """Kinds of resources that browsers do not load for search result pages:
+           'none', 'default' or 'document'"""
+        return str(self._read_yaml_path('webdriver.block_resources', 'default'))
+
+    def webdriver_details_blocking_profile(self) -> str:
+        """Kinds of resources that browsers do not load for expose detail pages"""
+        return str(self._read_yaml_path('webdriver.block_resources_details', 'document'))
+
+    def webdriver_allowed_resources(self, crawler: str) -> List[str]:
+        """Kinds of resources that are never blocked for a crawler, e.g. because its
+           captchas need them"""
+        return self._read_yaml_path(f'webdriver.allow_resources.{crawler.lower()}', [])
+
+    def close_browser_pool(self):
+        """Quit the pooled browsers, if any were started"""
+        with self.__browser_pool_lock__:
+            if self.__browser_pool__ is not None:
+                self.__browser_pool__.close()
+
+    def gmaps_cache_ttl_days(self) -> float:
+        """Number of days for which Google Maps results are cached. 0 disables the cache"""
+        return float(self._read_yaml_path('google_maps_api.cache.ttl_days', 30))
+
+    def gmaps_cache_max_entries(self) -> int:
+        """Maximum number of cached Google Maps results"""
+        return int(self._read_yaml_path('google_maps_api.cache.max_entries', 10000))
+
     def get_filter(self):
         """Read the configured filter"""
         builder = Filter.builder()
@@ -222,6 +313,37 @@ Preis: {price}
         """List of target URLs for crawling"""
         return self._read_yaml_path('urls', [])
 
+    def crawl_urls(self) -> List[str]:
+        """The target URLs to crawl. Once the search plugins are set up, these are the
+           canonical forms of the target URLs, without duplicates"""
+        if self.__crawl_urls__ is None:
+            return self.target_urls()
+        return self.__crawl_urls__
+
+    def crawl_max_workers(self) -> int:
+        """Maximum number of target URLs that are crawled concurrently"""
+        return int(self._read_yaml_path('crawl.max_workers', 4))
+
+    def crawl_max_workers_per_crawler(self) -> int:
+        """Maximum number of concurrent crawls against the same portal"""
+        return int(self._read_yaml_path('crawl.max_workers_per_crawler', 1))
+
+    def crawl_incremental(self) -> bool:
+        """True if paginated searches sorted newest first stop at the first page that
+           only holds known exposes. Only the ImmoScout24 crawler fetches more than one
+           page of results"""
+        return _to_bool(self._read_yaml_path('crawl.incremental', True))
+
+    def fast_extraction(self) -> bool:
+        """True if crawlers that can extract exposes with lxml do so, instead of
+           building a BeautifulSoup tree of the results pages"""
+        return _to_bool(self._read_yaml_path('crawl.fast_extraction', True))
+
+    def stream_results(self) -> bool:
+        """True if crawlers that can extract exposes from a results page while it
+           downloads do so, instead of waiting for the whole page"""
+        return _to_bool(self._read_yaml_path('crawl.stream_results', True))
+
     def verbose_logging(self):
         """Return true if logging should be verbose"""
         return self._read_yaml_path('verbose', None) is not None
@@ -291,6 +413,26 @@ Preis: {price}
         """Static list of receiver IDs for notification messages"""
         return self._read_yaml_path('telegram.receiver_ids', [])
 
+    def telegram_max_workers(self) -> int:
+        """Maximum number of receivers that Telegram messages are sent to concurrently"""
+        return int(self._read_yaml_path('telegram.max_workers', 8))
+
+    def telegram_rate_limiter(self) -> KeyedRateLimiter:
+        """Rate limiter for Telegram messages, created on first use and shared by all
+           senders, so that the bot stays within Telegram's global and per-chat limits"""
+        with self.__telegram_rate_limiter_lock__:
+            if self.__telegram_rate_limiter__ is None:
+                self.__telegram_rate_limiter__ = KeyedRateLimiter(
+                    rate=float(self._read_yaml_path(
+                        'telegram.rate_limit.messages_per_second', 30)),
+                    capacity=float(self._read_yaml_path(
+                        'telegram.rate_limit.burst', 30)),
+                    rate_per_key=float(self._read_yaml_path(
+                        'telegram.rate_limit.messages_per_chat_per_second', 1)),
+                    capacity_per_key=float(self._read_yaml_path(
+                        'telegram.rate_limit.burst_per_chat', 3)))
+            return self.__telegram_rate_limiter__
+
     def mattermost_webhook_url(self):
         """Webhook for sending Mattermost messages"""
         return self._read_yaml_path('mattermost.webhook_url', None)
@@ -325,23 +467,27 @@ Preis: {price}
         """API Token for Capmonster"""
         return self._read_yaml_path("captcha.capmonster.api_key", "")
 
-    def _get_captcha_solver(self) -> Optional[CaptchaSolver]:
-        """Get configured captcha solver"""
+    def _get_captcha_solver(self) -> Optional['CaptchaSolver']:
+        """Get configured captcha solver. Only the module of that solver is imported"""
+        # pylint: disable=import-outside-toplevel
         imagetyperz_token = self._get_imagetyperz_token()
         if imagetyperz_token:
+            from flathunter.captcha.imagetyperz_solver import ImageTyperzSolver
             return ImageTyperzSolver(imagetyperz_token)
 
         twocaptcha_api_key = self.get_twocaptcha_key()
         if twocaptcha_api_key:
+            from flathunter.captcha.twocaptcha_solver import TwoCaptchaSolver
             return TwoCaptchaSolver(twocaptcha_api_key)
 
         capmonster_api_key = self.get_capmonster_key()
         if capmonster_api_key:
+            from flathunter.captcha.capmonster_solver import CapmonsterSolver
             return CapmonsterSolver(capmonster_api_key)
 
         return None
 
-    def get_captcha_solver(self) -> CaptchaSolver:
+    def get_captcha_solver(self) -> 'CaptchaSolver':
         """Return the configured captcha solver (or raise exception)"""
         solver = self._get_captcha_solver()
         if solver is not None:
@@ -0,0 +1,53 @@
+"""Package for crawlers. The registry below maps the URLs each crawler handles to
+the module that implements it, so that a crawler module - and the libraries it
+depends on - is only imported once a configured URL needs it"""
+import importlib
+import re
+from typing import Iterable, List, NamedTuple
+
+
+class CrawlerPlugin(NamedTuple):
+    """A crawler, by the URL_PATTERN of the crawler class and where it is defined"""
+    url_pattern: re.Pattern
+    module: str
+    name: str
+
+    def handles(self, url: str) -> bool:
+        """True if the crawler handles the URL"""
+        return re.search(self.url_pattern, url) is not None
+
+    def load(self):
+        """Import the crawler module, and return the crawler class"""
+        return getattr(importlib.import_module(self.module), self.name)
+
+
+CRAWLER_PLUGINS = [
+    CrawlerPlugin(re.compile(r'https://www\.immobilienscout24\.de'),
+                  'flathunter.crawler.immobilienscout', 'Immobilienscout'),
+    CrawlerPlugin(re.compile(r'https://www\.wg-gesucht\.de'),
+                  'flathunter.crawler.wggesucht', 'WgGesucht'),
+    CrawlerPlugin(re.compile(r'https://www\.kleinanzeigen\.de'),
+                  'flathunter.crawler.kleinanzeigen', 'Kleinanzeigen'),
+    CrawlerPlugin(re.compile(r'https://www\.immowelt\.de'),
+                  'flathunter.crawler.immowelt', 'Immowelt'),
+    CrawlerPlugin(re.compile(r'https://www\.subito\.it'),
+                  'flathunter.crawler.subito', 'Subito'),
+    CrawlerPlugin(re.compile(r'https://www\.immobiliare\.it'),
+                  'flathunter.crawler.immobiliare', 'Immobiliare'),
+    CrawlerPlugin(re.compile(r'https://www\.idealista\.it'),
+                  'flathunter.crawler.idealista', 'Idealista'),
+    CrawlerPlugin(re.compile(r'https://vrm-immo\.de'),
+                  'flathunter.crawler.vrmimmo', 'VrmImmo'),
+]
+
+
+def plugins_for(urls: Iterable[str]) -> List[CrawlerPlugin]:
+    """The crawlers that handle at least one of the URLs, in registry order"""
+    urls = list(urls)
+    return [plugin for plugin in CRAWLER_PLUGINS
+            if any(plugin.handles(url) for url in urls)]
+
+
+def handles_url(url: str) -> bool:
+    """True if any crawler handles the URL"""
+    return len(plugins_for([url])) > 0
@@ -3,6 +3,29 @@ import re
 
 from flathunter.logging import logger
 from flathunter.abstract_crawler import Crawler
+from flathunter.utils.urls import normalize_url
+
+
+def parse_price(price_text: str) -> str:
+    """The price without the currency symbol, from the price shown for a listing"""
+    price_re = re.match(r".*\s([0-9]+.*)$", price_text)
+    return price_re[1] if price_re is not None else "???"
+
+
+def address_from_title(title: str) -> str:
+    """The address of a listing, which its title ends with"""
+    address_match = re.match(r"\w+\s(.*)$", title)
+    return address_match[1] if address_match else ""
+
+
+def search_results(data):
+    """The search results in the state of the Next.js page, or None"""
+    queries = data["props"]["pageProps"]["dehydratedState"]["queries"]
+    for query in queries:
+        results = (query.get("state", {}).get("data") or {}).get("results")
+        if isinstance(results, list):
+            return results
+    return None
 
 
 class Immobiliare(Crawler):
@@ -10,10 +33,16 @@ class Immobiliare(Crawler):
 
     URL_PATTERN = re.compile(r'https://www\.immobiliare\.it')
 
+    EMBEDDED_JSON_ID = "__NEXT_DATA__"
+
     def __init__(self, config):
         super().__init__(config)
         self.config = config
 
+    def canonical_url(self, url: str) -> str:
+        """Sorts the results by modification date, newest first"""
+        return normalize_url(url, replace={'criterio': 'dataModifica', 'ordine': 'desc'})
+
     # pylint: disable=too-many-locals
     def extract_data(self, raw_data):
         """Extracts all exposes from a provided Soup object"""
@@ -42,16 +71,12 @@ class Immobiliare(Crawler):
             price_li = row.find(
                 "div", {"class": "in-listingCardPrice"})
 
-            price_re = re.match(
-                r".*\s([0-9]+.*)$",
+            price = parse_price(
                 # if there is a discount on the price, then there will be a <div>,
                 # otherwise the text we are looking for is directly inside the <li>
                 (price_li.find("div") if price_li.find(
                     "div") else price_li).text.strip()
             )
-            price = "???"
-            if price_re is not None:
-                price = price_re[1]
 
             detail_texts = [ item.find("span").text.strip() for item in details_list ]
             room_counts = [ match.group(1) for text in detail_texts
@@ -67,9 +92,6 @@ class Immobiliare(Crawler):
             else:
                 size = None
 
-            address_match = re.match(r"\w+\s(.*)$", title)
-            address = address_match[1] if address_match else ""
-
             details = {
                 'id': int(flat_id),
                 'image': image,
@@ -78,7 +100,7 @@ class Immobiliare(Crawler):
                 'price': price,
                 'size': size,
                 'rooms': rooms,
-                'address': address,
+                'address': address_from_title(title),
                 'crawler': self.get_name()
             }
 
@@ -87,3 +109,38 @@ class Immobiliare(Crawler):
         logger.debug('Number of entries found: %d', len(entries))
 
         return entries
+
+    def extract_from_json(self, data):
+        """Extracts all exposes from the search state embedded in the page, with the
+           fields formatted like the listing cards show them"""
+        try:
+            results = search_results(data)
+        except (KeyError, TypeError):
+            return None
+        if results is None:
+            return None
+
+        entries = []
+        for result in results:
+            real_estate = result["realEstate"]
+            properties = (real_estate.get("properties") or [{}])[0]
+            title = real_estate["title"].strip()
+            rooms = re.match(r"(\d+)", str(properties.get("rooms") or ""))
+            size = re.match(r"(\d+) m²", str(properties.get("surface") or ""))
+            photo = properties.get("photo") or {}
+
+            entries.append({
+                'id': int(real_estate["id"]),
+                'image': photo.get("urls", {}).get("small", ""),
+                'url': result["seo"]["url"],
+                'title': title,
+                'price': parse_price(real_estate.get("price", {}).get("formattedValue", "")),
+                'size': size[1] if size else None,
+                'rooms': rooms[1] if rooms else None,
+                'address': address_from_title(title),
+                'crawler': self.get_name()
+            })
+
+        logger.debug('Number of entries found: %d', len(entries))
+
+        return entries
@@ -1,15 +1,26 @@
 """Expose crawler for ImmobilienScout"""
 import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, NamedTuple
 from urllib.parse import urlencode, urlparse, parse_qs
 
 import requests
 
 from flathunter.abstract_crawler import Crawler
 from flathunter.logging import logger
+from flathunter.pagination import IncrementalPagination
 from flathunter.schemas.immobilienscout import ImmoscoutQuery
+from flathunter.utils.urls import normalize_url
 
 STATIC_URL_PATTERN = re.compile(r'https://www\.immobilienscout24\.de')
 
+class CompiledQuery(NamedTuple):
+    """A validated search query, and the API URL for its pages, to be formatted with
+       the page number"""
+    query: ImmoscoutQuery
+    api_url: str
+
+
 class Immobilienscout(Crawler):
     """Implementation of Crawler interface for ImmobilienScout"""
 
@@ -27,6 +38,33 @@ class Immobilienscout(Crawler):
     FALLBACK_IMAGE_URL = "https://www.static-immobilienscout24.de/statpic/placeholder_house/" + \
                          "496c95154de31a357afa978cdb7f15f0_placeholder_medium.png"
 
+    def __init__(self, config):
+        super().__init__(config)
+        self.compiled_queries: Dict[str, CompiledQuery] = {}
+
+
+    def canonical_url(self, url: str) -> str:
+        """Search URLs are sorted newest first, and the tracking of the search form
+           is dropped"""
+        if not urlparse(url).path.startswith('/Suche/'):
+            return normalize_url(url)
+        return normalize_url(url, remove=['enteredFrom'], replace={'sorting': '2'})
+
+    def compile_query(self, search_url: str) -> CompiledQuery:
+        """The validated query for a search URL, and the API URL to fetch its pages
+           from. Both are built once per search URL and crawler; a reloaded config
+           creates new crawlers, and with them an empty cache"""
+        compiled = self.compiled_queries.get(search_url)
+        if compiled is None:
+            query = self.get_immoscout_query(search_url)
+            api_url = self.compose_api_url(query)
+            if '&pagenumber' in api_url:
+                api_url = re.sub(r"&pagenumber=[0-9]", "&pagenumber={0}", api_url)
+            else:
+                api_url = api_url + '&pagenumber={0}'
+            compiled = CompiledQuery(query, api_url)
+            self.compiled_queries[search_url] = compiled
+        return compiled
 
     def get_immoscout_query(self, search_url: str) -> ImmoscoutQuery:
         """Builds an Immoscout query from a web interface URL,
@@ -82,12 +120,13 @@ class Immobilienscout(Crawler):
             "supportedResultListType": [],
             "userData": {}
         }
-        response = requests.post(
-            search_url.format(page_no),
-            headers=self.HEADERS,
-            json=data,
-            timeout=30
-        )
+        with self.config.http_sessions().host_slot(search_url):
+            response = self.session.post(
+                search_url.format(page_no),
+                headers=self.HEADERS,
+                json=data,
+                timeout=30
+            )
         return response
 
     def extract_data(self, raw_data: dict) -> list:
@@ -129,32 +168,70 @@ class Immobilienscout(Crawler):
         logger.debug('Number of entries found: %d', len(entries))
         return entries
 
-    def get_results(self, search_url: str, max_pages: int | None = None) -> list:
-        """Fetches the exposes from the ImmoScout mobile API, starting at the provided URL"""
-        query = self.get_immoscout_query(search_url)
-        api_url = self.compose_api_url(query)
-        if '&pagenumber' in api_url:
-            api_url = re.sub(r"&pagenumber=[0-9]", "&pagenumber={0}", api_url)
-        else:
-            api_url = api_url + '&pagenumber={0}'
+    def get_results(self, search_url: str, max_pages: int | None = None,
+                    pagination: IncrementalPagination | None = None) -> list:
+        """Fetches the exposes from the ImmoScout mobile API, starting at the provided URL.
+           The number of pages is known from the first response; the remaining pages
+           are fetched in parallel, a batch of up to `http.max_requests_per_host` pages
+           at a time. If the results are sorted newest first, no more pages are
+           fetched once a page only holds known exposes"""
+        (query, api_url) = self.compile_query(search_url)
         logger.debug("Got search URL %s", api_url)
+        incremental = pagination is not None \
+            and query.sorting == ImmoscoutQuery.SORTING_MAP["2"]
 
-        page_no = 1
-        listings = self.fetch_api_data(api_url, page_no).json()
-
-        no_of_results = listings["totalResults"]
+        listings = self.fetch_api_data(api_url, 1).json()
+        page_count = self.page_count(listings, query, max_pages)
 
         # get data from first page
-        entries = self.extract_data(listings)
-
-        # iterate over all remaining pages
-        while len(entries) < min(no_of_results, self.RESULT_LIMIT) and \
-                (max_pages is None or page_no < max_pages):
+        pages = [self.extract_data(listings)]
+        entries = list(pages[0])
+        seen_ids = {entry['id'] for entry in entries}
+
+        # fetch the remaining pages in batches, merging them in page order
+        (pages_fetched, pages_saved) = (1, 0)
+        while pages_fetched < page_count:
+            if incremental and pagination is not None \
+                    and any(pagination.all_known(page) for page in pages):
+                pages_saved = page_count - pages_fetched
+                logger.debug('Page %d only holds known exposes, not fetching %d more',
+                             pages_fetched, pages_saved)
+                break
             logger.debug(
-                '(Next page) Number of entries: %d / Number of results: %d',
-                len(entries), no_of_results)
-            page_no += 1
-            listings = self.fetch_api_data(api_url, page_no).json()
-            cur_entries = self.extract_data(listings)
-            entries.extend(cur_entries)
+                '(Next pages) Number of entries: %d / Number of results: %d',
+                len(entries), listings["totalResults"])
+            page_numbers = range(pages_fetched + 1,
+                                 min(page_count, pages_fetched
+                                     + self.config.http_sessions().max_requests_per_host) + 1)
+            pages = self.fetch_pages(api_url, page_numbers)
+            pages_fetched = page_numbers[-1]
+            for page in pages:
+                # listings move between pages while they are fetched
+                entries.extend(entry for entry in page if entry['id'] not in seen_ids)
+                seen_ids.update(entry['id'] for entry in page)
+        if pagination is not None:
+            pagination.record(search_url, pages_fetched, pages_saved)
         return entries
+
+    def page_count(self, listings: dict, query: ImmoscoutQuery,
+                   max_pages: int | None = None) -> int:
+        """Number of pages to fetch for up to RESULT_LIMIT results, according to the
+           first page of results"""
+        expected_entries = min(listings["totalResults"], self.RESULT_LIMIT)
+        page_size = listings.get("pageSize") \
+            or len(listings.get("resultListItems") or []) or query.pagesize
+        page_count = -(-expected_entries // page_size)
+        if listings.get("numberOfPages"):
+            page_count = min(page_count, int(listings["numberOfPages"]))
+        if max_pages is not None:
+            page_count = min(page_count, max_pages)
+        return max(1, page_count)
+
+    def fetch_pages(self, api_url: str, page_numbers: range) -> list[list]:
+        """Fetches pages of results in parallel, and returns their exposes in page order"""
+        def fetch_page(page_no):
+            return self.extract_data(self.fetch_api_data(api_url, page_no).json())
+
+        with ThreadPoolExecutor(max_workers=len(page_numbers),
+                                thread_name_prefix='immoscout') as executor:
+            return list(executor.map(fetch_page, page_numbers))
@@ -4,19 +4,50 @@ import datetime
 import hashlib
 
 from bs4 import BeautifulSoup, Tag
+from lxml import etree
+from lxml.html import HtmlElement
 
 from flathunter.logging import logger
 from flathunter.abstract_crawler import Crawler
+from flathunter.utils.html import child_texts, first, has_class, text_of
+from flathunter.utils.urls import normalize_url
+
+# Compiled XPath expressions that find the same elements as the BeautifulSoup
+# calls in 'extract_data', for extracting exposes from an lxml tree
+CORE_LIST = etree.XPath("//div[@data-testid='serp-core-scrollablelistview-testid']")
+ADVERTISEMENTS = etree.XPath(f".//div[{has_class('css-79elbk')}]")
+TITLE = etree.XPath(f".//div[{has_class('css-1cbj9xw')}]")
+PRICE = etree.XPath(".//div[@data-testid='cardmfe-price-testid']")
+KEYFACTS = etree.XPath(".//div[@data-testid='cardmfe-keyfacts-testid']")
+LINK = etree.XPath(".//a")
+PICTURE = etree.XPath(".//img")
+ADDRESS = etree.XPath(".//div[@data-testid='cardmfe-description-box-address']")
+
+
+def optional_text(element: HtmlElement | None) -> str:
+    """The text of an element found in an expose, or an empty string if it is missing"""
+    return text_of(element) if element is not None else ""
+
 
 class Immowelt(Crawler):
     """Implementation of Crawler interface for ImmoWelt"""
 
     URL_PATTERN = re.compile(r'https://www\.immowelt\.de')
 
+    FAST_EXTRACTION = True
+
     def __init__(self, config):
         super().__init__(config)
         self.config = config
 
+    def canonical_url(self, url: str) -> str:
+        """Sorts the results newest first, in the current and in the legacy URL format"""
+        if '/classified-search' in url:
+            return normalize_url(url, replace={'order': 'DateDesc'})
+        if '/liste/' in url:
+            return normalize_url(url, replace={'sort': 'createdate+desc'})
+        return normalize_url(url)
+
     def get_expose_details(self, expose):
         """Loads additional details for an expose by processing the expose detail URL"""
         soup = self.get_page(expose['url'])
@@ -77,18 +108,6 @@ class Immowelt(Crawler):
             except AttributeError:
                 descriptions = []
 
-            size = list(filter(lambda x: "m²" in x, descriptions))
-            try:
-                size = size[0]
-            except IndexError:
-                size = ""
-
-            rooms = list(filter(lambda x: "Zimmer" in x, descriptions))
-            try:
-                rooms = rooms[0]
-            except IndexError:
-                rooms = ""
-
             id_element = adv.find("a")
             try:
                 url = id_element.get("href")
@@ -108,23 +127,53 @@ class Immowelt(Crawler):
                   ).text
             except AttributeError:
                 address = ""
-            ad_id = url.split('/')[-1]
-            processed_id = int(
-              hashlib.sha256(ad_id.encode('utf-8')).hexdigest(), 16
-            ) % 10**16
-
-            details = {
-                'id': processed_id,
-                'image': image,
-                'url': url,
-                'title': title.strip(),
-                'rooms': rooms,
-                'price': price,
-                'size': size,
-                'address': address,
-                'crawler': self.get_name()
-            }
-            entries.append(details)
+            entries.append(self.expose_details(url, image, title, descriptions, price, address))
 
         logger.debug('Number of entries found: %d', len(entries))
         return entries
+
+    def extract_from_tree(self, tree: HtmlElement):
+        """Extracts all exposes from an lxml tree of a results page"""
+        entries = []
+        core_list = first(CORE_LIST(tree))
+        if core_list is None:
+            return []
+        for adv in ADVERTISEMENTS(core_list):
+            id_element = first(LINK(adv))
+            url = id_element.get("href") if id_element is not None else None
+            if url is None:
+                continue
+            if "https" not in url:
+                url = "https://immowelt.de/" + url
+            keyfacts = first(KEYFACTS(adv))
+            descriptions = child_texts(keyfacts) if keyfacts is not None else []
+            picture = first(PICTURE(adv))
+            image = picture.get('src') if picture is not None else None
+            entries.append(self.expose_details(
+                url, image, optional_text(first(TITLE(adv))), descriptions,
+                optional_text(first(PRICE(adv))), optional_text(first(ADDRESS(adv)))))
+
+        logger.debug('Number of entries found: %d', len(entries))
+        return entries
+
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    def expose_details(self, url, image, title, descriptions, price, address):
+        """The expose details dictionary for the fields found in an advertisement"""
+        size = next(filter(lambda x: "m²" in x, descriptions), "")
+        rooms = next(filter(lambda x: "Zimmer" in x, descriptions), "")
+        ad_id = url.split('/')[-1]
+        processed_id = int(
+          hashlib.sha256(ad_id.encode('utf-8')).hexdigest(), 16
+        ) % 10**16
+
+        return {
+            'id': processed_id,
+            'image': image,
+            'url': url,
+            'title': title.strip(),
+            'rooms': rooms,
+            'price': price,
+            'size': size,
+            'address': address,
+            'crawler': self.get_name()
+        }
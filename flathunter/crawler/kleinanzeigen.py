@@ -6,6 +6,7 @@ from bs4 import Tag
 
 from flathunter.webdriver_crawler import WebdriverCrawler
 from flathunter.logging import logger
+from flathunter.utils.urls import normalize_url
 
 class Kleinanzeigen(WebdriverCrawler):
     """Implementation of Crawler interface for Kleinanzeigen"""
@@ -26,8 +27,12 @@ class Kleinanzeigen(WebdriverCrawler):
         "Dezember": "12"
     }
 
+    def canonical_url(self, url: str) -> str:
+        """Drops the sort order from the path, so that ads are sorted newest first"""
+        return normalize_url(re.sub(r'/sortierung:[^/?#]*', '', url))
+
     def get_expose_details(self, expose):
-        soup = self.get_page(expose['url'], self.get_driver())
+        soup = self.get_details_page(expose['url'])
         for detail in soup.find_all('li', {"class": "addetailslist--detail"}):
             if re.match(r'Verfügbar ab', detail.text):
                 date_string = re.match(r'(\w+) (\d{4})', detail.text)
@@ -10,19 +10,31 @@ class Subito(Crawler):
 
     URL_PATTERN = re.compile(r'https://www\.subito\.it')
 
+    EMBEDDED_JSON_ID = "__NEXT_DATA__"
+
     def __init__(self, config):
         super().__init__(config)
         self.config = config
 
-    # pylint: disable=too-many-locals
     def extract_data(self, raw_data):
         """Extracts all exposes from a provided Soup object"""
+        script = raw_data.find("script", {"id": self.EMBEDDED_JSON_ID})
+        if script is None:
+            logger.warning("No search state found in the page")
+            return []
+        return self.extract_from_json(json.loads(script.text.strip())) or []
+
+    # pylint: disable=too-many-locals
+    def extract_from_json(self, data):
+        """Extracts all exposes from the search state embedded in the page"""
         entries = []
 
         # as of today, subito provides a useful JSON that represents the state
         # of the search. Neat! We don't have to do much.
-        findings_json = raw_data.find("script", {"id": "__NEXT_DATA__"}).text.strip()
-        findings = json.loads(findings_json)["props"]["state"]["items"]["list"]
+        try:
+            findings = data["props"]["state"]["items"]["list"]
+        except (KeyError, TypeError):
+            return None
 
         for row in findings:
             row_id = row["item"]["urn"]
@@ -3,9 +3,28 @@ import re
 import hashlib
 
 from bs4 import BeautifulSoup
+from lxml import etree
+from lxml.html import HtmlElement
 
 from flathunter.logging import logger
 from flathunter.abstract_crawler import Crawler
+from flathunter.utils.html import first, has_class, text_of
+from flathunter.utils.urls import normalize_url
+
+# Compiled XPath expressions that find the same elements as the BeautifulSoup
+# calls in 'extract_data', for extracting exposes from an lxml tree
+ITEMS = etree.XPath(f"//div[{has_class('item-wrap js-serp-item')}]")
+TITLE_LINK = etree.XPath(f".//a[{has_class('js-item-title-link ci-search-result__link')}]")
+PRICE = etree.XPath(f".//div[{has_class('item__spec item-spec-price')}]")
+SIZE = etree.XPath(f".//div[{has_class('item__spec item-spec-area')}]")
+ROOMS = etree.XPath(f".//div[{has_class('item__spec item-spec-rooms')}]")
+IMAGE = etree.XPath(".//img")
+LOCALITY = etree.XPath(f".//div[{has_class('item__locality')}]")
+
+
+def optional_text(element: HtmlElement | None) -> str:
+    """The text of an element found in an expose, or an empty string if it is missing"""
+    return text_of(element) if element is not None else ""
 
 
 class VrmImmo(Crawler):
@@ -14,10 +33,16 @@ class VrmImmo(Crawler):
     BASE_URL = "https://vrm-immo.de"
     URL_PATTERN = re.compile(r'https://vrm-immo\.de')
 
+    FAST_EXTRACTION = True
+
     def __init__(self, config):
         super().__init__(config)
         self.config = config
 
+    def canonical_url(self, url: str) -> str:
+        """Sorts the results by update time, most recent first"""
+        return normalize_url(url, replace={'s': 'most_recently_updated_first'})
+
     # pylint: disable=too-many-locals
     def extract_data(self, raw_data: BeautifulSoup):
         """Extracts all exposes from a provided Soup object"""
@@ -56,21 +81,42 @@ class VrmImmo(Crawler):
             except (IndexError, AttributeError):
                 address = ""
 
-            processed_id = int(
-                hashlib.sha256(item.get("id").encode('utf-8')).hexdigest(), 16
-            ) % 10 ** 16
-
-            details = {
-                'id': processed_id,
-                'image': image,
-                'url': self.BASE_URL + url,
-                'title': title,
-                'rooms': rooms,
-                'price': price.strip(),
-                'size': size.strip(),
-                'address': address.strip(),
-                'crawler': self.get_name()
-            }
-            entries.append(details)
+            entries.append(self.expose_details(item.get("id"), url, title, image,
+                                               rooms, price, size, address))
+        logger.debug('Number of entries found: %d', len(entries))
+        return entries
+
+    def extract_from_tree(self, tree: HtmlElement):
+        """Extracts all exposes from an lxml tree of a results page"""
+        entries = []
+        for item in ITEMS(tree):
+            link = first(TITLE_LINK(item))
+            url = link.get("href")
+            logger.debug("Analyze %s", url)
+            image = first(IMAGE(item))
+            entries.append(self.expose_details(
+                item.get("id"), url, link.get("title"),
+                image.get("src", "") if image is not None else "",
+                optional_text(first(ROOMS(item))), optional_text(first(PRICE(item))),
+                optional_text(first(SIZE(item))), optional_text(first(LOCALITY(item)))))
         logger.debug('Number of entries found: %d', len(entries))
         return entries
+
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    def expose_details(self, item_id, url, title, image, rooms, price, size, address):
+        """The expose details dictionary for the fields found in a search result"""
+        processed_id = int(
+            hashlib.sha256(item_id.encode('utf-8')).hexdigest(), 16
+        ) % 10 ** 16
+
+        return {
+            'id': processed_id,
+            'image': image,
+            'url': self.BASE_URL + url,
+            'title': title,
+            'rooms': rooms,
+            'price': price.strip(),
+            'size': size.strip(),
+            'address': address.strip(),
+            'crawler': self.get_name()
+        }
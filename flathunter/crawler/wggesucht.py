@@ -4,9 +4,13 @@ from typing import Optional, List, Dict, Any, Union
 
 import requests
 from bs4 import BeautifulSoup, Tag
+from lxml import etree
+from lxml.html import HtmlElement
 
 from flathunter.logging import logger
 from flathunter.abstract_crawler import Crawler
+from flathunter.utils.html import first, has_class, text_of
+from flathunter.utils.urls import normalize_url
 
 
 def get_title(title_row: Tag) -> str:
@@ -21,7 +25,12 @@ def get_url(title_row: Tag) -> Optional[str]:
             or not a_element.has_attr('href') \
             or not isinstance(a_element.attrs['href'], str):
         return None
-    return 'https://www.wg-gesucht.de/' + a_element.attrs['href'].removeprefix("/")
+    return expose_url(a_element.attrs['href'])
+
+
+def expose_url(href: str) -> str:
+    """The absolute expose URL for the link in the expose title"""
+    return 'https://www.wg-gesucht.de/' + href.removeprefix("/")
 
 
 def extract_href_style(row: Tag) -> Optional[str]:
@@ -40,7 +49,11 @@ def extract_href_style(row: Tag) -> Optional[str]:
 
 def get_image_url(row: Tag) -> Optional[str]:
     """Parse the image url from the expose"""
-    href_style = extract_href_style(row)
+    return image_url_from_style(extract_href_style(row))
+
+
+def image_url_from_style(href_style: Optional[str]) -> Optional[str]:
+    """Parse the image url from the style attribute of the image link"""
     if href_style is None:
         return None
     image_match = re.match(r'background-image: url\((.*)\);', href_style)
@@ -54,7 +67,12 @@ def get_rooms(row: Tag) -> str:
     details_el = row.find("div", {"class": "col-xs-11"})
     if not isinstance(details_el, Tag):
         return ""
-    detail_string = details_el.text.strip().split("|")
+    return rooms_from_details(details_el.text)
+
+
+def rooms_from_details(details: str) -> str:
+    """Parse the number of rooms from the details line of the expose"""
+    detail_string = details.strip().split("|")
     details_array = list(map(lambda s: re.sub(' +', ' ',
                                               re.sub(r'\W', ' ', s.strip())),
                              detail_string))
@@ -75,7 +93,12 @@ def get_dates(numbers_row: Tag) -> List[str]:
     date_el = numbers_row.find("div", {"class": "text-center"})
     if not isinstance(date_el, Tag):
         return []
-    return re.findall(r'\d{2}.\d{2}.\d{4}', date_el.text)
+    return find_dates(date_el.text)
+
+
+def find_dates(text: str) -> List[str]:
+    """The dates in the text of the expose dates element"""
+    return re.findall(r'\d{2}.\d{2}.\d{4}', text)
 
 
 def get_size(numbers_row: Tag) -> List[str]:
@@ -83,7 +106,12 @@ def get_size(numbers_row: Tag) -> List[str]:
     size_el = numbers_row.find("div", {"class": "text-right"})
     if not isinstance(size_el, Tag):
         return []
-    return re.findall(r'\d{1,4}\sm²', size_el.text)
+    return find_sizes(size_el.text)
+
+
+def find_sizes(text: str) -> List[str]:
+    """The room sizes in the text of the expose size element"""
+    return re.findall(r'\d{1,4}\sm²', text)
 
 def is_verified_company(row: Tag) -> bool:
     """Filter out ads from 'Verified Companies'"""
@@ -122,7 +150,13 @@ def parse_expose_element_to_details(row: Tag, crawler: str) -> Optional[Dict]:
     if len(size) == 0:
         logger.warning("No size found - skipping")
         return None
+    return expose_details(url, title, image, rooms, price, dates, size[0], crawler)
+
 
+# pylint: disable=too-many-arguments,too-many-positional-arguments
+def expose_details(url: str, title: str, image: Optional[str], rooms: str,
+                   price: Optional[str], dates: List[str], size: str, crawler: str) -> Dict:
+    """The expose details dictionary for the fields parsed from an expose element"""
     if len(dates) == 2:
         title = f"{title} vom {dates[0]} bis {dates[1]}"
     else:
@@ -134,7 +168,7 @@ def parse_expose_element_to_details(row: Tag, crawler: str) -> Optional[Dict]:
         'url': url,
         'title': title,
         'price': price,
-        'size': size[0],
+        'size': size,
         'rooms': rooms,
         'address': url,
         'crawler': crawler
@@ -147,6 +181,73 @@ def parse_expose_element_to_details(row: Tag, crawler: str) -> Optional[Dict]:
     return details
 
 
+# Compiled XPath expressions that find the same elements as the BeautifulSoup
+# calls above, for extracting exposes from an lxml tree
+LISTE_ROWS = etree.XPath(
+    f"//*[starts-with(@id, 'liste-')][@class][not({has_class('display-none')})]"
+    f"[parent::*[@class][not({has_class('premium_user_extra_list')})]]")
+TITLE_ROW = etree.XPath(f".//h2[{has_class('truncate_title')}]")
+VERIFIED_LABEL = etree.XPath(f".//span[{has_class('label_verified')}]")
+LINK = etree.XPath(".//a")
+IMAGE_DIV = etree.XPath(f".//div[{has_class('card_image')}]")
+DETAILS_DIV = etree.XPath(f".//div[{has_class('col-xs-11')}]")
+NUMBERS_ROW = etree.XPath(f".//div[{has_class('middle')}]")
+PRICE_DIV = etree.XPath(f".//div[{has_class('col-xs-3')}]")
+DATES_DIV = etree.XPath(f".//div[{has_class('text-center')}]")
+SIZE_DIV = etree.XPath(f".//div[{has_class('text-right')}]")
+
+
+# pylint: disable=too-many-return-statements,too-many-locals
+def parse_expose_tree_to_details(row: HtmlElement, crawler: str) -> Optional[Dict]:
+    """Parse an expose element of an lxml tree to an Expose details dictionary,
+       like parse_expose_element_to_details"""
+    title_row = first(TITLE_ROW(row))
+    if title_row is None:
+        logger.warning("No title found - skipping")
+        return None
+    if len(VERIFIED_LABEL(row)) > 0:
+        logger.warning("Advert found - skipping")
+        return None
+    title = text_of(title_row).strip()
+    link = first(LINK(title_row))
+    if link is None or link.get('href') is None:
+        logger.warning("No expose URL found - skipping")
+        return None
+    url = expose_url(link.get('href'))
+    image_div = first(IMAGE_DIV(row))
+    image_link = first(LINK(image_div)) if image_div is not None else None
+    image = image_url_from_style(image_link.get('style') if image_link is not None else None)
+    details_div = first(DETAILS_DIV(row))
+    rooms = rooms_from_details(text_of(details_div)) if details_div is not None else ""
+    numbers_row = first(NUMBERS_ROW(row))
+    if numbers_row is None:
+        logger.warning("No numbers row found - skipping")
+        return None
+    price_div = first(PRICE_DIV(numbers_row))
+    price = text_of(price_div).strip() if price_div is not None else None
+    dates_div = first(DATES_DIV(numbers_row))
+    dates = find_dates(text_of(dates_div)) if dates_div is not None else []
+    if len(dates) == 0:
+        logger.warning("No dates found - skipping")
+        return None
+    size_div = first(SIZE_DIV(numbers_row))
+    size = find_sizes(text_of(size_div)) if size_div is not None else []
+    if len(size) == 0:
+        logger.warning("No size found - skipping")
+        return None
+    return expose_details(url, title, image, rooms, price, dates, size[0], crawler)
+
+
+def is_liste_row(element: HtmlElement) -> bool:
+    """True for the expose elements of an lxml tree that LISTE_ROWS finds"""
+    css_class = element.get('class')
+    parent = element.getparent()
+    parent_class = parent.get('class') if parent is not None else None
+    return element.get('id', '').startswith('liste-') \
+        and css_class is not None and 'display-none' not in css_class.split() \
+        and parent_class is not None and 'premium_user_extra_list' not in parent_class.split()
+
+
 def liste_attribute_filter(element: Union[Tag, str]) -> bool:
     """Return true for elements whose 'id' attribute starts with 'liste-' 
     and are not contained in the 'premium_user_extra_list' container"""
@@ -165,10 +266,17 @@ class WgGesucht(Crawler):
 
     URL_PATTERN = re.compile(r'https://www\.wg-gesucht\.de')
 
+    FAST_EXTRACTION = True
+    STREAMING_EXTRACTION = True
+
     def __init__(self, config):
         super().__init__(config)
         self.config = config
 
+    def canonical_url(self, url: str) -> str:
+        """Drops the sort order, so that offers are sorted by date, newest first"""
+        return normalize_url(url, remove=['sort_column', 'sort_order'])
+
     # pylint: disable=too-many-locals
     def extract_data(self, raw_data: BeautifulSoup) -> List[Dict]:
         """Extracts all exposes from a provided Soup object"""
@@ -189,6 +297,24 @@ class WgGesucht(Crawler):
 
         return entries
 
+    def extract_from_tree(self, tree: HtmlElement) -> List[Dict]:
+        """Extracts all exposes from an lxml tree of a results page"""
+        entries = []
+        for row in LISTE_ROWS(tree):
+            details = parse_expose_tree_to_details(row, self.get_name())
+            if details is not None:
+                entries.append(details)
+        logger.debug('Number of entries found: %d', len(entries))
+        return entries
+
+    def is_result_card(self, element: HtmlElement) -> bool:
+        """True for the elements of a results page that hold an expose"""
+        return is_liste_row(element)
+
+    def extract_from_card(self, card: HtmlElement) -> Optional[Dict]:
+        """Extracts the expose from an element of a results page"""
+        return parse_expose_tree_to_details(card, self.get_name())
+
     def load_address(self, url) -> Optional[str]:
         """Extract address from expose itself"""
         response = self.get_soup_from_url(url)
@@ -211,27 +337,40 @@ class WgGesucht(Crawler):
         """
         Creates a Soup object from the HTML at the provided URL
 
+        Overwrites the method inherited from abstract_crawler, so that the
+        page is loaded twice (see get_html).
+        """
+        if driver is not None and not self.config.use_proxy():
+            return self.get_soup_from_driver(driver, url, checkbox, afterlogin_string)
+        return BeautifulSoup(self.get_html(url), 'lxml')
+
+    def get_html(self, url: str) -> bytes:
+        """
+        Fetches the HTML at the provided URL
+
         Overwrites the method inherited from abstract_crawler. This is
         necessary as we need to reload the page once for all filters to
         be applied correctly on wg-gesucht.
         """
-        sess = requests.session()
+        resp = self.load_with_filters(url)
+        if self.config.use_proxy():
+            return self.get_html_with_proxy(url)
+        return resp.content
+
+    def get_html_stream(self, url: str) -> requests.Response:
+        """Requests the HTML at the provided URL, without reading the response body.
+        Like get_html, the page is loaded twice"""
+        return self.load_with_filters(url, stream=True)
+
+    def load_with_filters(self, url: str, stream: bool = False) -> requests.Response:
+        """Loads the page twice, so that the filters of the search are applied"""
+        # Fresh cookie jar for the filter reload, sharing the pooled connections
+        sess = self.config.http_sessions().new_session()
         # First page load to set filters; response is discarded
-        sess.get(url, headers=self.HEADERS)
+        sess.get(url, headers=self.HEADERS, timeout=30)
         # Second page load
-        resp = sess.get(url, headers=self.HEADERS)
+        resp = sess.get(url, headers=self.HEADERS, timeout=30, stream=stream)
 
         if resp.status_code not in (200, 405):
-            logger.error("Got response (%i): %s",
-                         resp.status_code, resp.content)
-        if self.config.use_proxy():
-            return self.get_soup_with_proxy(url)
-        if driver is not None:
-            driver.get(url)
-            if re.search("initGeetest", driver.page_source):
-                self.resolve_geetest(driver)
-            elif re.search("g-recaptcha", driver.page_source):
-                self.resolve_recaptcha(
-                    driver, checkbox, afterlogin_string or "")
-            return BeautifulSoup(driver.page_source, 'lxml')
-        return BeautifulSoup(resp.content, 'lxml')
+            logger.error("Got response (%i) for %s", resp.status_code, url)
+        return resp
@@ -0,0 +1,77 @@
+"""Routing of URLs to the crawlers that handle them"""
+import re
+import threading
+import time
+from typing import Dict, List, NamedTuple, Optional, TYPE_CHECKING
+from urllib.parse import urlsplit
+
+from flathunter.logging import logger
+
+if TYPE_CHECKING:
+    from flathunter.abstract_crawler import Crawler
+
+
+class DispatchStats(NamedTuple):
+    """Number of URLs dispatched, and the CPU time spent on it"""
+    dispatches: int
+    seconds: float
+
+
+class CrawlerRouter:
+    """Maps URLs to the crawlers whose URL_PATTERN matches them, keyed by scheme and
+       hostname. The crawlers for a host are found by matching the URL patterns once,
+       when the host is first seen; after that, dispatching a URL is a dict lookup,
+       and a check of the patterns of those crawlers against the full URL. URLs that
+       a crawler of their host does not handle, or that only match a pattern beyond
+       the hostname, fall back to matching every pattern against the full URL"""
+
+    def __init__(self, searchers: List['Crawler']):
+        self.searchers = list(searchers)
+        self.by_host: Dict[str, List['Crawler']] = {}
+        self.lock = threading.Lock()
+        self.dispatches = 0
+        self.seconds = 0.0
+        self.last_totals = (0, 0.0)
+
+    def crawlers_for(self, url: str) -> List['Crawler']:
+        """All crawlers that handle the URL, in the order of the search plugins"""
+        start = time.thread_time()
+        parts = urlsplit(url)
+        host = f"{parts.scheme}://{parts.netloc.lower()}"
+        if parts.netloc:
+            # the URL with its hostname in lower case, as in the route keys
+            url = host + url[len(host):]
+        crawlers = self.by_host.get(host)
+        if crawlers is None:
+            crawlers = [searcher for searcher in self.searchers
+                        if re.search(searcher.URL_PATTERN, host + '/')]
+            self.by_host[host] = crawlers
+        if len(crawlers) == 0 \
+                or not all(re.search(searcher.URL_PATTERN, url) for searcher in crawlers):
+            # another crawler on the same host may handle this path
+            crawlers = [searcher for searcher in self.searchers
+                        if re.search(searcher.URL_PATTERN, url)]
+        elapsed = time.thread_time() - start
+        with self.lock:
+            self.dispatches += 1
+            self.seconds += elapsed
+        return crawlers
+
+    def crawler_for(self, url: str) -> Optional['Crawler']:
+        """The first crawler that handles the URL, if any"""
+        crawlers = self.crawlers_for(url)
+        return crawlers[0] if crawlers else None
+
+    def cycle_stats(self) -> DispatchStats:
+        """Number of URLs dispatched, and the CPU seconds spent, since the previous call"""
+        with self.lock:
+            (last_dispatches, last_seconds) = self.last_totals
+            self.last_totals = (self.dispatches, self.seconds)
+            return DispatchStats(dispatches=self.dispatches - last_dispatches,
+                                 seconds=self.seconds - last_seconds)
+
+    def log_cycle_stats(self):
+        """Log the dispatch statistics since the previous call"""
+        stats = self.cycle_stats()
+        logger.info("Crawler dispatch: %d URLs in %.2f ms CPU time",
+                    stats.dispatches, stats.seconds * 1000)
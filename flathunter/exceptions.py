@@ -19,6 +19,11 @@ class UserDeactivatedException(ValueException):
     A small class that defines a UserDeactivated Exception.
     """
 
+class NotificationFailedException(ValueException):
+    """
+    A notifier could not deliver a message, and it should be sent again later
+    """
+
 class HeartbeatException(ValueException):
     """
     A small class that defines a Heartbeat Exception.
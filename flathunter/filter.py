@@ -1,17 +1,54 @@
 """Module with implementations of standard expose filters"""
-from functools import reduce
 import re
+import time
 from abc import ABC, ABCMeta
-from typing import List, Any
+from typing import List, Dict, Any, Optional, Set, Tuple, Iterable, Iterator
+
+from flathunter.utils.batches import BatchedIterator
 
 
 class AbstractFilter(ABC):
     """Abstract base class for filters"""
 
+    # Filters with side effects, or that are expensive regardless of how many exposes
+    # they reject, run after all other filters, in the order they were added
+    RUN_LAST = False
+
     def is_interesting(self, _expose) -> bool:
         """Return True if an expose should be included in the output, False otherwise"""
         return True
 
+    def is_interesting_record(self, record: 'ExposeRecord') -> bool:
+        """Same as is_interesting, for an expose whose numeric fields have already been
+           parsed. Filters on the numeric fields should override this"""
+        return self.is_interesting(record.expose)
+
+    def filter_interesting(self, records: List['ExposeRecord']) -> List['ExposeRecord']:
+        """Return the exposes of a batch that should be included in the output. Filters
+           that can check a whole batch more cheaply than one expose at a time
+           should override this"""
+        return [record for record in records if self.is_interesting_record(record)]
+
+    def sql_condition(self) -> Optional[Tuple[str, List]]:
+        """Return an equivalent SQL condition on the numeric 'price', 'size' and 'rooms'
+           columns of stored exposes, with its parameters, or None if the filter can
+           only be applied in Python"""
+        return None
+
+
+NUMBER_PATTERN = re.compile(r'\d+([\.,]\d+)?')
+
+def parse_number(text: str, thousands_separator: bool = False) -> Optional[float]:
+    """Extracts the first number from a text. With thousands_separator, a '.' in the
+       number separates thousands instead of decimals"""
+    match = NUMBER_PATTERN.search(text)
+    if match is None:
+        return None
+    number = match[0]
+    if thousands_separator:
+        number = number.replace(".", "")
+    return float(number.replace(",", "."))
+
 
 class ExposeHelper:
     """Helper functions for extracting data from expose text"""
@@ -19,40 +56,98 @@ class ExposeHelper:
     @staticmethod
     def get_price(expose):
         """Extracts the price from a price text"""
-        price_match = re.search(r'\d+([\.,]\d+)?', expose['price'])
-        if price_match is None:
-            return None
-        return float(price_match[0].replace(".", "").replace(",", "."))
+        return parse_number(expose['price'], thousands_separator=True)
 
     @staticmethod
     def get_size(expose):
         """Extracts the size from a size text"""
-        size_match = re.search(r'\d+([\.,]\d+)?', expose['size'])
-        if size_match is None:
-            return None
-        return float(size_match[0].replace(",", "."))
+        return parse_number(expose['size'])
 
     @staticmethod
     def get_rooms(expose):
         """Extracts the number of rooms from a room text"""
-        rooms_match = re.search(r'\d+([\.,]\d+)?', expose['rooms'])
-        if rooms_match is None:
-            return None
-        return float(rooms_match[0].replace(",", "."))
+        return parse_number(expose['rooms'])
+
+
+class ExposeRecord:
+    """An expose with its numeric fields parsed, so that the filters do not each have
+       to parse the expose text again. Fields that are missing or cannot be parsed
+       are None"""
+    __slots__ = ('expose', 'price', 'size', 'rooms')
+
+    def __init__(self, expose: Dict, price: Optional[float],
+                 size: Optional[float], rooms: Optional[float]):
+        self.expose = expose
+        self.price = price
+        self.size = size
+        self.rooms = rooms
+
+    @classmethod
+    def from_expose(cls, expose: Dict) -> 'ExposeRecord':
+        """Parses the numeric fields of an expose"""
+        price = expose.get('price')
+        size = expose.get('size')
+        rooms = expose.get('rooms')
+        return cls(expose,
+                   parse_number(price, thousands_separator=True)
+                   if isinstance(price, str) else None,
+                   parse_number(size) if isinstance(size, str) else None,
+                   parse_number(rooms) if isinstance(rooms, str) else None)
 
 
 class AlreadySeenFilter(AbstractFilter):
-    """Filter exposes that have already been processed"""
+    """Filter exposes that have already been processed. If mark_processed is False,
+       the exposes that pass are not marked as processed in the database - that is
+       left to a later step, such as queueing their notifications - and are only
+       remembered for the lifetime of the filter"""
+
+    # Queries the database, and marks the exposes that pass as processed
+    RUN_LAST = True
 
-    def __init__(self, id_watch):
+    def __init__(self, id_watch, mark_processed=True):
         self.id_watch = id_watch
+        self.mark_processed = mark_processed
+        self.seen: Set[Tuple[str, Any]] = set()
 
     def is_interesting(self, expose):
         """Returns true if an expose should be kept in the pipeline"""
-        if not self.id_watch.is_processed(expose['id']):
-            self.id_watch.mark_processed(expose['id'])
-            return True
-        return False
+        crawler = expose.get('crawler', '')
+        if (crawler, expose['id']) in self.seen \
+                or self.id_watch.is_processed(expose['id'], crawler):
+            return False
+        if self.mark_processed:
+            self.id_watch.mark_processed(expose['id'], crawler)
+        else:
+            self.seen.add((crawler, expose['id']))
+        return True
+
+    def filter_interesting(self, records):
+        """Look up a whole batch of exposes with one query per crawler, and mark
+           the new ones as processed in a single transaction per crawler"""
+        ids_by_crawler: Dict[str, List] = {}
+        for record in records:
+            ids_by_crawler.setdefault(record.expose.get('crawler', ''), []) \
+                          .append(record.expose['id'])
+        unprocessed = set()
+        for crawler, expose_ids in ids_by_crawler.items():
+            unprocessed.update((crawler, expose_id) for expose_id
+                               in self.id_watch.filter_unprocessed(expose_ids, crawler))
+        result = []
+        new_ids_by_crawler: Dict[str, List] = {crawler: [] for crawler in ids_by_crawler}
+        for record in records:
+            key = (record.expose.get('crawler', ''), record.expose['id'])
+            if key in unprocessed and key not in self.seen:
+                # only keep the first of several exposes with the same ID
+                unprocessed.remove(key)
+                result.append(record)
+                new_ids_by_crawler[key[0]].append(key[1])
+        if not self.mark_processed:
+            self.seen.update((crawler, expose_id) for crawler, expose_ids
+                             in new_ids_by_crawler.items() for expose_id in expose_ids)
+            return result
+        for crawler, expose_ids in new_ids_by_crawler.items():
+            self.id_watch.mark_processed_many(expose_ids, crawler)
+        return result
 
 
 class MaxPriceFilter(AbstractFilter):
@@ -63,10 +158,15 @@ class MaxPriceFilter(AbstractFilter):
 
     def is_interesting(self, expose):
         """True if expose is below the max price"""
-        price = ExposeHelper.get_price(expose)
-        if price is None:
-            return True
-        return price <= self.max_price
+        return self.is_interesting_record(ExposeRecord.from_expose(expose))
+
+    def is_interesting_record(self, record):
+        """True if expose is below the max price"""
+        return record.price is None or record.price <= self.max_price
+
+    def sql_condition(self):
+        """Matches the same exposes as is_interesting"""
+        return ('(price IS NULL OR price <= ?)', [self.max_price])
 
 
 class MinPriceFilter(AbstractFilter):
@@ -77,10 +177,15 @@ class MinPriceFilter(AbstractFilter):
 
     def is_interesting(self, expose):
         """True if expose is above the min price"""
-        price = ExposeHelper.get_price(expose)
-        if price is None:
-            return True
-        return price >= self.min_price
+        return self.is_interesting_record(ExposeRecord.from_expose(expose))
+
+    def is_interesting_record(self, record):
+        """True if expose is above the min price"""
+        return record.price is None or record.price >= self.min_price
+
+    def sql_condition(self):
+        """Matches the same exposes as is_interesting"""
+        return ('(price IS NULL OR price >= ?)', [self.min_price])
 
 
 class MaxSizeFilter(AbstractFilter):
@@ -91,10 +196,15 @@ class MaxSizeFilter(AbstractFilter):
 
     def is_interesting(self, expose):
         """True if expose is below the max size"""
-        size = ExposeHelper.get_size(expose)
-        if size is None:
-            return True
-        return size <= self.max_size
+        return self.is_interesting_record(ExposeRecord.from_expose(expose))
+
+    def is_interesting_record(self, record):
+        """True if expose is below the max size"""
+        return record.size is None or record.size <= self.max_size
+
+    def sql_condition(self):
+        """Matches the same exposes as is_interesting"""
+        return ('(size IS NULL OR size <= ?)', [self.max_size])
 
 
 class MinSizeFilter(AbstractFilter):
@@ -105,10 +215,15 @@ class MinSizeFilter(AbstractFilter):
 
     def is_interesting(self, expose):
         """True if expose is above the min size"""
-        size = ExposeHelper.get_size(expose)
-        if size is None:
-            return True
-        return size >= self.min_size
+        return self.is_interesting_record(ExposeRecord.from_expose(expose))
+
+    def is_interesting_record(self, record):
+        """True if expose is above the min size"""
+        return record.size is None or record.size >= self.min_size
+
+    def sql_condition(self):
+        """Matches the same exposes as is_interesting"""
+        return ('(size IS NULL OR size >= ?)', [self.min_size])
 
 
 class MaxRoomsFilter(AbstractFilter):
@@ -119,10 +234,15 @@ class MaxRoomsFilter(AbstractFilter):
 
     def is_interesting(self, expose):
         """True if expose is below the max number of rooms"""
-        rooms = ExposeHelper.get_rooms(expose)
-        if rooms is None:
-            return True
-        return rooms <= self.max_rooms
+        return self.is_interesting_record(ExposeRecord.from_expose(expose))
+
+    def is_interesting_record(self, record):
+        """True if expose is below the max number of rooms"""
+        return record.rooms is None or record.rooms <= self.max_rooms
+
+    def sql_condition(self):
+        """Matches the same exposes as is_interesting"""
+        return ('(rooms IS NULL OR rooms <= ?)', [self.max_rooms])
 
 
 class MinRoomsFilter(AbstractFilter):
@@ -133,10 +253,15 @@ class MinRoomsFilter(AbstractFilter):
 
     def is_interesting(self, expose):
         """True if expose is above the min number of rooms"""
-        rooms = ExposeHelper.get_rooms(expose)
-        if rooms is None:
-            return True
-        return rooms >= self.min_rooms
+        return self.is_interesting_record(ExposeRecord.from_expose(expose))
+
+    def is_interesting_record(self, record):
+        """True if expose is above the min number of rooms"""
+        return record.rooms is None or record.rooms >= self.min_rooms
+
+    def sql_condition(self):
+        """Matches the same exposes as is_interesting"""
+        return ('(rooms IS NULL OR rooms >= ?)', [self.min_rooms])
 
 
 class TitleFilter(AbstractFilter):
@@ -144,16 +269,13 @@ class TitleFilter(AbstractFilter):
 
     def __init__(self, filtered_titles):
         self.filtered_titles = filtered_titles
+        self.pattern = re.compile(
+            "(" + ")|(".join(self.filtered_titles) + ")", re.IGNORECASE)
 
     def is_interesting(self, expose):
         """True unless title matches the filtered titles"""
-        combined_excludes = "(" + ")|(".join(self.filtered_titles) + ")"
-        found_objects = re.search(
-            combined_excludes, expose['title'], re.IGNORECASE)
         # send all non matching regex patterns
-        if not found_objects:
-            return True
-        return False
+        return self.pattern.search(expose['title']) is None
 
 
 class PPSFilter(AbstractFilter):
@@ -164,13 +286,20 @@ class PPSFilter(AbstractFilter):
 
     def is_interesting(self, expose):
         """True if price per square is below max price per square"""
-        size = ExposeHelper.get_size(expose)
-        price = ExposeHelper.get_price(expose)
-        if size is None or price is None:
+        return self.is_interesting_record(ExposeRecord.from_expose(expose))
+
+    def is_interesting_record(self, record):
+        """True if price per square is below max price per square"""
+        if not record.size or record.price is None:
             return True
-        pps = price / size
+        pps = record.price / record.size
         return pps <= self.max_pps
 
+    def sql_condition(self):
+        """Matches the same exposes as is_interesting"""
+        return ('(price IS NULL OR size IS NULL OR size = 0 OR price / size <= ?)',
+                [self.max_pps])
+
 
 class FilterBuilder:
     """Construct a filter chain"""
@@ -198,9 +327,9 @@ class FilterBuilder:
             PPSFilter, config.max_price_per_square())
         return self
 
-    def filter_already_seen(self, id_watch):
+    def filter_already_seen(self, id_watch, mark_processed=True):
         """Filter exposes that have already been seen"""
-        self.filters.append(AlreadySeenFilter(id_watch))
+        self.filters.append(AlreadySeenFilter(id_watch, mark_processed))
         return self
 
     def build(self):
@@ -208,22 +337,101 @@ class FilterBuilder:
         return Filter(self.filters)
 
 
+class FilterStats:
+    """Measured cost and rejection rate of a filter"""
+    __slots__ = ('seconds', 'checked', 'rejected')
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.checked = 0
+        self.rejected = 0
+
+    def add(self, seconds: float, checked: int, passed: int):
+        """Record a run of the filter over a batch of exposes"""
+        self.seconds += seconds
+        self.checked += checked
+        self.rejected += checked - passed
+
+    def rank(self) -> float:
+        """Cost per expose divided by the rejection rate. Running filters in ascending
+           order of rank minimises the expected time spent on each expose"""
+        if self.checked == 0:
+            return 0.0
+        rejection_rate = (self.rejected + 1) / (self.checked + 2)
+        return self.seconds / self.checked / rejection_rate
+
+
 class Filter:
-    """Abstract filter object"""
+    """Abstract filter object. Filters are applied in order of their measured cost
+       per rejected expose, cheapest first, and stop at the first filter that rejects
+       an expose. Filters marked RUN_LAST always run after all others"""
 
     filters: List[AbstractFilter]
 
+    # Number of exposes that are passed through the filters at once
+    BATCH_SIZE = 50
+
     def __init__(self, filters: List[AbstractFilter]):
-        self.filters = filters
+        self.reorderable = [f for f in filters if not f.RUN_LAST]
+        self.run_last = [f for f in filters if f.RUN_LAST]
+        self.filters = self.reorderable + self.run_last
+        self.stats = {expose_filter: FilterStats() for expose_filter in self.reorderable}
 
     def is_interesting_expose(self, expose):
         """Apply all filters to this expose"""
-        return reduce((lambda x, y: x and y),
-                      map((lambda x: x.is_interesting(expose)), self.filters), True)
-
-    def filter(self, exposes):
-        """Apply all filters to every expose in the list"""
-        return filter(self.is_interesting_expose, exposes)
+        record = ExposeRecord.from_expose(expose)
+        return all(expose_filter.is_interesting_record(record)
+                   for expose_filter in self.filters)
+
+    def reorder(self):
+        """Sort the filters by their measured rank"""
+        self.reorderable.sort(key=lambda expose_filter: self.stats[expose_filter].rank())
+        self.filters = self.reorderable + self.run_last
+
+    def sql_conditions(self) -> Tuple[str, List, 'Filter']:
+        """Translate the filters into a SQL WHERE condition on the numeric columns of
+           stored exposes. Returns the condition and its parameters, and a Filter with
+           the filters that cannot be expressed in SQL and still need to be applied
+           to the loaded exposes"""
+        conditions = []
+        parameters = []
+        remaining = []
+        for expose_filter in self.filters:
+            condition = expose_filter.sql_condition()
+            if condition is None:
+                remaining.append(expose_filter)
+            else:
+                conditions.append(condition[0])
+                parameters.extend(condition[1])
+        return (' AND '.join(conditions) or '1', parameters, Filter(remaining))
+
+    def filter(self, exposes) -> Iterator[Dict]:
+        """Apply all filters to every expose in the sequence"""
+        return BatchedIterator(exposes, self.BATCH_SIZE, lambda batch: self.filter_batch(
+            [ExposeRecord.from_expose(expose) for expose in batch]))
+
+    def filter_records(self, records: Iterable[ExposeRecord]) -> Iterator[Dict]:
+        """Apply all filters to a sequence of parsed exposes, and return the exposes
+           that pass. Records are consumed in batches of up to BATCH_SIZE"""
+        return BatchedIterator(records, self.BATCH_SIZE, self.filter_batch)
+
+    def filter_batch(self, batch: List[ExposeRecord]) -> List[Dict]:
+        """Apply all filters to a batch of parsed exposes, and return the exposes that
+           pass. Each filter is applied to the records that passed the previous ones"""
+        for expose_filter in self.reorderable:
+            if len(batch) == 0:
+                break
+            start = time.perf_counter()
+            passed = expose_filter.filter_interesting(batch)
+            self.stats[expose_filter].add(
+                time.perf_counter() - start, len(batch), len(passed))
+            batch = passed
+        for expose_filter in self.run_last:
+            if len(batch) == 0:
+                break
+            batch = expose_filter.filter_interesting(batch)
+        self.reorder()
+        return [record.expose for record in batch]
 
     @staticmethod
     def builder():
@@ -1,78 +1,216 @@
 """Calculate Google-Maps distances between specific locations and the target flat"""
 import datetime
 import time
+from typing import Dict, Iterable, List, Tuple
 from urllib.parse import quote_plus
-import requests
 
 from flathunter.logging import logger
 from flathunter.abstract_processor import Processor
+from flathunter.utils.batches import BatchedIterator
+from flathunter.utils.list import chunk_list
+
+def normalize_address(address: str) -> str:
+    """Normalize an address for comparison: case and whitespace are ignored"""
+    return ' '.join(address.casefold().split())
+
+class DurationCache:
+    """Cache of Google Maps results in the database of the id maintainer, keyed by
+       origin, destination, mode and arrival time. Counts cache hits and misses"""
+
+    def __init__(self, id_watch, ttl: datetime.timedelta, max_entries: int):
+        self.id_watch = id_watch
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(origin: str, dest: str, mode: str, arrival: datetime.datetime) -> str:
+        """The cache key of a route. Arrival times are bucketed by weekday and hour"""
+        return '|'.join([normalize_address(origin), normalize_address(dest), mode,
+                         arrival.strftime('%a %H')])
+
+    def get(self, keys: Iterable[str]) -> Dict[str, str]:
+        """Look up the results for the keys. Returns the ones found, by key"""
+        keys = set(keys)
+        found = self.id_watch.get_cached_durations(
+            list(keys), datetime.datetime.now() - self.ttl)
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def put(self, results: Dict[str, str]):
+        """Cache results, by key"""
+        if len(results) > 0:
+            self.id_watch.cache_durations(
+                results, datetime.datetime.now() - self.ttl, self.max_entries)
 
 class GMapsDurationProcessor(Processor):
-    """Implementation of Processor class to calculate travel durations"""
+    """Implementation of Processor class to calculate travel durations. The durations
+       of a batch of exposes are requested together, with one Distance Matrix request
+       per mode for up to MAX_ORIGINS addresses and MAX_DESTINATIONS destinations.
+       Results are cached if an id maintainer is given to store them"""
 
     GM_MODE_TRANSIT = 'transit'
     GM_MODE_BICYCLE = 'bicycling'
     GM_MODE_DRIVING = 'driving'
 
-    def __init__(self, config):
+    # Limits of the Distance Matrix API per request
+    MAX_ORIGINS = 25
+    MAX_DESTINATIONS = 25
+    MAX_ELEMENTS = 100
+
+    # Number of exposes whose durations are requested together
+    BATCH_SIZE = 50
+
+    def __init__(self, config, id_watch=None):
         self.config = config
+        self.cache = None
+        ttl_days = config.gmaps_cache_ttl_days()
+        if id_watch is not None and ttl_days > 0:
+            self.cache = DurationCache(id_watch, datetime.timedelta(days=ttl_days),
+                                       config.gmaps_cache_max_entries())
 
     def process_expose(self, expose):
         """Calculate the durations for an expose"""
         expose['durations'] = self.get_formatted_durations(expose['address']).strip()
         return expose
 
+    def process_exposes(self, exposes):
+        """Calculate the durations for the exposes in batches, and log the cache
+           statistics once the sequence has been consumed"""
+        def calculate(batch):
+            arrival = self.next_arrival()
+            durations = self.get_durations([expose['address'] for expose in batch], arrival)
+            for expose in batch:
+                expose['durations'] = self.format_durations(
+                    expose['address'], durations, arrival).strip()
+            return batch
+
+        def log_cache_stats():
+            if self.cache is not None and self.cache.hits + self.cache.misses > 0:
+                logger.info("Google Maps cache: %d hits, %d misses",
+                            self.cache.hits, self.cache.misses)
+
+        return BatchedIterator(exposes, self.BATCH_SIZE, calculate, on_done=log_cache_stats)
+
     def get_formatted_durations(self, address):
         """Return a formatted list of GoogleMaps durations"""
-        out = ""
+        arrival = self.next_arrival()
+        return self.format_durations(address, self.get_durations([address], arrival), arrival)
+
+    def routes(self) -> List[Tuple[str, str, str, str]]:
+        """The configured (name, destination, mode, title) routes"""
+        if 'key' not in self.config.get('google_maps_api', {}):
+            return []
+        res = []
         for duration in self.config.get('durations', []):
             if 'destination' in duration and 'name' in duration:
-                dest = duration.get('destination')
-                name = duration.get('name')
                 for mode in duration.get('modes', []):
-                    if 'gm_id' in mode and 'title' in mode \
-                                       and 'key' in self.config.get('google_maps_api', {}):
-                        duration = self.get_gmaps_distance(address, dest, mode['gm_id'])
-                        title = mode['title']
-                        out += f"> {name} ({title}): {duration}\n"
+                    if 'gm_id' in mode and 'title' in mode:
+                        res.append((duration['name'], duration['destination'],
+                                    mode['gm_id'], mode['title']))
+        return res
 
+    def format_durations(self, address, durations: Dict[str, str],
+                         arrival: datetime.datetime) -> str:
+        """Format the durations of the routes from an address, given the durations
+           by cache key"""
+        out = ""
+        for (name, dest, mode, title) in self.routes():
+            key = DurationCache.key(address, dest, self.request_mode(mode), arrival)
+            out += f"> {name} ({title}): {durations.get(key)}\n"
         return out.strip()
 
-    def get_gmaps_distance(self, address, dest, mode):
-        """Get the distance"""
-        # get timestamp for next monday at 9:00:00 o'clock
-        now = datetime.datetime.today().replace(hour=9, minute=0, second=0)
-        next_monday = now + datetime.timedelta(days=7 - now.weekday())
-        arrival_time = str(int(time.mktime(next_monday.timetuple())))
+    def get_durations(self, addresses: List[str], arrival: datetime.datetime) -> Dict[str, str]:
+        """Look up the durations of all routes from the addresses, by cache key. Routes
+           are looked up in the cache first; the others are requested per mode, with
+           as few requests as the limits of the Distance Matrix API allow"""
+        destinations_by_mode: Dict[str, List[str]] = {}
+        for (_, dest, mode, _) in self.routes():
+            destinations = destinations_by_mode.setdefault(self.request_mode(mode), [])
+            if dest not in destinations:
+                destinations.append(dest)
+        # addresses that only differ in case or whitespace are requested once
+        origins = list({normalize_address(address): address for address in addresses}.values())
+        keys = {DurationCache.key(origin, dest, mode, arrival): (origin, dest, mode)
+                for (mode, destinations) in destinations_by_mode.items()
+                for dest in destinations for origin in origins}
+        durations = self.cache.get(keys) if self.cache is not None else {}
 
-        # decode from unicode and url encode addresses
-        address = quote_plus(address.strip().encode('utf8'))
-        dest = quote_plus(dest.strip().encode('utf8'))
-        logger.debug("Got address: %s", address)
+        for (mode, destinations) in destinations_by_mode.items():
+            missing = list(dict.fromkeys(origin for (key, (origin, _, route_mode)) in keys.items()
+                                         if route_mode == mode and key not in durations))
+            fetched = {}
+            for dest_chunk in chunk_list(destinations,
+                                         min(self.MAX_DESTINATIONS, self.MAX_ELEMENTS)):
+                origin_chunk_size = min(self.MAX_ORIGINS, self.MAX_ELEMENTS // len(dest_chunk))
+                for origin_chunk in chunk_list(missing, origin_chunk_size):
+                    matrix = self.get_distance_matrix(origin_chunk, dest_chunk, mode, arrival)
+                    fetched.update({DurationCache.key(origin, dest, mode, arrival): duration
+                                    for ((origin, dest), duration) in matrix.items()})
+            durations.update(fetched)
+            if self.cache is not None:
+                self.cache.put(fetched)
+        return durations
 
-        # get google maps config stuff
-        base_url = self.config.get('google_maps_api', {}).get('url')
-        gm_key = self.config.get('google_maps_api', {}).get('key')
+    @staticmethod
+    def next_arrival() -> datetime.datetime:
+        """The arrival time durations are calculated for: next monday at 9:00:00"""
+        now = datetime.datetime.today().replace(hour=9, minute=0, second=0, microsecond=0)
+        return now + datetime.timedelta(days=7 - now.weekday())
 
+    def request_mode(self, mode):
+        """The mode to request: without an API key, only 'driving' is allowed"""
+        gm_key = self.config.get('google_maps_api', {}).get('key')
         if not gm_key and mode != self.GM_MODE_DRIVING:
             logger.warning("No Google Maps API key configured and without using a mode "
                                  "different from 'driving' is not allowed. "
                                  "Downgrading to mode 'drinving' thus. ")
-            mode = 'driving'
+            return self.GM_MODE_DRIVING
+        return mode
+
+    def get_gmaps_distance(self, address, dest, mode):
+        """Get the distance"""
+        mode = self.request_mode(mode)
+        matrix = self.get_distance_matrix([address], [dest], mode, self.next_arrival())
+        return matrix.get((address, dest))
+
+    def get_distance_matrix(self, origins: List[str], destinations: List[str], mode: str,
+                            arrival: datetime.datetime) -> Dict[Tuple[str, str], str]:
+        """Request the routes from each origin to each destination with a single
+           Distance Matrix request. Returns the formatted duration and distance by
+           (origin, destination), for the routes that were found"""
+        arrival_time = str(int(time.mktime(arrival.timetuple())))
+
+        # decode from unicode and url encode addresses, separated by pipes
+        origin = '%7C'.join(quote_plus(address.strip().encode('utf8')) for address in origins)
+        dest = '%7C'.join(quote_plus(address.strip().encode('utf8')) for address in destinations)
+        logger.debug("Got addresses: %s", origin)
+
+        # get google maps config stuff
+        base_url = self.config.get('google_maps_api', {}).get('url')
+        gm_key = self.config.get('google_maps_api', {}).get('key')
+        if not gm_key:
             base_url = base_url.replace('&key={key}', '')
 
         # retrieve the result
-        url = base_url.format(dest=dest, mode=mode, origin=address,
+        url = base_url.format(dest=dest, mode=mode, origin=origin,
                               key=gm_key, arrival=arrival_time)
-        result = requests.get(url, timeout=30).json()
+        result = self.config.http_session().get(url, timeout=30).json()
         if result['status'] != 'OK':
-            logger.error("Failed retrieving distance to address %s: %s", address, result)
-            return None
+            logger.error("Failed retrieving distances to addresses %s: %s", origins, result)
+            return {}
+        return self.parse_distance_matrix(result, origins, destinations)
 
-        # get the fastest route
+    @staticmethod
+    def parse_distance_matrix(result: Dict, origins: List[str],
+                              destinations: List[str]) -> Dict[Tuple[str, str], str]:
+        """Extract the formatted routes from a Distance Matrix response"""
+        # rows are in the order of the origins, and elements in that of the destinations
         distances = {}
-        for row in result['rows']:
-            for element in row['elements']:
+        for (address, row) in zip(origins, result['rows']):
+            for (destination, element) in zip(destinations, row['elements']):
                 if 'status' in element and element['status'] != 'OK':
                     logger.warning("For address %s we got the status message: %s",
                                          address, element['status'])
@@ -84,5 +222,5 @@ class GMapsDurationProcessor(Processor):
                                    element['duration']['value'])
                 duration_text = element['duration']['text']
                 distance_text = element['distance']['text']
-                distances[element['duration']['value']] = f"{duration_text} ({distance_text})"
-        return distances[min(distances.keys())] if distances else None
+                distances[(address, destination)] = f"{duration_text} ({distance_text})"
+        return distances
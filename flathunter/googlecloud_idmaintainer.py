@@ -1,5 +1,6 @@
 """Storage back-end implementation using Google Cloud Firestore"""
 import datetime
+import json
 import pytz
 import firebase_admin
 from firebase_admin import credentials
@@ -8,11 +9,16 @@ from google.cloud.firestore_v1.base_query import BaseQuery
 
 from flathunter.logging import logger
 from flathunter.exceptions import PersistenceException
+from flathunter.idmaintainer import content_hash
+from flathunter.utils.list import chunk_list
 
 
 class GoogleCloudIdMaintainer:
     """Storage back-end - implementation of IdMaintainer API"""
 
+    # Maximum number of writes in a single Firestore batch
+    MAX_BATCH_SIZE = 500
+
     def __init__(self, config):
         project_id = config.google_cloud_project_id()
         if project_id is None:
@@ -23,25 +29,180 @@ class GoogleCloudIdMaintainer:
         })
         self.database = firestore.client()
 
-    def mark_processed(self, expose_id):
+    def mark_processed(self, expose_id, crawler=''):
         """Mark exposes as processed when we have processed them"""
-        logger.debug('mark_processed(%d)', expose_id)
+        logger.debug('mark_processed(%s)', expose_id)
         self.database.collection('processed').document(
-            str(expose_id)).set({'id': expose_id})
+            str(expose_id)).set({'id': expose_id, 'crawler': crawler})
+
+    # Processed documents are keyed by expose ID alone, so the crawler is not
+    # taken into account when looking them up
+    # pylint: disable=unused-argument
 
-    def is_processed(self, expose_id):
+    def is_processed(self, expose_id, crawler=None):
         """Returns true if an expose has already been marked as processed"""
-        logger.debug('is_processed(%d)', expose_id)
+        logger.debug('is_processed(%s)', expose_id)
         doc = self.database.collection('processed').document(str(expose_id))
         return doc.get().exists
 
+    def filter_unprocessed(self, expose_ids, crawler=None):
+        """Returns the expose IDs from the list that have not been processed yet"""
+        expose_ids = list(dict.fromkeys(expose_ids))
+        collection = self.database.collection('processed')
+        references = [collection.document(str(expose_id)) for expose_id in expose_ids]
+        processed = {snapshot.id for snapshot in self.database.get_all(references)
+                     if snapshot.exists}
+        return [expose_id for expose_id in expose_ids if str(expose_id) not in processed]
+
+    def filter_unknown(self, expose_ids, crawler):
+        """Returns the expose IDs from the list that have not been saved by an earlier
+           crawl. Exposes are stored by ID only, so the crawler is not matched"""
+        expose_ids = list(dict.fromkeys(expose_ids))
+        collection = self.database.collection('exposes')
+        references = [collection.document(str(expose_id)) for expose_id in expose_ids]
+        known = {snapshot.id for snapshot in self.database.get_all(references)
+                 if snapshot.exists}
+        return [expose_id for expose_id in expose_ids if str(expose_id) not in known]
+
+    # pylint: enable=unused-argument
+
+    def mark_processed_many(self, expose_ids, crawler=''):
+        """Mark a list of exposes as processed, using batched writes"""
+        logger.debug('mark_processed_many(%d exposes)', len(expose_ids))
+        collection = self.database.collection('processed')
+        for chunk in chunk_list(expose_ids, self.MAX_BATCH_SIZE):
+            batch = self.database.batch()
+            for expose_id in chunk:
+                batch.set(collection.document(str(expose_id)),
+                          {'id': expose_id, 'crawler': crawler})
+            batch.commit()
+
+    def queue_notifications(self, exposes, notifications):
+        """Marks the exposes as processed, and adds the notifications - (notifier name,
+           receiver IDs or None, expose) tuples - to the outbox. The writes are made in
+           batches, with the outbox entries written before the exposes are marked"""
+        now = pytz.utc.localize(datetime.datetime.now())
+        outbox = self.database.collection('outbox')
+        processed = self.database.collection('processed')
+        # document IDs are random, so the times are offset to keep the notifications
+        # in order when they are read back by next_attempt
+        now -= datetime.timedelta(microseconds=len(notifications))
+        writes = [(outbox.document(), {
+            'notifier': notifier,
+            'receivers': receivers,
+            'expose': json.dumps(expose),
+            'created': now + datetime.timedelta(microseconds=index),
+            'attempts': 0,
+            'next_attempt': now + datetime.timedelta(microseconds=index)
+        }) for index, (notifier, receivers, expose) in enumerate(notifications)]
+        writes.extend((processed.document(str(expose['id'])),
+                       {'id': expose['id'], 'crawler': expose.get('crawler', '')})
+                      for expose in exposes)
+        for chunk in chunk_list(writes, self.MAX_BATCH_SIZE):
+            batch = self.database.batch()
+            for reference, document in chunk:
+                batch.set(reference, document)
+            batch.commit()
+
+    def get_due_notifications(self, count):
+        """Returns up to 'count' notifications from the outbox that are due for delivery,
+           oldest first"""
+        now = pytz.utc.localize(datetime.datetime.now())
+        res = []
+        for doc in self.database.collection('outbox') \
+                .where('next_attempt', '<=', now) \
+                .order_by('next_attempt').limit(count).stream():
+            notification = doc.to_dict()
+            if notification is None:
+                continue
+            res.append({'id': doc.id,
+                        'notifier': notification['notifier'],
+                        'receivers': notification['receivers'],
+                        'expose': json.loads(notification['expose']),
+                        'attempts': notification['attempts']})
+        return res
+
+    def acknowledge_notifications(self, notification_ids):
+        """Removes delivered notifications from the outbox"""
+        collection = self.database.collection('outbox')
+        for chunk in chunk_list(notification_ids, self.MAX_BATCH_SIZE):
+            batch = self.database.batch()
+            for notification_id in chunk:
+                batch.delete(collection.document(notification_id))
+            batch.commit()
+
+    def retry_notifications(self, retries):
+        """Records failed deliveries: sets the number of attempts made and the time of
+           the next attempt from (notification ID, attempts, next attempt) tuples"""
+        collection = self.database.collection('outbox')
+        for chunk in chunk_list(retries, self.MAX_BATCH_SIZE):
+            batch = self.database.batch()
+            for notification_id, attempts, next_attempt in chunk:
+                batch.update(collection.document(notification_id), {
+                    'attempts': attempts,
+                    'next_attempt': pytz.utc.localize(next_attempt)
+                })
+            batch.commit()
+
     def save_expose(self, expose):
         """Writes an expose to the storage backend"""
-        record = expose.copy()
-        record.update({'created_at': pytz.utc.localize(datetime.datetime.now()),
-                       'created_sort': (0 - datetime.datetime.now().timestamp())})
-        self.database.collection('exposes').document(
-            str(expose['id'])).set(record)
+        seen_at = datetime.datetime.now()
+        self.update_last_seen(self.save_exposes([expose], seen_at), seen_at)
+
+    def save_exposes(self, exposes, seen_at):
+        """Writes the new and changed exposes of a batch to the storage backend. The
+           (id, crawler) keys of the unchanged exposes are returned, as by the SQLite
+           back-end, to be passed to update_last_seen"""
+        collection = self.database.collection('exposes')
+        records = {str(expose['id']): expose for expose in exposes}
+        references = [collection.document(expose_id) for expose_id in records]
+        stored = {snapshot.id: snapshot.to_dict() or {}
+                  for snapshot in self.database.get_all(references) if snapshot.exists}
+        localized_seen_at = pytz.utc.localize(seen_at)
+        unchanged = []
+        writes = []
+        for expose_id, expose in records.items():
+            details_hash = content_hash(json.dumps(expose))
+            if expose_id not in stored:
+                writes.append((expose_id, {
+                    **expose,
+                    'content_hash': details_hash,
+                    'created_at': localized_seen_at,
+                    'created_sort': (0 - seen_at.timestamp()),
+                    'first_seen': localized_seen_at,
+                    'last_seen': localized_seen_at
+                }))
+            elif stored[expose_id].get('content_hash') != details_hash:
+                # replace the document, so that fields the expose no longer has are
+                # dropped, but keep its creation and first_seen times
+                writes.append((expose_id, {
+                    **expose,
+                    **{field: stored[expose_id][field]
+                       for field in ('created_at', 'created_sort', 'first_seen')
+                       if field in stored[expose_id]},
+                    'content_hash': details_hash,
+                    'last_seen': localized_seen_at
+                }))
+            else:
+                unchanged.append((int(expose['id']), expose['crawler']))
+        for chunk in chunk_list(writes, self.MAX_BATCH_SIZE):
+            batch = self.database.batch()
+            for expose_id, record in chunk:
+                batch.set(collection.document(expose_id), record)
+            batch.commit()
+        return unchanged
+
+    def update_last_seen(self, expose_keys, seen_at):
+        """Sets the last_seen time of the exposes with the given (id, crawler) keys, using
+           batched writes"""
+        collection = self.database.collection('exposes')
+        localized_seen_at = pytz.utc.localize(seen_at)
+        for chunk in chunk_list(expose_keys, self.MAX_BATCH_SIZE):
+            batch = self.database.batch()
+            for (expose_id, _) in chunk:
+                batch.update(collection.document(str(expose_id)),
+                             {'last_seen': localized_seen_at})
+            batch.commit()
 
     def get_exposes_since(self, min_datetime):
         """Returns all exposes since the supplied datetime"""
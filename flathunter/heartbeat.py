@@ -3,7 +3,7 @@ from flathunter.abstract_notifier import Notifier
 from flathunter.config import YamlConfig
 from flathunter.logging import logger
 from flathunter.notifiers import SenderApprise, SenderMattermost, SenderTelegram, SenderSlack
-from flathunter.exceptions import HeartbeatException
+from flathunter.exceptions import HeartbeatException, NotificationFailedException
 
 
 def interval2counter(interval: str) -> int:
@@ -48,9 +48,13 @@ class Heartbeat:
         # it's time for a new heartbeat message and reset counter
         if counter % self.interval == 0:
             logger.info('Sending heartbeat message.')
-            self.notifier.notify(
-                'Beep Boop. This is a heartbeat message. '
-                'Your bot is actively searching for flats.'
-            )
+            try:
+                self.notifier.notify(
+                    'Beep Boop. This is a heartbeat message. '
+                    'Your bot is actively searching for flats.'
+                )
+            except NotificationFailedException as error:
+                # a missed heartbeat is not worth stopping the hunt for
+                logger.error("Could not send heartbeat message: %s", error)
             counter = 0
         return counter
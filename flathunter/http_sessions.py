@@ -0,0 +1,146 @@
+"""Pooled HTTP sessions. The crawlers, processors and notifiers share the connection
+pools, so that TCP and TLS connections are kept alive and reused between requests.
+Each crawler has a session of its own, so that cookies and User-Agents are not
+shared between portals"""
+import threading
+from typing import Dict, NamedTuple
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+
+from flathunter.logging import logger
+
+
+class ConnectionStats(NamedTuple):
+    """Number of connections opened and reused for a series of requests"""
+    opened: int
+    reused: int
+
+
+class ConnectionCounter:
+    """Thread-safe count of connections opened and requests sent"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.opened = 0
+        self.requests = 0
+
+    def count_connect(self):
+        """Record that a new connection was established"""
+        with self.lock:
+            self.opened += 1
+
+    def count_request(self):
+        """Record that a request was sent"""
+        with self.lock:
+            self.requests += 1
+
+    def totals(self):
+        """Return the number of connections opened and requests sent so far"""
+        with self.lock:
+            return self.opened, self.requests
+
+
+class CountingConnectionMixin:
+    """Counts every (re-)connect of a pooled connection"""
+    counter: ConnectionCounter
+
+    def connect(self):
+        """Open the connection to the server"""
+        self.counter.count_connect()
+        super().connect() # type: ignore
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """Transport adapter that keeps count of the connections its pools open and reuse"""
+
+    def __init__(self, keep_alive: bool = True, **kwargs):
+        # set before calling the parent constructor, which initialises the pool manager
+        self.keep_alive = keep_alive
+        self.counter = ConnectionCounter()
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        """Create the pool manager, with connections that report to this adapter's counter"""
+        super().init_poolmanager(*args, **kwargs)
+        members = {'counter': self.counter}
+        http_connection = type('CountingHTTPConnection',
+                               (CountingConnectionMixin, HTTPConnection), members)
+        https_connection = type('CountingHTTPSConnection',
+                                (CountingConnectionMixin, HTTPSConnection), members)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': type('CountingHTTPConnectionPool', (HTTPConnectionPool,),
+                         {'ConnectionCls': http_connection}),
+            'https': type('CountingHTTPSConnectionPool', (HTTPSConnectionPool,),
+                          {'ConnectionCls': https_connection}),
+        }
+
+    def send(self, request, *args, **kwargs): # pylint: disable=signature-differs
+        """Send the request, asking the server to close the connection if keep-alive is off"""
+        if not self.keep_alive:
+            request.headers['Connection'] = 'close'
+        self.counter.count_request()
+        return super().send(request, *args, **kwargs)
+
+
+class HttpSessions:
+    """Owns the pooled HTTP transport. All sessions created here share the same
+       connection pools (one per host), keep-alive and retry policy"""
+
+    RETRY_STATUS_CODES = (502, 503, 504)
+
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    def __init__(self,
+                 pool_connections: int = 10,
+                 pool_maxsize: int = 10,
+                 max_retries: int = 2,
+                 backoff_factor: float = 0.5,
+                 keep_alive: bool = True,
+                 max_requests_per_host: int = 4):
+        retry = Retry(total=max_retries,
+                      backoff_factor=backoff_factor,
+                      status_forcelist=self.RETRY_STATUS_CODES,
+                      raise_on_status=False)
+        self.adapter = PooledHTTPAdapter(keep_alive=keep_alive,
+                                         pool_connections=pool_connections,
+                                         pool_maxsize=pool_maxsize,
+                                         max_retries=retry)
+        self.session = self.new_session()
+        self.last_totals = (0, 0)
+        self.max_requests_per_host = max(1, max_requests_per_host)
+        self.host_slots: Dict[str, threading.BoundedSemaphore] = {}
+        self.host_slots_lock = threading.Lock()
+
+    def new_session(self) -> requests.Session:
+        """Create a session with its own cookie jar that uses the shared connection pools"""
+        session = requests.Session()
+        session.mount('http://', self.adapter)
+        session.mount('https://', self.adapter)
+        return session
+
+    def host_slot(self, url: str) -> threading.BoundedSemaphore:
+        """The semaphore that limits the number of concurrent requests to the host of
+           the URL. Requests that may run in parallel should hold it while being sent"""
+        host = urlsplit(url).netloc.lower()
+        with self.host_slots_lock:
+            if host not in self.host_slots:
+                self.host_slots[host] = threading.BoundedSemaphore(self.max_requests_per_host)
+            return self.host_slots[host]
+
+    def cycle_stats(self) -> ConnectionStats:
+        """Number of connections opened and reused since the previous call"""
+        opened, requests_sent = self.adapter.counter.totals()
+        last_opened, last_requests_sent = self.last_totals
+        self.last_totals = (opened, requests_sent)
+        opened -= last_opened
+        requests_sent -= last_requests_sent
+        return ConnectionStats(opened=opened, reused=max(0, requests_sent - opened))
+
+    def log_cycle_stats(self):
+        """Log the connection statistics since the previous call"""
+        stats = self.cycle_stats()
+        logger.info("HTTP connections: %d opened, %d reused", stats.opened, stats.reused)
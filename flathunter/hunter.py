@@ -1,15 +1,76 @@
 """Default Flathunter implementation for the command line"""
+import threading
 import traceback
-from itertools import chain
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from queue import Empty, Queue
+from typing import Deque, Optional
 import requests
 
 from flathunter.logging import logger
 from flathunter.config import YamlConfig
 from flathunter.filter import Filter
 from flathunter.processor import ProcessorChain
+from flathunter.notification_outbox import NotificationDispatcher
+from flathunter.pagination import IncrementalPagination
 from flathunter.captcha.captcha_solver import CaptchaUnsolvableError
 from flathunter.exceptions import ConfigException
 
+# Marker put on the result queue by a crawl job once it has finished
+_CRAWL_DONE = object()
+
+class CrawlResults:
+    """Iterator over the exposes that crawl jobs put on a queue, in the order they
+       arrive. Its 'ready' method tells the processors whether an expose can be taken
+       without waiting for the crawls, so that they never hold exposes back"""
+
+    def __init__(self, results: Queue, pending: int,
+                 executor: Optional[ThreadPoolExecutor] = None):
+        self.results = results
+        self.pending = pending
+        self.executor = executor
+        self.received: Deque = deque()
+
+    def ready(self) -> bool:
+        """True if the next expose, or the end of the crawls, is available"""
+        while len(self.received) == 0 and self.pending > 0:
+            try:
+                self.receive(self.results.get_nowait())
+            except Empty:
+                return False
+        return True
+
+    def receive(self, item):
+        """Take an item from the queue: an expose, an error raised by a crawl job, or
+           the marker of a finished job"""
+        if item is not _CRAWL_DONE:
+            self.received.append(item)
+            return
+        self.pending -= 1
+        if self.pending == 0:
+            self.close()
+
+    def close(self):
+        """Release the worker threads. Crawl jobs that have not started yet are
+           cancelled; running jobs finish in the background"""
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while len(self.received) == 0:
+            if self.pending == 0:
+                raise StopIteration
+            self.receive(self.results.get())
+        item = self.received.popleft()
+        if isinstance(item, Exception):
+            # raised by a crawl job
+            self.close()
+            raise item
+        return item
+
 class Hunter:
     """Basic methods for crawling and processing / filtering exposes"""
 
@@ -19,42 +80,96 @@ class Hunter:
             raise ConfigException(
                 "Invalid config for hunter - should be a 'Config' object")
         self.id_watch = id_watch
+        self.notification_dispatcher = NotificationDispatcher(config, id_watch)
+        self.pagination = IncrementalPagination(id_watch) \
+            if config.crawl_incremental() else None
 
     def crawl_for_exposes(self, max_pages=None):
-        """Trigger a new crawl of the configured URLs"""
+        """Trigger a new crawl of the configured URLs. URLs are crawled concurrently
+           on a bounded pool of worker threads, with at most
+           `crawl.max_workers_per_crawler` concurrent crawls per portal. Exposes are
+           passed on as soon as they are crawled, so that processing can start before
+           the slowest portal has responded"""
         def try_crawl(searcher, url, max_pages):
+            # crawlers may yield exposes while the page downloads, so errors can
+            # be raised while iterating over them
             try:
-                return searcher.crawl(url, max_pages)
+                yield from searcher.crawl(url, max_pages, self.pagination)
             except CaptchaUnsolvableError:
                 logger.info("Error while scraping url %s: the captcha was unsolvable", url)
-                return []
             except requests.exceptions.RequestException:
                 logger.info("Error while scraping url %s:\n%s", url, traceback.format_exc())
-                return []
 
-        return chain(*[try_crawl(searcher, url, max_pages)
-                       for searcher in self.config.searchers()
-                       for url in self.config.target_urls()])
+        router = self.config.crawler_router()
+        jobs = [(searcher, url)
+                for url in self.config.crawl_urls()
+                for searcher in router.crawlers_for(url)]
+        if len(jobs) == 0:
+            return CrawlResults(Queue(), 0)
+
+        # slow resources such as browsers are prepared while other portals are crawled
+        for searcher in dict.fromkeys(searcher for (searcher, _) in jobs):
+            searcher.prewarm()
+
+        per_crawler_limit = max(1, self.config.crawl_max_workers_per_crawler())
+        limits = {searcher: threading.BoundedSemaphore(per_crawler_limit)
+                  for (searcher, _) in jobs}
+        results: Queue = Queue()
+
+        def crawl_job(searcher, url):
+            try:
+                with limits[searcher]:
+                    for expose in try_crawl(searcher, url, max_pages):
+                        results.put(expose)
+            except Exception as error: # pylint: disable=broad-exception-caught
+                # re-raised on the consuming thread
+                results.put(error)
+            finally:
+                results.put(_CRAWL_DONE)
+
+        max_workers = min(max(1, self.config.crawl_max_workers()), len(jobs))
+        executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='crawl')
+        for (searcher, url) in jobs:
+            executor.submit(crawl_job, searcher, url)
+        return CrawlResults(results, len(jobs), executor)
+
+    def new_exposes_filter(self) -> Filter:
+        """The configured filters, followed by a filter for exposes that have already
+           been processed"""
+        return Filter.builder() \
+                     .read_config(self.config) \
+                     .filter_already_seen(self.id_watch, mark_processed=False) \
+                     .build()
+
+    def end_cycle(self):
+        """Deliver the queued notifications, and log the statistics of the cycle"""
+        self.notification_dispatcher.dispatch()
+        self.config.http_sessions().log_cycle_stats()
+        self.config.crawler_router().log_cycle_stats()
+        if self.pagination is not None:
+            self.pagination.log_cycle_stats()
+        if self.config.browser_pool_started():
+            self.config.browser_pool().log_cycle_stats()
 
     def hunt_flats(self, max_pages: None|int = None):
         """Crawl, process and filter exposes"""
-        filter_set = Filter.builder() \
-                           .read_config(self.config) \
-                           .filter_already_seen(self.id_watch) \
-                           .build()
-
         processor_chain = ProcessorChain.builder(self.config) \
                                         .save_all_exposes(self.id_watch) \
-                                        .apply_filter(filter_set) \
+                                        .apply_filter(self.new_exposes_filter()) \
                                         .resolve_addresses() \
-                                        .calculate_durations() \
-                                        .send_messages() \
+                                        .calculate_durations(self.id_watch) \
+                                        .queue_notifications(self.id_watch) \
                                         .build()
 
         result = []
-        # We need to iterate over this list to force the evaluation of the pipeline
-        for expose in processor_chain.process(self.crawl_for_exposes(max_pages)):
-            logger.info('New offer: %s', expose['title'])
-            result.append(expose)
+        crawl_results = self.crawl_for_exposes(max_pages)
+        try:
+            # We need to iterate over this list to force the evaluation of the pipeline
+            for expose in processor_chain.process(crawl_results):
+                logger.info('New offer: %s', expose['title'])
+                result.append(expose)
+        finally:
+            crawl_results.close()
 
+        self.end_cycle()
         return result
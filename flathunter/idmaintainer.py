@@ -2,10 +2,14 @@
 import threading
 import sqlite3 as lite
 import datetime
+import hashlib
 import json
 
 from flathunter.logging import logger
 from flathunter.abstract_processor import Processor
+from flathunter.filter import ExposeRecord
+from flathunter.utils.batches import BatchedIterator
+from flathunter.utils.list import chunk_list
 
 __author__ = "Nody"
 __version__ = "0.1"
@@ -13,9 +17,30 @@ __maintainer__ = "Nody"
 __email__ = "harrymcfly@protonmail.com"
 __status__ = "Prodction"
 
+def content_hash(details):
+    """Returns a hash of the serialized expose, used to detect changed exposes"""
+    return hashlib.sha1(details.encode('utf-8')).hexdigest()
+
+def numeric_fields(expose):
+    """Returns the price, size and number of rooms of an expose as numbers. Values that
+       are missing or cannot be parsed are None"""
+    record = ExposeRecord.from_expose(expose)
+    return (record.price, record.size, record.rooms)
+
+def backfill_numeric_columns(connection):
+    """Fills the numeric columns of exposes that were saved before they existed"""
+    rows = connection.execute('SELECT id, crawler, details FROM exposes').fetchall()
+    connection.executemany('UPDATE exposes SET price = ?, size = ?, rooms = ? \
+                            WHERE id = ? AND crawler = ?',
+                           [(*numeric_fields(json.loads(details)), expose_id, crawler)
+                            for (expose_id, crawler, details) in rows])
+
 class SaveAllExposesProcessor(Processor):
     """Processor that saves all exposes to the database"""
 
+    # Number of exposes that are saved at once
+    BATCH_SIZE = 50
+
     def __init__(self, config, id_watch):
         self.config = config
         self.id_watch = id_watch
@@ -25,55 +50,292 @@ class SaveAllExposesProcessor(Processor):
         self.id_watch.save_expose(expose)
         return expose
 
-class IdMaintainer:
+    def process_exposes(self, exposes):
+        """Save the exposes in batches. Only new and changed exposes are written;
+           the last_seen time of the unchanged ones is updated once the sequence
+           has been consumed"""
+        seen_at = datetime.datetime.now()
+        unchanged = []
+
+        def save(batch):
+            unchanged.extend(self.id_watch.save_exposes(batch, seen_at))
+            return batch
+
+        return BatchedIterator(exposes, self.BATCH_SIZE, save,
+                               on_done=lambda: self.id_watch.update_last_seen(unchanged,
+                                                                             seen_at))
+
+class IdMaintainer:  # pylint: disable=too-many-public-methods
     """SQLite back-end for the database"""
 
+    # Stay well below SQLite's limit on the number of bound query parameters
+    MAX_QUERY_PARAMETERS = 500
+
+    # Schema migrations, in order. Applying the first n migrations brings the database
+    # to schema version n, which is stored in SQLite's 'user_version' header field.
+    # A migration step is either a SQL statement or a function taking the connection.
+    # Never change a migration once released - append a new one instead.
+    MIGRATIONS = [
+        # 1: the original schema
+        [
+            'CREATE TABLE IF NOT EXISTS processed (ID INTEGER)',
+            'CREATE TABLE IF NOT EXISTS executions (timestamp timestamp)',
+            'CREATE TABLE IF NOT EXISTS exposes (id INTEGER, created TIMESTAMP, \
+                crawler STRING, details BLOB, PRIMARY KEY (id, crawler))',
+            'CREATE TABLE IF NOT EXISTS users (id INTEGER PRIMARY KEY, settings BLOB)',
+        ],
+        # 2: key processed IDs by crawler, and index the columns exposes and
+        # executions are sorted by. IDs processed before this version are migrated
+        # with an empty crawler, which matches exposes from every crawler
+        [
+            "CREATE TABLE processed_v2 (id INTEGER NOT NULL, crawler TEXT NOT NULL DEFAULT '', \
+                PRIMARY KEY (id, crawler)) WITHOUT ROWID",
+            'INSERT OR IGNORE INTO processed_v2 (id) SELECT ID FROM processed WHERE ID IS NOT NULL',
+            'DROP TABLE processed',
+            'ALTER TABLE processed_v2 RENAME TO processed',
+            'CREATE INDEX IF NOT EXISTS exposes_created ON exposes (created)',
+            'CREATE INDEX IF NOT EXISTS executions_timestamp ON executions (timestamp)',
+        ],
+        # 3: track when exposes were first and last crawled, and a hash of their
+        # content so that unchanged exposes are not rewritten
+        [
+            'ALTER TABLE exposes ADD COLUMN content_hash TEXT',
+            'ALTER TABLE exposes ADD COLUMN first_seen TIMESTAMP',
+            'ALTER TABLE exposes ADD COLUMN last_seen TIMESTAMP',
+            'UPDATE exposes SET first_seen = created, last_seen = created',
+        ],
+        # 4: numeric columns, so that filters can be applied in the query
+        [
+            'ALTER TABLE exposes ADD COLUMN price REAL',
+            'ALTER TABLE exposes ADD COLUMN size REAL',
+            'ALTER TABLE exposes ADD COLUMN rooms REAL',
+            backfill_numeric_columns,
+        ],
+        # 5: outbox of notifications waiting to be delivered
+        [
+            'CREATE TABLE outbox (id INTEGER PRIMARY KEY AUTOINCREMENT, notifier TEXT NOT NULL, \
+                receivers TEXT, expose BLOB NOT NULL, created TIMESTAMP NOT NULL, \
+                attempts INTEGER NOT NULL DEFAULT 0, next_attempt TIMESTAMP NOT NULL)',
+            'CREATE INDEX outbox_next_attempt ON outbox (next_attempt)',
+        ],
+        # 6: cache of Google Maps Distance Matrix results
+        [
+            'CREATE TABLE gmaps_cache (key TEXT PRIMARY KEY, result TEXT NOT NULL, \
+                created TIMESTAMP NOT NULL, last_used TIMESTAMP NOT NULL)',
+            'CREATE INDEX gmaps_cache_last_used ON gmaps_cache (last_used)',
+        ],
+    ]
+
     def __init__(self, db_name):
         self.db_name = db_name
         self.threadlocal = threading.local()
+        # Open the connection right away, so that the schema is upgraded at startup
+        self.get_connection()
 
     def get_connection(self):
         """Connects to the SQLite database. Connections are thread-local"""
         connection = getattr(self.threadlocal, 'connection', None)
         if connection is None:
             try:
-                self.threadlocal.connection = lite.connect(self.db_name)
-                connection = self.threadlocal.connection
-                cur = self.threadlocal.connection.cursor()
-                cur.execute('CREATE TABLE IF NOT EXISTS processed (ID INTEGER)')
-                cur.execute('CREATE TABLE IF NOT EXISTS executions (timestamp timestamp)')
-                cur.execute('CREATE TABLE IF NOT EXISTS exposes (id INTEGER, created TIMESTAMP, \
-                                    crawler STRING, details BLOB, PRIMARY KEY (id, crawler))')
-                cur.execute('CREATE TABLE IF NOT EXISTS users \
-                                    (id INTEGER PRIMARY KEY, settings BLOB)')
-                self.threadlocal.connection.commit()
+                connection = lite.connect(self.db_name)
+                # Readers do not block the writer (and vice versa) in WAL mode, and it
+                # is safe to only sync the WAL at checkpoints
+                connection.execute('PRAGMA journal_mode=WAL')
+                connection.execute('PRAGMA synchronous=NORMAL')
+                self.migrate(connection)
+                self.threadlocal.connection = connection
             except lite.Error as error:
                 logger.error("Error %s:", error.args[0])
                 raise error
         return connection
 
-    def is_processed(self, expose_id):
-        """Returns true if an expose has already been processed"""
-        logger.debug('is_processed(%d)', expose_id)
+    @staticmethod
+    def get_schema_version(connection):
+        """Returns the schema version of the database"""
+        return connection.execute('PRAGMA user_version').fetchone()[0]
+
+    def migrate(self, connection):
+        """Upgrades the database schema to the latest version"""
+        if self.get_schema_version(connection) >= len(self.MIGRATIONS):
+            return
+        # Take the write lock before reading the version again, in case another
+        # process is upgrading the same database
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            version = self.get_schema_version(connection)
+            for number, statements in enumerate(self.MIGRATIONS[version:], start=version + 1):
+                logger.info('Upgrading database schema to version %d', number)
+                for statement in statements:
+                    if callable(statement):
+                        statement(connection)
+                    else:
+                        connection.execute(statement)
+            connection.execute(f'PRAGMA user_version = {len(self.MIGRATIONS)}')
+            connection.commit()
+        except lite.Error:
+            connection.rollback()
+            raise
+
+    def is_processed(self, expose_id, crawler=None):
+        """Returns true if an expose has already been processed. If a crawler is given,
+           only IDs processed for that crawler (or before IDs were stored per
+           crawler) count"""
+        logger.debug('is_processed(%s)', expose_id)
         cur = self.get_connection().cursor()
-        cur.execute('SELECT id FROM processed WHERE id = ?', (expose_id,))
+        if crawler is None:
+            cur.execute('SELECT id FROM processed WHERE id = ? LIMIT 1', (expose_id,))
+        else:
+            cur.execute("SELECT id FROM processed WHERE id = ? AND crawler IN (?, '') LIMIT 1",
+                        (expose_id, crawler))
         row = cur.fetchone()
         return row is not None
 
-    def mark_processed(self, expose_id):
+    def mark_processed(self, expose_id, crawler=''):
         """Mark an expose as processed in the database"""
-        logger.debug('mark_processed(%d)', expose_id)
+        logger.debug('mark_processed(%s)', expose_id)
+        cur = self.get_connection().cursor()
+        cur.execute('INSERT OR IGNORE INTO processed (id, crawler) VALUES (?, ?)',
+                    (expose_id, crawler))
+        self.get_connection().commit()
+
+    def filter_unprocessed(self, expose_ids, crawler=None):
+        """Returns the expose IDs from the list that have not been processed yet.
+           The crawler is matched as in is_processed"""
+        expose_ids = list(dict.fromkeys(expose_ids))
+        processed = set()
+        cur = self.get_connection().cursor()
+        for chunk in chunk_list(expose_ids, self.MAX_QUERY_PARAMETERS):
+            placeholders = ','.join('?' * len(chunk))
+            if crawler is None:
+                cur.execute(f'SELECT id FROM processed WHERE id IN ({placeholders})', chunk)
+            else:
+                cur.execute(f"SELECT id FROM processed WHERE id IN ({placeholders}) \
+                              AND crawler IN (?, '')", [*chunk, crawler])
+            processed.update(str(row[0]) for row in cur.fetchall())
+        return [expose_id for expose_id in expose_ids if str(expose_id) not in processed]
+
+    def filter_unknown(self, expose_ids, crawler):
+        """Returns the expose IDs from the list that have not been saved by an earlier
+           crawl of the crawler"""
+        expose_ids = list(dict.fromkeys(expose_ids))
+        known = set()
+        cur = self.get_connection().cursor()
+        for chunk in chunk_list(expose_ids, self.MAX_QUERY_PARAMETERS):
+            placeholders = ','.join('?' * len(chunk))
+            cur.execute(f'SELECT id FROM exposes WHERE id IN ({placeholders}) \
+                          AND crawler = ?', [*chunk, crawler])
+            known.update(str(row[0]) for row in cur.fetchall())
+        return [expose_id for expose_id in expose_ids if str(expose_id) not in known]
+
+    def mark_processed_many(self, expose_ids, crawler=''):
+        """Mark a list of exposes as processed, in a single transaction"""
+        if len(expose_ids) == 0:
+            return
+        logger.debug('mark_processed_many(%d exposes)', len(expose_ids))
+        cur = self.get_connection().cursor()
+        cur.executemany('INSERT OR IGNORE INTO processed (id, crawler) VALUES (?, ?)',
+                        [(expose_id, crawler) for expose_id in expose_ids])
+        self.get_connection().commit()
+
+    def queue_notifications(self, exposes, notifications):
+        """Marks the exposes as processed, and adds the notifications - (notifier name,
+           receiver IDs or None, expose) tuples - to the outbox, in a single transaction"""
+        now = datetime.datetime.now()
+        cur = self.get_connection().cursor()
+        cur.executemany('INSERT INTO outbox (notifier, receivers, expose, created, next_attempt) \
+                         VALUES (?, ?, ?, ?, ?)',
+                        [(notifier, None if receivers is None else json.dumps(receivers),
+                          json.dumps(expose), now, now)
+                         for (notifier, receivers, expose) in notifications])
+        cur.executemany('INSERT OR IGNORE INTO processed (id, crawler) VALUES (?, ?)',
+                        [(expose['id'], expose.get('crawler', '')) for expose in exposes])
+        self.get_connection().commit()
+
+    def get_due_notifications(self, count):
+        """Returns up to 'count' notifications from the outbox that are due for delivery,
+           oldest first"""
+        cur = self.get_connection().cursor()
+        cur.execute('SELECT id, notifier, receivers, expose, attempts FROM outbox \
+                     WHERE next_attempt <= ? ORDER BY id LIMIT ?',
+                    (datetime.datetime.now(), count))
+        return [{'id': row[0],
+                 'notifier': row[1],
+                 'receivers': None if row[2] is None else json.loads(row[2]),
+                 'expose': json.loads(row[3]),
+                 'attempts': row[4]} for row in cur.fetchall()]
+
+    def acknowledge_notifications(self, notification_ids):
+        """Removes delivered notifications from the outbox"""
+        cur = self.get_connection().cursor()
+        for chunk in chunk_list(notification_ids, self.MAX_QUERY_PARAMETERS):
+            placeholders = ','.join('?' * len(chunk))
+            cur.execute(f'DELETE FROM outbox WHERE id IN ({placeholders})', chunk)
+        self.get_connection().commit()
+
+    def retry_notifications(self, retries):
+        """Records failed deliveries: sets the number of attempts made and the time of
+           the next attempt from (notification ID, attempts, next attempt) tuples"""
         cur = self.get_connection().cursor()
-        cur.execute('INSERT INTO processed VALUES(?)', (expose_id,))
+        cur.executemany('UPDATE outbox SET attempts = ?, next_attempt = ? WHERE id = ?',
+                        [(attempts, next_attempt, notification_id)
+                         for (notification_id, attempts, next_attempt) in retries])
         self.get_connection().commit()
 
     def save_expose(self, expose):
         """Saves an expose to a database"""
+        seen_at = datetime.datetime.now()
+        self.update_last_seen(self.save_exposes([expose], seen_at), seen_at)
+
+    def save_exposes(self, exposes, seen_at):
+        """Saves a batch of exposes in a single transaction. Exposes that are new or
+           whose content has changed are written; the keys of the unchanged exposes are
+           returned instead, to be passed to update_last_seen"""
+        records = {}
+        for expose in exposes:
+            details = json.dumps(expose)
+            records[(int(expose['id']), expose['crawler'])] = \
+                (expose, details, content_hash(details))
+        stored_hashes = {}
+        cur = self.get_connection().cursor()
+        for chunk in chunk_list(list({key[0] for key in records}), self.MAX_QUERY_PARAMETERS):
+            placeholders = ','.join('?' * len(chunk))
+            cur.execute(f'SELECT id, crawler, content_hash FROM exposes \
+                          WHERE id IN ({placeholders})', chunk)
+            stored_hashes.update(((row[0], row[1]), row[2]) for row in cur.fetchall())
+        new, changed, unchanged = [], [], []
+        for (key, (expose, details, details_hash)) in records.items():
+            if key not in stored_hashes:
+                new.append((*key, details, details_hash, seen_at, seen_at, seen_at,
+                            *numeric_fields(expose)))
+            elif stored_hashes[key] != details_hash:
+                changed.append((details, details_hash, seen_at, *numeric_fields(expose), *key))
+            else:
+                unchanged.append(key)
+        if len(new) > 0 or len(changed) > 0:
+            # an overlapping hunt may have saved a new expose since it was looked up
+            cur.executemany('INSERT INTO exposes(id, crawler, details, content_hash, \
+                                                 created, first_seen, last_seen, \
+                                                 price, size, rooms) \
+                             VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) \
+                             ON CONFLICT(id, crawler) DO UPDATE SET \
+                                 details = excluded.details, \
+                                 content_hash = excluded.content_hash, \
+                                 last_seen = excluded.last_seen, price = excluded.price, \
+                                 size = excluded.size, rooms = excluded.rooms', new)
+            cur.executemany('UPDATE exposes SET details = ?, content_hash = ?, last_seen = ?, \
+                                                price = ?, size = ?, rooms = ? \
+                             WHERE id = ? AND crawler = ?', changed)
+            self.get_connection().commit()
+        return unchanged
+
+    def update_last_seen(self, expose_keys, seen_at):
+        """Sets the last_seen time of the exposes with the given (id, crawler) keys,
+           in a single transaction"""
+        if len(expose_keys) == 0:
+            return
         cur = self.get_connection().cursor()
-        cur.execute('INSERT OR REPLACE INTO exposes(id, created, crawler, details) \
-                     VALUES (?, ?, ?, ?)',
-                    (int(expose['id']), datetime.datetime.now(),
-                     expose['crawler'], json.dumps(expose)))
+        cur.executemany('UPDATE exposes SET last_seen = ? WHERE id = ? AND crawler = ?',
+                        [(seen_at, *key) for key in expose_keys])
         self.get_connection().commit()
 
     def get_exposes_since(self, min_datetime):
@@ -88,18 +350,26 @@ class IdMaintainer:
         return list(map(row_to_expose, cur.fetchall()))
 
     def get_recent_exposes(self, count, filter_set=None):
-        """Returns up to 'count' recent exposes, filtered by the provided filter"""
+        """Returns up to 'count' recent exposes, filtered by the provided filter. The
+           parts of the filter that can be expressed in SQL are applied in the query;
+           the rest are applied to the loaded exposes"""
+        condition, parameters, remaining = '1', [], None
+        if filter_set is not None:
+            condition, parameters, remaining = filter_set.sql_conditions()
+        query = f'SELECT details FROM exposes WHERE {condition} \
+                   ORDER BY created DESC, rowid DESC'
+        if remaining is None or len(remaining.filters) == 0:
+            query += ' LIMIT ?'
+            parameters.append(count)
+            remaining = None
         cur = self.get_connection().cursor()
-        cur.execute('SELECT details FROM exposes ORDER BY created DESC')
+        cur.execute(query, parameters)
         res = []
-        next_batch = []
-        while len(res) < count:
-            if len(next_batch) == 0:
-                next_batch = cur.fetchmany()
-                if len(next_batch) == 0:
-                    break
-            expose = json.loads(next_batch.pop()[0])
-            if filter_set is None or filter_set.is_interesting_expose(expose):
+        for row in cur:
+            if len(res) == count:
+                break
+            expose = json.loads(row[0])
+            if remaining is None or remaining.is_interesting_expose(expose):
                 res.append(expose)
         return res
 
@@ -109,6 +379,38 @@ class IdMaintainer:
         cur.execute('INSERT OR REPLACE INTO users VALUES (?, ?)', (user_id, json.dumps(settings)))
         self.get_connection().commit()
 
+    def get_cached_durations(self, keys, min_created):
+        """Returns the cached Google Maps results for the keys, as a dict, leaving out
+           those cached before min_created. The results found are marked as used"""
+        now = datetime.datetime.now()
+        res = {}
+        cur = self.get_connection().cursor()
+        for chunk in chunk_list(list(dict.fromkeys(keys)), self.MAX_QUERY_PARAMETERS):
+            placeholders = ','.join('?' * len(chunk))
+            cur.execute(f'SELECT key, result FROM gmaps_cache \
+                          WHERE key IN ({placeholders}) AND created >= ?',
+                        [*chunk, min_created])
+            res.update(cur.fetchall())
+        if len(res) > 0:
+            cur.executemany('UPDATE gmaps_cache SET last_used = ? WHERE key = ?',
+                            [(now, key) for key in res])
+            self.get_connection().commit()
+        return res
+
+    def cache_durations(self, results, min_created, max_entries):
+        """Caches Google Maps results, given as a dict by key. Entries cached before
+           min_created are removed, and the least recently used entries beyond
+           max_entries are evicted"""
+        now = datetime.datetime.now()
+        cur = self.get_connection().cursor()
+        cur.executemany('INSERT OR REPLACE INTO gmaps_cache (key, result, created, last_used) \
+                         VALUES (?, ?, ?, ?)',
+                        [(key, result, now, now) for (key, result) in results.items()])
+        cur.execute('DELETE FROM gmaps_cache WHERE created < ?', (min_created,))
+        cur.execute('DELETE FROM gmaps_cache WHERE key IN (SELECT key FROM gmaps_cache \
+                     ORDER BY last_used DESC LIMIT -1 OFFSET ?)', (max_entries,))
+        self.get_connection().commit()
+
     def get_settings_for_user(self, user_id):
         """Loads the settings for a user from the database"""
         cur = self.get_connection().cursor()
@@ -0,0 +1,200 @@
+"""Durable delivery of notifications. The processor chain appends notifications to
+an outbox in the database, marking their exposes as processed in the same
+transaction; a dispatcher drains the outbox in batches and removes each
+notification once its notifier has delivered it. Notifications whose notifier
+raises are kept and retried later, so delivery is at-least-once, up to a maximum
+number of attempts"""
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+from flathunter.logging import logger
+from flathunter.abstract_processor import Processor
+from flathunter.config import YamlConfig
+from flathunter.utils.batches import BatchedIterator
+from flathunter.exceptions import BotBlockedException, UserDeactivatedException
+from flathunter.notifiers import SenderMattermost, SenderTelegram, SenderApprise, SenderSlack
+
+
+def build_notifier(config: YamlConfig, notifier: str, receivers: Optional[List[int]]):
+    """Create the sender for a notifier name. Only Telegram notifications have
+       individual receivers"""
+    if notifier == 'telegram':
+        return SenderTelegram(config, receivers=receivers)
+    if notifier == 'mattermost':
+        return SenderMattermost(config)
+    if notifier == 'apprise':
+        return SenderApprise(config)
+    if notifier == 'slack':
+        return SenderSlack(config)
+    raise ValueError(f"Unknown notifier {notifier}")
+
+
+def notifications_for(config: YamlConfig, exposes: List[Dict],
+                      receivers: Optional[List[int]] = None) \
+        -> List[Tuple[str, Optional[List[int]], Dict]]:
+    """The (notifier, receivers, expose) notifications to queue for the exposes, one
+       per configured notifier. Telegram notifications without explicit receivers go
+       to the configured receiver IDs, and are skipped if there are none"""
+    notifiers = [notifier for notifier in config.notifiers()
+                 if notifier != 'telegram' or receivers is not None
+                 or len(config.telegram_receiver_ids()) > 0]
+    return [(notifier, receivers, expose) for expose in exposes for notifier in notifiers]
+
+
+class QueueNotificationsProcessor(Processor):
+    """Processor that adds a notification per configured notifier to the outbox for
+       each expose, and marks the exposes as processed"""
+
+    # Number of exposes that are queued at once
+    BATCH_SIZE = 50
+
+    def __init__(self, config: YamlConfig, id_watch, receivers=None):
+        self.config = config
+        self.id_watch = id_watch
+        self.receivers = receivers
+
+    def process_expose(self, expose):
+        """Queue the notifications for a single expose"""
+        self.id_watch.queue_notifications(
+            [expose], notifications_for(self.config, [expose], self.receivers))
+        return expose
+
+    def process_exposes(self, exposes):
+        """Queue the notifications for the exposes in batches"""
+        def queue(batch):
+            self.id_watch.queue_notifications(
+                batch, notifications_for(self.config, batch, self.receivers))
+            return batch
+
+        return BatchedIterator(exposes, self.BATCH_SIZE, queue)
+
+
+class NotificationDispatcher:
+    """Delivers the notifications in the outbox. The outbox can be drained inline,
+       on the calling thread, or by a background worker that is woken up after
+       every hunt. Notifications for different receivers are sent concurrently;
+       database access stays on the draining thread"""
+
+    # Number of notifications fetched from the outbox at once
+    BATCH_SIZE = 100
+    # Attempts before an undeliverable notification is dropped
+    MAX_ATTEMPTS = 5
+    # Delay before the first retry, doubled for every further attempt
+    RETRY_DELAY = datetime.timedelta(seconds=30)
+    # Seconds between checks of the outbox for notifications due for a retry
+    POLL_INTERVAL = 60
+
+    def __init__(self, config: YamlConfig, id_watch,
+                 on_undeliverable: Optional[Callable[[int], None]] = None):
+        self.config = config
+        self.id_watch = id_watch
+        self.on_undeliverable = on_undeliverable
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+
+    def deliver(self, notifications: List[Dict]) -> Tuple[List, List, List]:
+        """Send a batch of notifications. Returns the IDs of the notifications that
+           are done with, the (ID, attempts) pairs of those that failed, and the
+           receivers that cannot be reached"""
+        groups: Dict[Tuple, List[Dict]] = {}
+        for notification in notifications:
+            receivers = notification['receivers']
+            key = (notification['notifier'], None if receivers is None else tuple(receivers))
+            groups.setdefault(key, []).append(notification)
+
+        def deliver_group(notifications):
+            """Send the notifications for one notifier and set of receivers, in order"""
+            (done, failed, unreachable) = ([], [], [])
+            notifier = build_notifier(self.config, notifications[0]['notifier'],
+                                      notifications[0]['receivers'])
+            for notification in notifications:
+                try:
+                    notifier.process_expose(notification['expose'])
+                    done.append(notification['id'])
+                except (BotBlockedException, UserDeactivatedException) as error:
+                    logger.warning("Receivers %s cannot be reached: %s",
+                                   notification['receivers'], error)
+                    done.append(notification['id'])
+                    unreachable.extend(notification['receivers'] or [])
+                except Exception: # pylint: disable=broad-exception-caught
+                    logger.exception("Error sending notification %s via %s",
+                                     notification['id'], notification['notifier'])
+                    failed.append((notification['id'], notification['attempts'] + 1))
+            return (done, failed, unreachable)
+
+        max_workers = max(1, min(self.config.telegram_max_workers(), len(groups)))
+        with ThreadPoolExecutor(max_workers=max_workers,
+                                thread_name_prefix='notify') as executor:
+            results = list(executor.map(deliver_group, groups.values()))
+        (done, failed, unreachable) = ([], [], [])
+        for (group_done, group_failed, group_unreachable) in results:
+            done.extend(group_done)
+            failed.extend(group_failed)
+            unreachable.extend(group_unreachable)
+        return (done, failed, list(dict.fromkeys(unreachable)))
+
+    def drain(self) -> int:
+        """Deliver all notifications that are due, in batches. Returns the number of
+           notifications removed from the outbox after being sent"""
+        delivered = 0
+        while notifications := self.id_watch.get_due_notifications(self.BATCH_SIZE):
+            (done, failed, unreachable) = self.deliver(notifications)
+            delivered += len(done)
+            retries = []
+            for (notification_id, attempts) in failed:
+                if attempts >= self.MAX_ATTEMPTS:
+                    logger.error("Giving up on notification %s after %d attempts",
+                                 notification_id, attempts)
+                    done.append(notification_id)
+                else:
+                    retries.append((notification_id, attempts, datetime.datetime.now()
+                                    + self.RETRY_DELAY * 2 ** (attempts - 1)))
+            self.id_watch.retry_notifications(retries)
+            self.id_watch.acknowledge_notifications(done)
+            if self.on_undeliverable is not None:
+                for receiver in unreachable:
+                    self.on_undeliverable(receiver)
+        return delivered
+
+    def run(self):
+        """Drain the outbox whenever woken up, and periodically for retries"""
+        while True:
+            # drain once more after being asked to stop
+            stopping = self.stopping.is_set()
+            self.wakeup.clear()
+            try:
+                self.drain()
+            except Exception: # pylint: disable=broad-exception-caught
+                logger.exception("Error draining the notification outbox")
+            if stopping:
+                return
+            self.wakeup.wait(self.POLL_INTERVAL)
+
+    def start(self):
+        """Drain the outbox on a background thread from now on. The database of the
+           id maintainer must be accessible from that thread (i.e. not in-memory)"""
+        if self.thread is not None:
+            return
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self.run, name='notifications', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop the background thread, once it has delivered the due notifications"""
+        if self.thread is None:
+            return
+        self.stopping.set()
+        self.wakeup.set()
+        self.thread.join()
+        self.thread = None
+
+    def dispatch(self):
+        """Deliver the notifications queued by a hunt: wake up the background thread
+           if it is running, otherwise drain the outbox on the calling thread"""
+        if self.thread is not None:
+            self.wakeup.set()
+        else:
+            self.drain()
@@ -1,10 +1,9 @@
 """Functions and classes related to sending Telegram messages"""
 import json
 
-import requests
-
 from flathunter.abstract_notifier import Notifier
 from flathunter.abstract_processor import Processor
+from flathunter.exceptions import NotificationFailedException
 from flathunter.logging import logger
 
 
@@ -37,7 +36,7 @@ class SenderMattermost(Processor, Notifier):
         """Send messages to the mattermost webhook"""
         logger.debug(('webhook_url:', self.webhook_url))
         logger.debug(('message', message))
-        resp = requests.post(
+        resp = self.config.http_session().post(
             self.webhook_url,
             data=json.dumps({"text": message}),
             timeout=30
@@ -51,3 +50,5 @@ class SenderMattermost(Processor, Notifier):
                 resp.status_code,
                 resp.text
             )
+            raise NotificationFailedException(
+                f"Mattermost webhook call failed with status {resp.status_code}")
@@ -2,11 +2,10 @@
 import json
 from typing import Dict
 
-import requests
-
 from flathunter.abstract_notifier import Notifier
 from flathunter.abstract_processor import Processor
 from flathunter.config import YamlConfig
+from flathunter.exceptions import NotificationFailedException
 from flathunter.logging import logger
 
 
@@ -39,7 +38,7 @@ class SenderSlack(Processor, Notifier):
         """Send messages to the Slack webhook"""
         logger.debug(('webhook_url:', self.webhook_url))
         logger.debug(('message', message))
-        response = requests.post(
+        response = self.config.http_session().post(
             self.webhook_url,
             data=json.dumps({"text": message}),
             timeout=30
@@ -52,3 +51,5 @@ class SenderSlack(Processor, Notifier):
                 response.status_code,
                 response.text
             )
+            raise NotificationFailedException(
+                f"Slack webhook call failed with status {response.status_code}")
@@ -1,15 +1,14 @@
 """Functions and classes related to sending Telegram messages"""
 import json
-import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Optional
 
-import requests
-
 from flathunter.abstract_notifier import Notifier
 from flathunter.abstract_processor import Processor
 from flathunter.config import YamlConfig
 from flathunter.exceptions import BotBlockedException
 from flathunter.exceptions import UserDeactivatedException
+from flathunter.exceptions import NotificationFailedException
 from flathunter.logging import logger
 from flathunter.utils.list import chunk_list
 
@@ -17,10 +16,15 @@ from flathunter.utils.list import chunk_list
 class SenderTelegram(Processor, Notifier):
     """Expose processor that sends Telegram messages"""
 
+    # A request that Telegram rejects with 'Too Many Requests' is retried once, after
+    # the time Telegram asks us to wait
+    MAX_ATTEMPTS = 2
+
     def __init__(self, config: YamlConfig, receivers=None):
         self.config = config
         self.bot_token = self.config.telegram_bot_token()
         self.__notify_with_images: bool = self.config.telegram_notify_with_images()
+        self.rate_limiter = self.config.telegram_rate_limiter()
 
         self.__text_message_url = f"https://api.telegram.org/bot{self.bot_token}/sendMessage"
         self.__media_group_url = f"https://api.telegram.org/bot{self.bot_token}/sendMediaGroup"
@@ -44,19 +48,42 @@ class SenderTelegram(Processor, Notifier):
                     message: str,
                     images: Optional[List[str]] = None) -> None:
         """
-        Broadcast given message to the given receiver ids
+        Broadcast given message to the given receiver ids. Receivers are sent to
+        concurrently, within the rate limits shared by all senders
         :param receivers: list of user/group ids
         :param message: text message to send to users
         :param images: images to send to users as a reply to message
         :return: None
         """
-        for receiver in receivers:
-            msg = self.__send_text(receiver, message)
-            if not msg:
-                continue
+        receivers = receivers or []
+        max_workers = min(self.config.telegram_max_workers(), len(receivers))
+        if max_workers <= 1:
+            for receiver in receivers:
+                self.__send_to_receiver(receiver, message, images)
+            return
+
+        with ThreadPoolExecutor(max_workers=max_workers,
+                                thread_name_prefix='telegram') as executor:
+            futures = [executor.submit(self.__send_to_receiver, receiver, message, images)
+                       for receiver in receivers]
+        for future in futures:
+            # re-raises errors such as BotBlockedException
+            future.result()
+
+    def __send_to_receiver(self, chat_id: int, message: str, images: Optional[List[str]]):
+        """
+        Send the message to one receiver, followed by the images as a reply to it
+        :param chat_id: the receiver id
+        :param message: text message to send to the user
+        :param images: images to send to the user as a reply to message
+        :return: None
+        """
+        msg = self.__send_text(chat_id, message)
+        if not msg:
+            return
 
-            if self.__notify_with_images and images:
-                self.__send_images(chat_id=receiver, msg=msg, images=images)
+        if self.__notify_with_images and images:
+            self.__send_images(chat_id=chat_id, msg=msg, images=images)
 
     def notify(self, message: str):
         """
@@ -82,17 +109,8 @@ class SenderTelegram(Processor, Notifier):
         logger.debug(('token:', self.bot_token))
         logger.debug(('chat_id:', chat_id))
         logger.debug(('text:', message))
-        logger.debug("Retrieving URL %s, payload %s", self.__text_message_url, payload)
-        response = requests.request("POST", self.__text_message_url, data=payload, timeout=30)
-        logger.debug("Got response (%i): %s", response.status_code, response.content)
-
-        # handle error
-        if response.status_code != 200:
-            self.__handle_error("When sending bot text message, we got an error.",
-                response, chat_id)
-            return {}
-
-        return response.json().get('result', {})
+        return self.__post(self.__text_message_url, payload, chat_id,
+                           "When sending bot text message, we got an error.")
 
     def __send_images(self, chat_id: int, msg: Dict, images: List[str]):
         """
@@ -115,24 +133,50 @@ class SenderTelegram(Processor, Notifier):
             if msg.get('message_id', None):
                 payload['reply_to_message_id'] = msg.get('message_id')
 
-            response = requests.request("POST", self.__media_group_url, data=payload, timeout=30)
-
-            if response.status_code != 200:
+            try:
+                self.__post(self.__media_group_url, payload, chat_id,
+                            "When sending media group, we got an error.")
+            except NotificationFailedException:
+                # the text message has been delivered; sending it again for the sake
+                # of its images would only duplicate it
                 logger.warning("Error sending media group: %s", json.dumps(payload))
-                self.__handle_error(
-                    "When sending media group, we got an error.",
-                    response=response,
-                    chat_id=str(chat_id)
-                )
                 return
 
-    def __handle_error(self, msg: str, response, chat_id) -> None:
+    def __post(self, url: str, payload: Dict, chat_id: int, error_message: str) -> Dict:
+        """
+        Send a request to the bot API, waiting for the global and per-chat rate limits
+        :param url: the API method to call
+        :param payload: the parameters of the call
+        :param chat_id: the receiver of the message
+        :param error_message: the message to log if the call fails
+        :return: the result of the call
+
+        :raise NotificationFailedException: Happens when the API rejects the call, or
+            still asks us to back off after the last attempt
+        """
+        for attempt in range(1, self.MAX_ATTEMPTS + 1):
+            self.rate_limiter.acquire(chat_id)
+            logger.debug("Retrieving URL %s, payload %s", url, payload)
+            response = self.config.http_session().request("POST", url, data=payload, timeout=30)
+            logger.debug("Got response (%i): %s", response.status_code, response.content)
+            if response.status_code == 200:
+                return response.json().get('result', {})
+            retry_after = self.__handle_error(error_message, response, chat_id)
+            if retry_after is None:
+                break
+            if attempt < self.MAX_ATTEMPTS:
+                logger.info("Retrying message to %s in %d seconds", chat_id, retry_after)
+        raise NotificationFailedException(
+            f"Telegram API call for chat {chat_id} failed with status {response.status_code}")
+
+    def __handle_error(self, msg: str, response, chat_id) -> Optional[int]:
         """
         Handles telegram API error responses
         :param msg: the message for logging
         :param response: the response that is received form the API
         :param chat_id: the receiver that was supposed to get the message
-        :return: None
+        :return: the number of seconds to wait before retrying, if the request
+            should be retried
 
         :raise BotBlockedException: Happens when bot trys to send a message to a user that
             has already blocked the bot
@@ -151,9 +195,10 @@ class SenderTelegram(Processor, Notifier):
                 raise UserDeactivatedException(f"User {chat_id} has been deactivated")
         if response.status_code == 429:
             if "Too Many Requests" in data.get("description", ""):
-                backoff = data.get("parameters", {}).get("retry_after", 30)
-                time.sleep(min(backoff, 30))
-                return None
+                backoff = min(data.get("parameters", {}).get("retry_after", 30), 30)
+                # only hold back messages to this chat - other chats carry on
+                self.rate_limiter.pause(chat_id, backoff)
+                return backoff
         return None
 
     def __get_images(self, expose: Dict) -> List[str]:
@@ -0,0 +1,58 @@
+"""Incremental crawling of paginated search results. When the results of a search
+are sorted newest first, the pages after a page that only holds exposes seen in
+earlier crawls hold nothing new either, so they need not be fetched"""
+import threading
+from typing import Dict, Iterable, List, NamedTuple
+
+from flathunter.logging import logger
+
+
+class PaginationStats(NamedTuple):
+    """Number of result pages fetched for a search URL, and not fetched because the
+       newest results were all known already"""
+    pages_fetched: int
+    pages_saved: int
+
+
+class IncrementalPagination:
+    """Checks pages of search results against the exposes in the database as they
+       arrive, and records per search URL how many pages were fetched and saved"""
+
+    def __init__(self, id_watch):
+        self.id_watch = id_watch
+        self.lock = threading.Lock()
+        self.stats: Dict[str, PaginationStats] = {}
+
+    def all_known(self, entries: Iterable[Dict]) -> bool:
+        """True if every expose on a page has been saved in an earlier crawl. An empty
+           page does not count as known"""
+        ids_by_crawler: Dict[str, List] = {}
+        for entry in entries:
+            ids_by_crawler.setdefault(entry.get('crawler', ''), []).append(entry['id'])
+        if len(ids_by_crawler) == 0:
+            return False
+        for (crawler, expose_ids) in ids_by_crawler.items():
+            if len(self.id_watch.filter_unknown(expose_ids, crawler)) > 0:
+                return False
+        return True
+
+    def record(self, url: str, pages_fetched: int, pages_saved: int):
+        """Add the pages fetched and saved for a search URL to the statistics"""
+        with self.lock:
+            (fetched, saved) = self.stats.get(url, PaginationStats(0, 0))
+            self.stats[url] = PaginationStats(fetched + pages_fetched, saved + pages_saved)
+
+    def cycle_stats(self) -> Dict[str, PaginationStats]:
+        """Pages fetched and saved per search URL, since the previous call"""
+        with self.lock:
+            (stats, self.stats) = (self.stats, {})
+        return stats
+
+    def log_cycle_stats(self):
+        """Log the pagination statistics since the previous call"""
+        stats = self.cycle_stats()
+        for (url, (fetched, saved)) in stats.items():
+            logger.debug("Pagination of %s: %d pages fetched, %d saved", url, fetched, saved)
+        logger.info("Pagination: %d pages fetched, %d pages saved by incremental crawling",
+                    sum(fetched for (fetched, _) in stats.values()),
+                    sum(saved for (_, saved) in stats.values()))
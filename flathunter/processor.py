@@ -8,7 +8,8 @@ from flathunter.default_processors import LambdaProcessor
 from flathunter.default_processors import CrawlExposeDetails
 from flathunter.notifiers import SenderMattermost, SenderTelegram, SenderApprise, SenderSlack
 from flathunter.gmaps_duration_processor import GMapsDurationProcessor
-from flathunter.idmaintainer import SaveAllExposesProcessor
+from flathunter.idmaintainer import IdMaintainer, SaveAllExposesProcessor
+from flathunter.notification_outbox import QueueNotificationsProcessor
 from flathunter.abstract_processor import Processor
 
 class ProcessorChainBuilder:
@@ -32,17 +33,25 @@ class ProcessorChainBuilder:
             self.processors.append(SenderSlack(self.config))
         return self
 
+    def queue_notifications(self, id_watch, receivers=None):
+        """Add processor that queues notifications for exposes in the outbox, and
+           marks the exposes as processed"""
+        self.processors.append(QueueNotificationsProcessor(self.config, id_watch, receivers))
+        return self
+
     def resolve_addresses(self):
         """Add processor that resolves addresses from expose pages"""
         self.processors.append(AddressResolver(self.config))
         return self
 
-    def calculate_durations(self):
-        """Add processor to calculate durations, if enabled"""
+    def calculate_durations(self, id_watch=None):
+        """Add processor to calculate durations, if enabled. Results are cached in the
+           database of the id maintainer, if it is an SQLite database"""
         durations_enabled = "google_maps_api" in self.config \
                             and self.config["google_maps_api"]["enable"]
         if durations_enabled:
-            self.processors.append(GMapsDurationProcessor(self.config))
+            cache_store = id_watch if isinstance(id_watch, IdMaintainer) else None
+            self.processors.append(GMapsDurationProcessor(self.config, cache_store))
         return self
 
     def crawl_expose_details(self):
@@ -0,0 +1,154 @@
+"""Index of the filters of all web users, mapping each expose to the users whose
+filters it passes without running every user's filter chain"""
+import bisect
+import math
+import re
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from flathunter.config import YamlConfig
+from flathunter.filter import ExposeRecord
+
+
+def price_per_square(record: ExposeRecord) -> Optional[float]:
+    """Price per square metre of an expose, if known"""
+    if record.price is None or not record.size:
+        return None
+    return record.price / record.size
+
+
+class SortedBounds:
+    """One kind of bound (e.g. the maximum price) of all users that set it, sorted
+       so that the users rejecting a value are found by bisection"""
+
+    def __init__(self, is_upper_bound: bool):
+        self.is_upper_bound = is_upper_bound
+        self.entries: List[Tuple[float, int]] = []
+
+    def add(self, bound: float, user_id: int):
+        """Add a user's bound"""
+        bisect.insort(self.entries, (bound, user_id))
+
+    def remove(self, bound: float, user_id: int):
+        """Remove a user's bound"""
+        index = bisect.bisect_left(self.entries, (bound, user_id))
+        if index < len(self.entries) and self.entries[index] == (bound, user_id):
+            del self.entries[index]
+
+    def rejecting_users(self, value: float) -> Iterable[int]:
+        """The users whose bound excludes the value"""
+        if self.is_upper_bound:
+            end = bisect.bisect_left(self.entries, (value,))
+            return (user_id for (_, user_id) in self.entries[:end])
+        start = bisect.bisect_right(self.entries, (value, math.inf))
+        return (user_id for (_, user_id) in self.entries[start:])
+
+
+class TitleExclusions:
+    """The excluded title patterns of all users. All patterns are compiled into a
+       single expression, so that titles matching none of them - the common case - are
+       checked in one pass; only titles that match are checked pattern by pattern"""
+
+    def __init__(self):
+        self.users_by_pattern: Dict[str, Set[int]] = {}
+        self.compiled: Dict[str, re.Pattern] = {}
+        self.combined: Optional[re.Pattern] = None
+
+    def add(self, pattern: str, user_id: int):
+        """Add an excluded title pattern of a user"""
+        if pattern not in self.users_by_pattern:
+            self.users_by_pattern[pattern] = set()
+            self.compiled[pattern] = re.compile(pattern, re.IGNORECASE)
+            self.combined = None
+        self.users_by_pattern[pattern].add(user_id)
+
+    def remove(self, pattern: str, user_id: int):
+        """Remove an excluded title pattern of a user"""
+        users = self.users_by_pattern.get(pattern)
+        if users is None:
+            return
+        users.discard(user_id)
+        if len(users) == 0:
+            del self.users_by_pattern[pattern]
+            del self.compiled[pattern]
+            self.combined = None
+
+    def rejecting_users(self, title: str) -> Iterable[int]:
+        """The users that exclude the title"""
+        if len(self.users_by_pattern) == 0:
+            return []
+        if self.combined is None:
+            self.combined = re.compile(
+                "|".join(f"(?:{pattern})" for pattern in self.users_by_pattern), re.IGNORECASE)
+        if self.combined.search(title) is None:
+            return []
+        return (user_id for (pattern, users) in self.users_by_pattern.items()
+                if self.compiled[pattern].search(title) for user_id in users)
+
+
+class SubscriptionIndex:
+    """Maps an expose to the users whose filters it passes. A user's filters match
+       the filters built from their settings by FilterBuilder.read_config. Users that
+       have muted notifications are not indexed"""
+
+    # Numeric bounds: config accessor, value of the expose that is bounded, upper bound?
+    BOUNDS: List[Tuple[str, Callable[[ExposeRecord], Optional[float]], bool]] = [
+        ('min_price', lambda record: record.price, False),
+        ('max_price', lambda record: record.price, True),
+        ('min_size', lambda record: record.size, False),
+        ('max_size', lambda record: record.size, True),
+        ('min_rooms', lambda record: record.rooms, False),
+        ('max_rooms', lambda record: record.rooms, True),
+        ('max_price_per_square', price_per_square, True),
+    ]
+
+    def __init__(self):
+        self.bounds = {name: SortedBounds(is_upper_bound)
+                       for (name, _, is_upper_bound) in self.BOUNDS}
+        self.titles = TitleExclusions()
+        # the bounds and title patterns of each indexed user, to remove them again
+        self.users: Dict[int, Tuple[Dict[str, float], List[str]]] = {}
+
+    @classmethod
+    def from_user_settings(cls, user_settings: Iterable[Tuple[int, Dict]]):
+        """Build the index from the (user ID, settings) pairs in the database"""
+        index = cls()
+        for (user_id, settings) in user_settings:
+            index.update_user(user_id, settings)
+        return index
+
+    def update_user(self, user_id: int, settings: Optional[Dict]):
+        """Replace the filters of a user with the ones in their new settings"""
+        self.remove_user(user_id)
+        if settings is None or 'mute_notifications' in settings:
+            return
+        config = YamlConfig(settings)
+        bounds = {}
+        for (name, _, _) in self.BOUNDS:
+            bound = getattr(config, name)()
+            if bound:
+                bounds[name] = bound
+                self.bounds[name].add(bound, user_id)
+        titles = list(dict.fromkeys(config.excluded_titles()))
+        for pattern in titles:
+            self.titles.add(pattern, user_id)
+        self.users[user_id] = (bounds, titles)
+
+    def remove_user(self, user_id: int):
+        """Remove a user's filters from the index"""
+        if user_id not in self.users:
+            return
+        (bounds, titles) = self.users.pop(user_id)
+        for (name, bound) in bounds.items():
+            self.bounds[name].remove(bound, user_id)
+        for pattern in titles:
+            self.titles.remove(pattern, user_id)
+
+    def matching_users(self, record: ExposeRecord) -> List[int]:
+        """The IDs of the users whose filters the expose passes"""
+        rejected: Set[int] = set()
+        for (name, value_of, _) in self.BOUNDS:
+            value = value_of(record)
+            if value is not None:
+                rejected.update(self.bounds[name].rejecting_users(value))
+        rejected.update(self.titles.rejecting_users(record.expose.get('title', '')))
+        return [user_id for user_id in self.users if user_id not in rejected]
@@ -0,0 +1,70 @@
+"""Processing of sequences of exposes in batches, without holding exposes back.
+
+Exposes reach the processors while the crawls are still running. A processor that
+waited for a full batch would hold back the first exposes until enough of them had
+been crawled, or until every crawl was done. Iterators that can tell whether their
+next item is available without waiting (with a 'ready' method) let processors take
+a partial batch instead, and pass its exposes on right away."""
+from collections import deque
+from typing import Any, Callable, Deque, Iterable, Iterator, List, Optional
+
+
+def is_ready(iterator: Iterator) -> bool:
+    """True if the next item of the iterator is available without waiting. Iterators
+       that cannot tell are taken to be ready"""
+    ready = getattr(iterator, 'ready', None)
+    return ready() if ready is not None else True
+
+
+def take_ready(iterator: Iterator, size: int) -> List:
+    """The next item of the iterator, waiting for it if need be, followed by the items
+       after it that are ready, up to 'size' items in all. Empty once the iterator is
+       exhausted"""
+    batch: List = []
+    for item in iterator:
+        batch.append(item)
+        if len(batch) >= size or not is_ready(iterator):
+            break
+    return batch
+
+
+class BatchedIterator:
+    """Iterator over the results of processing the items of another iterator in
+       batches of up to 'size' items. A batch is processed as soon as no further item
+       is ready, and 'on_done' is called once all items have been processed"""
+
+    def __init__(self, items: Iterable, size: int,
+                 process_batch: Callable[[List], Iterable],
+                 on_done: Optional[Callable[[], Any]] = None):
+        self.items = iter(items)
+        self.size = size
+        self.process_batch = process_batch
+        self.on_done = on_done
+        self.processed: Deque = deque()
+        self.done = False
+
+    def ready(self) -> bool:
+        """True if the next result is available without waiting for further items.
+           Items that are ready are processed to find out"""
+        while len(self.processed) == 0 and not self.done and is_ready(self.items):
+            self._process_next_batch()
+        return len(self.processed) > 0 or self.done
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while len(self.processed) == 0:
+            if self.done:
+                raise StopIteration
+            self._process_next_batch()
+        return self.processed.popleft()
+
+    def _process_next_batch(self):
+        batch = take_ready(self.items, self.size)
+        if len(batch) == 0:
+            self.done = True
+            if self.on_done is not None:
+                self.on_done()
+        else:
+            self.processed.extend(self.process_batch(batch))
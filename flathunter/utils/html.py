@@ -0,0 +1,94 @@
+"""Utilities for extracting exposes from HTML with lxml. Parsing a results page into
+an lxml tree, and querying it with compiled XPath expressions, takes a fraction of
+the time needed to build a BeautifulSoup tree of the page. The helpers here match
+the results of the BeautifulSoup calls they stand in for"""
+import re
+from typing import Callable, Iterable, Iterator, List, Optional, Union
+
+from bs4 import UnicodeDammit
+from lxml import etree, html
+
+# Text nodes that are part of the text of an element in BeautifulSoup, which leaves
+# out the contents of scripts, stylesheets and templates
+TEXT_NODES = etree.XPath(
+    './/text()[not(ancestor::script or ancestor::style or ancestor::template)]',
+    smart_strings=False)
+
+CHARSET = re.compile(r'charset=["\']?([\w.:-]+)', re.IGNORECASE)
+
+
+def parse_html(content: Union[bytes, str]) -> html.HtmlElement:
+    """Parse an HTML page into an lxml tree. The encoding of the page is detected
+       the same way as by BeautifulSoup"""
+    if isinstance(content, str):
+        (content, encoding) = (content.encode('utf-8'), 'utf-8')
+    else:
+        encoding = UnicodeDammit(content, is_html=True).original_encoding
+    try:
+        return html.document_fromstring(content, parser=html.HTMLParser(encoding=encoding))
+    except etree.ParserError:
+        # An empty page
+        return html.document_fromstring('<html></html>')
+
+
+def has_class(css_class: str) -> str:
+    """XPath condition for elements with a CSS class, as matched by BeautifulSoup's
+       find(name, {'class': css_class}). A value with several classes has to match
+       the whole class attribute"""
+    if ' ' in css_class:
+        return f"normalize-space(@class)='{css_class}'"
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {css_class} ')"
+
+
+def first(elements: List[html.HtmlElement]) -> Optional[html.HtmlElement]:
+    """The first result of an XPath query, if any"""
+    return elements[0] if len(elements) > 0 else None
+
+
+def text_of(element: html.HtmlElement) -> str:
+    """The text of an element and its descendants, as returned by 'text' on a
+       BeautifulSoup tag"""
+    return ''.join(TEXT_NODES(element))
+
+
+def child_texts(element: html.HtmlElement) -> List[str]:
+    """The text of each child node of an element, including the text between child
+       elements, as found by 'text' on the 'children' of a BeautifulSoup tag"""
+    texts = [element.text] if element.text else []
+    for child in element:
+        # Comments and processing instructions have no text in BeautifulSoup
+        texts.append(text_of(child) if isinstance(child.tag, str) else '')
+        if child.tail:
+            texts.append(child.tail)
+    return texts
+
+
+def charset(content_type: Optional[str]) -> Optional[str]:
+    """The character set in a Content-Type header, if it names one"""
+    match = CHARSET.search(content_type or '')
+    return match[1] if match else None
+
+
+def iter_elements(chunks: Iterable[bytes], select: Callable[[etree.ElementBase], bool],
+                  encoding: Optional[str] = None) -> Iterator[etree.ElementBase]:
+    """Parse HTML incrementally from chunks of a page as they arrive, and yield the
+       elements for which 'select' is true as soon as their end tag is parsed. Once
+       the next element is requested, the yielded element and the elements before it
+       are removed from the tree, so the tree never holds the whole page"""
+    parser = etree.HTMLPullParser(events=('end',), encoding=encoding)
+    parser.set_element_class_lookup(html.HtmlElementClassLookup())
+
+    def selected_elements():
+        for (_, element) in parser.read_events():
+            if isinstance(element.tag, str) and select(element):
+                yield element
+                element.clear()
+                parent = element.getparent()
+                while parent is not None and element.getprevious() is not None:
+                    del parent[0]
+
+    for chunk in chunks:
+        parser.feed(chunk)
+        yield from selected_elements()
+    parser.close()
+    yield from selected_elements()
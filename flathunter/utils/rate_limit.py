@@ -0,0 +1,116 @@
+"""Thread-safe token bucket rate limiting"""
+import threading
+import time
+from typing import Callable, Dict, Hashable
+
+
+class TokenBucket:  # pylint: disable=too-many-instance-attributes
+    """Allows bursts of up to 'capacity' events, refilled at 'rate' events per second.
+       Callers block in acquire until a token is available. Time is read from 'clock'
+       and waited for with 'sleep', which tests can replace"""
+
+    def __init__(self, rate: float, capacity: float,
+                 clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = capacity
+        self.updated = clock()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float):
+        """Add the tokens accumulated since the last update"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self) -> float:
+        """Take a token if one is available. Returns 0 on success, or else the number
+           of seconds until a token will be available"""
+        with self.lock:
+            now = self.clock()
+            if now < self.paused_until:
+                return self.paused_until - now
+            self._refill(now)
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self):
+        """Take a token, waiting for one to become available"""
+        while (wait := self.try_acquire()) > 0:
+            self.sleep(wait)
+
+    def pause(self, seconds: float):
+        """Hand out no tokens for the given time, e.g. when the server asks us to back off"""
+        with self.lock:
+            now = self.clock()
+            self.paused_until = max(self.paused_until, now + seconds)
+            self._refill(now)
+            self.tokens = min(self.tokens, 0)
+
+    def idle(self) -> bool:
+        """True if the bucket is full and not paused, i.e. no different from a new one"""
+        with self.lock:
+            now = self.clock()
+            self._refill(now)
+            return now >= self.paused_until and self.tokens >= self.capacity
+
+
+class KeyedRateLimiter:  # pylint: disable=too-many-instance-attributes
+    """A global token bucket, plus one token bucket per key (e.g. per receiver).
+       Pausing a key only holds back the callers for that key. Idle buckets are
+       dropped as new keys come in, so that the number of buckets stays bounded by the
+       number of recently active keys"""
+
+    # Number of buckets above which idle buckets are dropped; raised as needed to
+    # keep the sweeps infrequent
+    MIN_SWEEP_SIZE = 64
+
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    def __init__(self, rate: float, capacity: float, rate_per_key: float, capacity_per_key: float,
+                 clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep):
+        self.bucket = TokenBucket(rate, capacity, clock, sleep)
+        self.rate_per_key = rate_per_key
+        self.capacity_per_key = capacity_per_key
+        self.clock = clock
+        self.sleep = sleep
+        self.buckets: Dict[Hashable, TokenBucket] = {}
+        self.sweep_size = self.MIN_SWEEP_SIZE
+        self.lock = threading.Lock()
+
+    def _bucket_for(self, key: Hashable) -> TokenBucket:
+        """Return the token bucket of a key, creating it on first use. The caller holds
+           the lock, so that the bucket is not dropped while it is being used"""
+        if key not in self.buckets:
+            if len(self.buckets) >= self.sweep_size:
+                self.buckets = {other: bucket for (other, bucket) in self.buckets.items()
+                                if not bucket.idle()}
+                self.sweep_size = max(self.MIN_SWEEP_SIZE, 2 * len(self.buckets))
+            self.buckets[key] = TokenBucket(self.rate_per_key, self.capacity_per_key,
+                                            self.clock, self.sleep)
+        return self.buckets[key]
+
+    def bucket_for(self, key: Hashable) -> TokenBucket:
+        """Return the token bucket of a key, creating it on first use"""
+        with self.lock:
+            return self._bucket_for(key)
+
+    def acquire(self, key: Hashable):
+        """Wait for a token for the key, and then for a global token"""
+        while True:
+            with self.lock:
+                wait = self._bucket_for(key).try_acquire()
+            if wait <= 0:
+                break
+            self.sleep(wait)
+        self.bucket.acquire()
+
+    def pause(self, key: Hashable, seconds: float):
+        """Hold back all requests for the key for the given time"""
+        with self.lock:
+            self._bucket_for(key).pause(seconds)
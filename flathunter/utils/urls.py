@@ -0,0 +1,26 @@
+"""Utilities for normalizing search URLs"""
+import re
+from typing import Dict, Iterable, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+# Query parameters added by ad campaigns and analytics, which do not change the search
+TRACKING_PARAMETERS = re.compile(
+    r'^(utm_.*|gclid|gclsrc|dclid|fbclid|msclkid|yclid|igshid|mc_cid|mc_eid|_ga|_gl)$')
+
+
+def normalize_url(url: str, remove: Iterable[str] = (),
+                  replace: Optional[Dict[str, str]] = None) -> str:
+    """Normalize a URL, so that URLs for the same search compare equal: the scheme and
+       host are lowercased, the fragment and tracking parameters are dropped, and the
+       query parameters are sorted by name. Parameters in 'remove' are dropped as
+       well, and those in 'replace' are set to the given values"""
+    replace = replace or {}
+    remove = set(remove) | set(replace)
+    parts = urlsplit(url)
+    params = [(name, value)
+              for (name, value) in parse_qsl(parts.query, keep_blank_values=True)
+              if name not in remove and TRACKING_PARAMETERS.match(name) is None]
+    params.extend(replace.items())
+    params.sort(key=lambda param: param[0])
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path,
+                       urlencode(params), ''))
@@ -1,60 +1,63 @@
 """Flathunter implementation for website"""
-from flathunter.config import YamlConfig
 from flathunter.logging import logger
 from flathunter.hunter import Hunter
-from flathunter.filter import Filter
+from flathunter.filter import ExposeRecord
 from flathunter.processor import ProcessorChain
-from flathunter.exceptions import BotBlockedException, UserDeactivatedException
+from flathunter.notification_outbox import NotificationDispatcher, notifications_for
+from flathunter.subscription_index import SubscriptionIndex
 
 class WebHunter(Hunter):
     """Flathunter implementation for website. Designed to hunt all exposes from
        all sites and save them to the database. Includes support for multiple users
        with individual filters implemented in-app"""
 
+    def __init__(self, config, id_watch):
+        super().__init__(config, id_watch)
+        self.notification_dispatcher = NotificationDispatcher(
+            config, id_watch, on_undeliverable=self.mute_unreachable_user)
+
+    def subscription_index(self) -> SubscriptionIndex:
+        """Build the index of all users' filters from the database. The web app may
+           run in several processes, each saving settings of its own, so the index is
+           rebuilt for every hunt rather than kept up to date in memory"""
+        return SubscriptionIndex.from_user_settings(self.id_watch.get_user_settings())
+
     def hunt_flats(self, max_pages=1):
         """Crawl all URLs, and send notifications to users of new flats"""
-        filter_set = Filter.builder() \
-                       .read_config(self.config) \
-                       .filter_already_seen(self.id_watch) \
-                       .build()
-
         processor_chain = ProcessorChain.builder(self.config) \
-                                        .apply_filter(filter_set) \
+                                        .apply_filter(self.new_exposes_filter()) \
                                         .crawl_expose_details() \
                                         .save_all_exposes(self.id_watch) \
                                         .resolve_addresses() \
-                                        .calculate_durations() \
-                                        .send_messages() \
+                                        .calculate_durations(self.id_watch) \
                                         .build()
 
         new_exposes = []
-        for expose in processor_chain.process(self.crawl_for_exposes(max_pages=max_pages)):
-            new_exposes.append(expose)
-
-        for (user_id, settings) in self.id_watch.get_user_settings():
-            if 'mute_notifications' in settings:
-                continue
-            filter_set = Filter.builder().read_config(YamlConfig(settings)).build()
-            try:
-                processor_chain = ProcessorChain.builder(self.config) \
-                                                .apply_filter(filter_set) \
-                                                .send_messages([user_id]) \
-                                                .build()
-                for message in processor_chain.process(new_exposes):
-                    logger.debug("Sent expose %d to user %d", message['id'], user_id)
-            except BotBlockedException:
-                logger.warning("Bot has been blocked by user %d - updating settings", user_id)
-                settings["mute_notifications"] = True
-                self.id_watch.save_settings_for_user(user_id, settings)
-            except UserDeactivatedException:
-                logger.warning(
-                    "User %d has deactivated their telegram account - updating settings", user_id)
-                settings["mute_notifications"] = True
-                self.id_watch.save_settings_for_user(user_id, settings)
+        crawl_results = self.crawl_for_exposes(max_pages=max_pages)
+        try:
+            for expose in processor_chain.process(crawl_results):
+                new_exposes.append(expose)
+        finally:
+            crawl_results.close()
 
+        # The notifications for the configured receivers and for all matching users
+        # are queued in the outbox, and the exposes marked as processed, at once
+        notifications = notifications_for(self.config, new_exposes)
+        subscriptions = self.subscription_index()
+        for expose in new_exposes:
+            for user_id in subscriptions.matching_users(ExposeRecord.from_expose(expose)):
+                notifications.extend(notifications_for(self.config, [expose], [user_id]))
+        self.id_watch.queue_notifications(new_exposes, notifications)
+        self.end_cycle()
         self.id_watch.update_last_run_time()
         return list(new_exposes)
 
+    def mute_unreachable_user(self, user_id):
+        """Mute the notifications of a user that has blocked the bot, or has deactivated
+           their telegram account"""
+        logger.warning("User %d cannot be reached - updating settings", user_id)
+        self.set_notification_status(user_id, False)
+
     def get_last_run_time(self):
         """Return the time of last run, for display on the website"""
         return self.id_watch.get_last_run_time()
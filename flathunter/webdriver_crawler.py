@@ -1,36 +1,38 @@
 """Expose crawler for Kleinanzeigen"""
-from typing import Optional
-
-from selenium.webdriver import Chrome
 from bs4 import BeautifulSoup
 
 from flathunter.abstract_crawler import Crawler
-from flathunter.chrome_wrapper import get_chrome_driver
-from flathunter.exceptions import DriverLoadException
+from flathunter.chrome_wrapper import block_urls, blocked_urls
 
 class WebdriverCrawler(Crawler):
-    """Parent class of crawlers that use webdriver rather than `requests` to fetch pages"""
-
-    def __init__(self, config):
-        super().__init__(config)
-        self.config = config
-        self.driver = None
-
-    def get_driver(self) -> Optional[Chrome]:
-        """Lazy method to fetch the driver as required at runtime"""
-        if self.driver is not None:
-            return self.driver
-        driver_arguments = self.config.captcha_driver_arguments()
-        self.driver = get_chrome_driver(driver_arguments)
-        return self.driver
-
-    def get_driver_force(self) -> Chrome:
-        """Fetch the driver, and throw an exception if it is not configured or available"""
-        res = self.get_driver()
-        if res is None:
-            raise DriverLoadException("Unable to load chrome driver when expected")
-        return res
+    """Parent class of crawlers that use webdriver rather than `requests` to fetch pages.
+       Browsers are leased from the pool shared through the config"""
+
+    def prewarm(self):
+        """Start a browser in the background, while other crawlers are running"""
+        self.config.browser_pool().prewarm()
+
+    def load_in_browser(self, driver, url: str):
+        """Navigate the browser to the URL, recording the load time and bytes transferred"""
+        self.config.browser_pool().load(driver, url)
+
+    def performance_log(self, driver):
+        """The performance log entries since the page was loaded, including those read
+           by the browser pool to measure the page load"""
+        return self.config.browser_pool().performance_log(driver)
 
     def get_page(self, search_url, driver=None, page_no=None) -> BeautifulSoup:
         """Applies a page number to a formatted search URL and fetches the exposes at that page"""
-        return self.get_soup_from_url(search_url, driver=self.get_driver())
+        return self.get_soup_in_browser(search_url, self.config.webdriver_blocking_profile())
+
+    def get_details_page(self, url) -> BeautifulSoup:
+        """Fetch the details page of an expose, loading as few resources as possible"""
+        return self.get_soup_in_browser(url, self.config.webdriver_details_blocking_profile())
+
+    def get_soup_in_browser(self, url, profile: str) -> BeautifulSoup:
+        """Fetch a page in a pooled browser, blocking the resources of the profile
+           except for those allowed for this crawler"""
+        patterns = blocked_urls(profile, self.config.webdriver_allowed_resources(self.get_name()))
+        with self.config.browser_pool().lease() as driver:
+            block_urls(driver, patterns)
+            return self.get_soup_from_url(url, driver=driver)
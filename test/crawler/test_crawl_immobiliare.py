@@ -1,3 +1,4 @@
+import json
 import unittest
 from flathunter.crawler.immobiliare import Immobiliare
 from test.utils.config import StringConfig
@@ -27,3 +28,35 @@ class ImmobiliareCrawlerTest(unittest.TestCase):
             self.assertIsNotNone(
                 entries[0][attr], attr + " should be set (" + entries[0]['url'] + ")"
             )
+
+
+SEARCH_STATE = {'props': {'pageProps': {'dehydratedState': {'queries': [
+    {'state': {'data': {'breadcrumbs': []}}},
+    {'state': {'data': {'results': [{
+        'realEstate': {
+            'id': 112233,
+            'title': 'Bilocale via Roma 1, Milano',
+            'price': {'formattedValue': '€ 1.200/mese'},
+            'properties': [{'rooms': '2', 'surface': '55 m²',
+                            'photo': {'urls': {'small': 'https://pwm.im-cdn.it/1.jpg'}}}],
+        },
+        'seo': {'url': 'https://www.immobiliare.it/annunci/112233/'},
+    }]}}},
+]}}}}
+
+def test_results_are_extracted_from_embedded_json(mocker):
+    crawler = Immobiliare(StringConfig(string=""))
+    page = ('<html><script id="__NEXT_DATA__" type="application/json">'
+            f'{json.dumps(SEARCH_STATE)}</script></html>').encode('utf-8')
+    mocker.patch.object(crawler, 'get_html', return_value=page)
+    assert crawler.get_results(ImmobiliareCrawlerTest.TEST_URL) == [{
+        'id': 112233,
+        'image': 'https://pwm.im-cdn.it/1.jpg',
+        'url': 'https://www.immobiliare.it/annunci/112233/',
+        'title': 'Bilocale via Roma 1, Milano',
+        'price': '1.200/mese',
+        'size': '55',
+        'rooms': '2',
+        'address': 'via Roma 1, Milano',
+        'crawler': 'Immobiliare'
+    }]
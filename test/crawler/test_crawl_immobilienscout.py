@@ -3,6 +3,7 @@ from time import sleep
 
 from flathunter.crawler.immobilienscout import Immobilienscout
 from test.utils.config import StringConfig
+from test.utils.legacy import uncached_api_url
 
 DUMMY_CONFIG = """
 urls:
@@ -107,6 +108,11 @@ def test_url_conversion(crawler, test_url, test_api_url):
     api_url = crawler.compose_api_url(query)
     assert api_url == test_api_url
 
+def test_compiled_queries_match_uncached_queries(crawler):
+    for test_url in TEST_URLS:
+        assert crawler.compile_query(test_url).api_url == uncached_api_url(crawler, test_url)
+        assert '&pagenumber={0}' in crawler.compile_query(test_url).api_url
+
 @pytest.mark.parametrize("test_api_url", TEST_API_URLS)
 def test_api_response(crawler, test_api_url):
   response = crawler.fetch_api_data(test_api_url)
@@ -1,8 +1,11 @@
 import pytest
+from bs4 import BeautifulSoup
 
 from flathunter.crawler.immowelt import Immowelt
-from test.test_util import count
+from flathunter.crawler_router import CrawlerRouter
+from flathunter.utils.html import parse_html
 from test.utils.config import StringConfig
+from test.utils.pages import immowelt_page
 
 DUMMY_CONFIG = """
 urls:
@@ -28,8 +31,7 @@ def test_crawler(crawler):
         assert entries[0][attr] is not None
 
 def test_dont_crawl_other_urls(crawler):
-    exposes = crawler.crawl("https://www.example.com")
-    assert count(exposes) == 0
+    assert CrawlerRouter([crawler]).crawlers_for("https://www.example.com") == []
 
 def test_process_expose_fetches_details(crawler):
     soup = crawler.get_page(TEST_URL)
@@ -42,3 +44,29 @@ def test_process_expose_fetches_details(crawler):
         print(expose)
         for attr in [ 'title', 'price', 'size', 'rooms', 'address', 'from' ]:
             assert expose[attr] is not None
+
+RESULTS_PAGE = """<html><body><div data-testid="serp-core-scrollablelistview-testid">
+  <div class="css-79elbk">
+    <a href="https://www.immowelt.de/expose/2ab3c4d"></a>
+    <div class="css-1cbj9xw"> Wohnung am Park </div>
+    <div data-testid="cardmfe-price-testid">950 €</div>
+    <div data-testid="cardmfe-keyfacts-testid"><div>2 Zimmer</div>·<div>50 m²</div></div>
+  </div>
+</div></body></html>""".encode('utf-8')
+
+@pytest.mark.parametrize("fast_extraction", [True, False])
+def test_results_do_not_depend_on_the_parser(mocker, fast_extraction):
+    crawler = Immowelt(StringConfig(
+        string=f"crawl:\n  fast_extraction: {str(fast_extraction).lower()}\n"))
+    mocker.patch.object(crawler, 'get_html', return_value=RESULTS_PAGE)
+    extract_data = mocker.spy(crawler, 'extract_data')
+    entries = crawler.get_results(TEST_URL)
+    assert [(entry['title'], entry['price'], entry['rooms'], entry['size'], entry['image'])
+            for entry in entries] == [('Wohnung am Park', '950 €', '2 Zimmer', '50 m²', None)]
+    assert extract_data.called != fast_extraction
+
+def test_lxml_extraction_matches_soup_extraction():
+    crawler = Immowelt(StringConfig(string=""))
+    entries = crawler.extract_data(BeautifulSoup(immowelt_page(), 'lxml'))
+    assert len(entries) == 30
+    assert crawler.extract_from_tree(parse_html(immowelt_page())) == entries
@@ -0,0 +1,62 @@
+import json
+
+from bs4 import BeautifulSoup
+
+from flathunter.abstract_crawler import find_embedded_json
+from flathunter.crawler.subito import Subito
+from test.utils.config import StringConfig
+from test.utils.pages import subito_page
+
+TEST_URL = 'https://www.subito.it/annunci-lombardia/affitto/appartamenti/milano/'
+
+def subito_item(item_id, subject):
+    return {'item': {
+        'urn': f"id:ad:{item_id}",
+        'subject': subject,
+        'urls': {'default': f"https://www.subito.it/appartamenti/{item_id}.htm"},
+        'images': [],
+        'features': {'/price': {'values': [{'key': '900 €'}]},
+                     '/room': {'values': [{'key': '2'}]}},
+        'geo': {'town': {'value': 'Milano'}, 'city': {'shortName': 'MI'}, 'region': None},
+    }}
+
+SEARCH_STATE = {'props': {'state': {'items': {'list': [
+    subito_item(101, 'Bilocale in centro'),
+    subito_item(102, 'Cerco appartamento'),
+]}}}}
+
+def page_with_state(state):
+    return (f'<html><head><script id="__NEXT_DATA__" type="application/json">{state}'
+            '</script></head><body><div>Annunci</div></body></html>').encode('utf-8')
+
+def test_embedded_json_is_found_without_parsing_the_page():
+    page = b'<script>var x;</script><script type="application/json" id=__NEXT_DATA__>' \
+           b'{"a": [1]}</SCRIPT>'
+    assert find_embedded_json(page, '__NEXT_DATA__') == {'a': [1]}
+    assert find_embedded_json(page, 'other') is None
+    assert find_embedded_json(b'<script id="__NEXT_DATA__">{"a":</script>',
+                              '__NEXT_DATA__') is None
+
+def test_results_are_extracted_from_embedded_json(mocker):
+    crawler = Subito(StringConfig(string=""))
+    page = page_with_state(json.dumps(SEARCH_STATE))
+    mocker.patch.object(crawler, 'get_html', return_value=page)
+    extract_data = mocker.spy(crawler, 'extract_data')
+    entries = crawler.get_results(TEST_URL)
+    assert [(entry['id'], entry['price'], entry['rooms'], entry['size'], entry['address'])
+            for entry in entries] == [('101', '900 €', '2', '?', 'Milano, MI, ')]
+    assert not extract_data.called
+    assert entries == crawler.extract_data(BeautifulSoup(page, 'lxml'))
+
+def test_pages_without_embedded_json_are_parsed(mocker):
+    crawler = Subito(StringConfig(string=""))
+    mocker.patch.object(crawler, 'get_html', return_value=b'<html><body></body></html>')
+    extract_data = mocker.spy(crawler, 'extract_data')
+    assert crawler.get_results(TEST_URL) == []
+    assert extract_data.called
+
+def test_embedded_json_matches_soup_extraction():
+    crawler = Subito(StringConfig(string=""))
+    entries = crawler.extract_embedded_json(subito_page())
+    assert len(entries) == 30
+    assert entries == crawler.extract_data(BeautifulSoup(subito_page(), 'lxml'))
@@ -3,8 +3,12 @@ import unittest
 import pytest
 from functools import reduce
 
+from bs4 import BeautifulSoup
+
 from flathunter.crawler.vrmimmo import VrmImmo
+from flathunter.utils.html import parse_html
 from test.utils.config import StringConfig
+from test.utils.pages import vrmimmo_page
 
 class VrmImmoCrawlerTest(unittest.TestCase):
     TEST_URL = 'https://vrm-immo.de/suchergebnisse?l=Darmstadt&r=0km&_multiselect_r=0km&a=de.darmstadt&t=apartment%3Asale%3Aliving&pf=&pt=&rf=0&rt=0&sf=&st=&s=most_recently_updated_first'
@@ -30,3 +34,9 @@ class VrmImmoCrawlerTest(unittest.TestCase):
                         u"URL should be an immobilien link")
         for attr in ['title', 'price', 'size', 'rooms', 'address', 'image']:
             self.assertIsNotNone(entries[0][attr], attr + " should be set")
+
+def test_lxml_extraction_matches_soup_extraction():
+    crawler = VrmImmo(StringConfig(string=""))
+    entries = crawler.extract_data(BeautifulSoup(vrmimmo_page(), 'lxml'))
+    assert len(entries) == 30
+    assert crawler.extract_from_tree(parse_html(vrmimmo_page())) == entries
@@ -4,7 +4,9 @@ from typing import Dict
 from functools import reduce
 from bs4 import BeautifulSoup
 from flathunter.crawler.wggesucht import WgGesucht
+from flathunter.utils.html import parse_html
 from test.utils.config import StringConfig
+from test.utils.pages import wggesucht_page
 
 class WgGesuchtCrawlerTest(unittest.TestCase):
 
@@ -37,3 +39,45 @@ class WgGesuchtCrawlerTest(unittest.TestCase):
         entries = self.crawler.extract_data(soup)
         assert len(entries) == 20
 
+class StreamedResponse:
+    """Stands in for a streamed requests response, recording how much of the body
+       has been read"""
+
+    def __init__(self, body, chunk_size):
+        self.chunks = [body[start:start + chunk_size]
+                       for start in range(0, len(body), chunk_size)]
+        self.chunks_read = 0
+        self.headers = {'Content-Type': 'text/html; charset=UTF-8'}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def iter_content(self, chunk_size):
+        for chunk in self.chunks:
+            self.chunks_read += 1
+            yield chunk
+
+def test_results_are_streamed_while_the_page_downloads(mocker):
+    crawler = WgGesucht(StringConfig(string=""))
+    response = StreamedResponse(wggesucht_page(), 4096)
+    mocker.patch.object(crawler, 'get_html_stream', return_value=response)
+    exposes = crawler.get_results(WgGesuchtCrawlerTest.TEST_URL)
+    first = next(exposes)
+    assert response.chunks_read < len(response.chunks) / 2
+    entries = [first] + list(exposes)
+    assert entries == crawler.extract_from_tree(parse_html(wggesucht_page()))
+    assert len(entries) == 20
+
+def test_streaming_can_be_disabled(mocker):
+    crawler = WgGesucht(StringConfig(string="crawl:\n  stream_results: false\n"))
+    mocker.patch.object(crawler, 'get_html', return_value=wggesucht_page())
+    assert len(crawler.get_results(WgGesuchtCrawlerTest.TEST_URL)) == 20
+
+def test_lxml_extraction_matches_soup_extraction():
+    crawler = WgGesucht(StringConfig(string=""))
+    entries = crawler.extract_data(BeautifulSoup(wggesucht_page(), 'lxml'))
+    assert len(entries) == 20
+    assert crawler.extract_from_tree(parse_html(wggesucht_page())) == entries
@@ -15,7 +15,7 @@ class DummyCrawler(Crawler):
         self.titlewords = titlewords
         self.addresses_as_links = addresses_as_links
 
-    def get_results(self, search_url, max_pages=None):
+    def get_results(self, search_url, max_pages=None, pagination=None):
         logger.debug("Generating dummy results")
         entries = []
         for _ in range(randint(20, 40)):
@@ -2,6 +2,7 @@ import unittest
 
 import requests_mock
 
+from flathunter.exceptions import NotificationFailedException
 from flathunter.notifiers import SenderMattermost
 from flathunter.config import YamlConfig
 
@@ -16,3 +17,12 @@ class SenderMattermostTest(unittest.TestCase):
         m.post('http://example.com/dummy_webhook_url')
         self.assertEqual(None, sender.notify("result"),
                          "Expected message to be sent")
+
+    @requests_mock.Mocker()
+    def test_failed_message_raises(self, m):
+        sender = SenderMattermost(YamlConfig({"mattermost": {
+            "webhook_url": "http://example.com/dummy_webhook_url"}}))
+
+        m.post('http://example.com/dummy_webhook_url', status_code=500)
+        with self.assertRaises(NotificationFailedException):
+            sender.notify("result")
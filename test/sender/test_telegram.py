@@ -5,8 +5,11 @@ import datetime
 from requests_mock import Mocker
 from test.utils.request_matcher import RequestCounter
 from test.utils.config import StringConfig
+from test.utils.clock import FakeClock
 
+from flathunter.exceptions import NotificationFailedException
 from flathunter.notifiers import SenderTelegram
+from flathunter.utils.rate_limit import KeyedRateLimiter
 
 
 class SenderTelegramTest(unittest.TestCase):
@@ -110,6 +113,37 @@ class SenderTelegramTest(unittest.TestCase):
         }'''
         m.post('https://api.telegram.org/botdummy_token/sendMessage', text=mock_response, status_code=429)
         before = datetime.datetime.now()
-        self.assertEqual(None, sender.notify("result"), "Expected no message to be sent")
+        with self.assertRaises(NotificationFailedException):
+            sender.notify("result")
         after = datetime.datetime.now()
-        self.assertEqual(2, (after - before).seconds)
\ No newline at end of file
+        self.assertEqual(2, (after - before).seconds)
+
+    @Mocker()
+    def test_receivers_are_sent_to_concurrently(self, m: Mocker):
+        c = StringConfig(string=json.dumps(
+            {"telegram": {"bot_token": "dummy_token", "receiver_ids": [1, 2, 3]}}
+        ))
+        sender = SenderTelegram(config=c)
+        clock = FakeClock()
+        sender.rate_limiter = KeyedRateLimiter(rate=30, capacity=30, rate_per_key=1,
+                                               capacity_per_key=3, clock=clock.monotonic,
+                                               sleep=clock.sleep)
+        sent = {}
+
+        def respond(request, context):
+            chat_id = request.text.split('&')[0]
+            sent[chat_id] = sent.get(chat_id, 0) + 1
+            if chat_id == 'chat_id=1' and sent[chat_id] == 1:
+                context.status_code = 429
+                return {"description": "Too Many Requests", "parameters": {"retry_after": 1}}
+            return {"ok": True, "result": {"message_id": 456}}
+
+        m.post('https://api.telegram.org/botdummy_token/sendMessage', json=respond)
+        sender.notify("result")
+        self.assertEqual({'chat_id=1': 2, 'chat_id=2': 1, 'chat_id=3': 1}, sent)
+        # only the chat that was asked to back off waited, and for as long as it was asked
+        self.assertEqual([1], clock.sleeps)
+        self.assertEqual(0, sender.rate_limiter.bucket_for(1).tokens)
+        # the other chats each took one token of their own
+        self.assertEqual(2, sender.rate_limiter.bucket_for(2).tokens)
+        self.assertEqual(2, sender.rate_limiter.bucket_for(3).tokens)
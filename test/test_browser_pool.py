@@ -0,0 +1,238 @@
+import json
+import threading
+import time
+
+import pytest
+
+from flathunter.abstract_crawler import detect_captcha
+from flathunter.chrome_wrapper import BrowserPool, blocked_urls, browser_rss_mb
+from flathunter.crawler.kleinanzeigen import Kleinanzeigen
+from flathunter.exceptions import ConfigException
+from test.utils.config import StringConfig
+
+
+class FakeDriver:
+    """Stands in for a Chrome WebDriver"""
+    started = []
+
+    def __init__(self):
+        self.quit_called = False
+        self.rss = 100
+        FakeDriver.started.append(self)
+
+    def quit(self):
+        self.quit_called = True
+
+@pytest.fixture
+def drivers():
+    FakeDriver.started = []
+    return FakeDriver.started
+
+def test_browsers_are_reused(drivers):
+    pool = BrowserPool(FakeDriver)
+    for _ in range(3):
+        with pool.lease() as driver:
+            assert driver is drivers[0]
+    assert len(drivers) == 1
+    assert not drivers[0].quit_called
+
+def test_browsers_are_recycled_after_max_pages(drivers):
+    pool = BrowserPool(FakeDriver, max_pages=2)
+    for _ in range(5):
+        with pool.lease():
+            pass
+    assert len(drivers) == 3
+    assert [driver.quit_called for driver in drivers] == [True, True, False]
+
+def test_browsers_are_recycled_above_max_rss(drivers):
+    pool = BrowserPool(FakeDriver, max_pages=0, max_rss_mb=500,
+                       measure_rss=lambda driver: driver.rss)
+    with pool.lease() as driver:
+        pass
+    with pool.lease() as driver:
+        driver.rss = 600
+    with pool.lease() as driver:
+        assert driver is drivers[1]
+    assert drivers[0].quit_called
+
+def test_browsers_are_quit_after_errors(drivers):
+    pool = BrowserPool(FakeDriver)
+    with pytest.raises(RuntimeError):
+        with pool.lease():
+            raise RuntimeError("Browser crashed")
+    assert drivers[0].quit_called
+    with pool.lease() as driver:
+        assert driver is drivers[1]
+
+def test_number_of_browsers_is_capped(drivers):
+    pool = BrowserPool(FakeDriver, max_browsers=2)
+    (lock, in_use) = (threading.Lock(), set())
+    peak = []
+
+    def load_page():
+        with pool.lease() as driver:
+            with lock:
+                in_use.add(driver)
+                peak.append(len(in_use))
+            time.sleep(0.01)
+            with lock:
+                in_use.remove(driver)
+
+    threads = [threading.Thread(target=load_page) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert max(peak) == 2
+    assert len(drivers) == 2
+
+def test_prewarmed_browser_is_leased(drivers):
+    pool = BrowserPool(FakeDriver)
+    pool.prewarm()
+    deadline = time.monotonic() + 5
+    while pool.warming and time.monotonic() < deadline:
+        time.sleep(0.01)
+    with pool.lease() as driver:
+        assert driver is drivers[0]
+    pool.prewarm()
+    assert len(drivers) == 1
+
+def test_close_quits_idle_and_returned_browsers(drivers):
+    pool = BrowserPool(FakeDriver, max_browsers=2)
+    with pool.lease() as leased:
+        with pool.lease() as idle:
+            pass
+        pool.close()
+        assert idle.quit_called
+        assert not leased.quit_called
+    assert leased.quit_called
+
+def test_captchas_are_detected_in_order_of_precedence():
+    assert detect_captcha('<html></html>') is None
+    assert detect_captcha('<div class="g-recaptcha"></div>') == 'g-recaptcha'
+    assert detect_captcha('g-recaptcha awswaf-captcha') == 'awswaf-captcha'
+    assert detect_captcha('g-recaptcha awswaf-captcha initGeetest') == 'initGeetest'
+
+def test_rss_is_unknown_without_browser_pid():
+    assert browser_rss_mb(FakeDriver()) is None
+
+def test_config_shares_browser_pool():
+    config = StringConfig(string="""
+webdriver:
+  max_browsers: 3
+  max_pages_per_browser: 10
+""")
+    pool = config.browser_pool()
+    assert pool is config.browser_pool()
+    assert pool.max_pages == 10
+    assert pool.max_rss_mb == 1024
+
+def test_blocking_profiles():
+    assert blocked_urls('none') == []
+    default = blocked_urls('default')
+    assert '*.jpg' in default and '*.woff2?*' in default
+    assert '*.js' not in default
+    document = blocked_urls('document', allowed=['scripts'])
+    assert '*.css' in document and '*.js' not in document
+    with pytest.raises(ConfigException):
+        blocked_urls('everything')
+    with pytest.raises(ConfigException):
+        blocked_urls('default', allowed=['cookies'])
+
+def performance_entry(method, **params):
+    return { 'message': json.dumps({ 'message': { 'method': method, 'params': params } }) }
+
+class LoggingDriver(FakeDriver):
+    """Fake driver with a Chrome performance log, which sends all of its commands
+       through 'execute', like a WebDriver"""
+
+    def __init__(self):
+        super().__init__()
+        self.log = [performance_entry('Network.loadingFinished', encodedDataLength=999)]
+        self.loaded = []
+        self.blocked = []
+        self.commands = []
+        self.html = '<html><body></body></html>'
+
+    def execute(self, command, params=None):
+        self.commands.append(command)
+
+    def execute_cdp_cmd(self, command, params):
+        self.execute('executeCdpCommand')
+        assert command == 'Network.setBlockedURLs'
+        self.blocked = params['urls']
+
+    def get(self, url):
+        self.execute('get')
+        self.loaded.append(url)
+        self.log += [performance_entry('Network.requestWillBeSent'),
+                     performance_entry('Network.loadingFinished', encodedDataLength=2048),
+                     performance_entry('Network.loadingFinished', encodedDataLength=1024),
+                     performance_entry('Network.loadingFailed', blockedReason='inspector')]
+
+    def get_log(self, log_type):
+        self.execute('getLog')
+        assert log_type == 'performance'
+        (log, self.log) = (self.log, [])
+        return log
+
+    @property
+    def page_source(self):
+        self.execute('getPageSource')
+        return self.html
+
+def test_page_loads_are_measured(drivers):
+    pool = BrowserPool(LoggingDriver)
+    with pool.lease() as driver:
+        stats = pool.load(driver, 'https://www.example.com/1')
+        pool.load(driver, 'https://www.example.com/2')
+    assert driver.loaded == ['https://www.example.com/1', 'https://www.example.com/2']
+    assert (stats.pages, stats.transferred_bytes, stats.blocked_requests) == (1, 3072, 1)
+    totals = pool.cycle_stats()
+    assert (totals.pages, totals.transferred_bytes, totals.blocked_requests) == (2, 6144, 2)
+    assert pool.cycle_stats().pages == 0
+
+def test_webdriver_crawler_blocks_resources(drivers):
+    config = StringConfig(string="""
+webdriver:
+  allow_resources:
+    kleinanzeigen:
+      - stylesheets
+""")
+    config.__browser_pool__ = BrowserPool(LoggingDriver)
+    crawler = Kleinanzeigen(config)
+    crawler.get_page('https://www.kleinanzeigen.de/s-wohnung-mieten/berlin')
+    assert '*.jpg' in drivers[0].blocked and '*.js' not in drivers[0].blocked
+    crawler.get_details_page('https://www.kleinanzeigen.de/s-anzeige/wohnung/123')
+    assert '*.js' in drivers[0].blocked and '*.css' not in drivers[0].blocked
+    assert config.browser_pool().cycle_stats().pages == 2
+
+def test_page_source_is_read_once(drivers):
+    config = StringConfig(string="")
+    config.__browser_pool__ = BrowserPool(LoggingDriver)
+    crawler = Kleinanzeigen(config)
+    crawler.get_page('https://www.kleinanzeigen.de/s-wohnung-mieten/berlin')
+    assert drivers[0].commands.count('getPageSource') == 1
+    assert config.browser_pool().cycle_stats().commands == len(drivers[0].commands)
+
+def test_page_source_is_read_again_after_captcha(drivers, mocker):
+    config = StringConfig(string="")
+    config.__browser_pool__ = BrowserPool(LoggingDriver)
+    crawler = Kleinanzeigen(config)
+    resolve_geetest = mocker.patch.object(crawler, 'resolve_geetest')
+    resolve_recaptcha = mocker.patch.object(crawler, 'resolve_recaptcha')
+    with config.browser_pool().lease() as driver:
+        driver.html = '<div class="g-recaptcha"></div><script>initGeetest({})</script>'
+        crawler.get_soup_from_url('https://www.kleinanzeigen.de/s-anzeige/1', driver=driver)
+        assert driver.commands.count('getPageSource') == 2
+        resolve_geetest.assert_called_once_with(driver)
+        resolve_recaptcha.assert_not_called()
+
+def test_awswaf_sees_the_performance_log_of_the_page(drivers):
+    config = StringConfig(string="")
+    config.__browser_pool__ = BrowserPool(LoggingDriver)
+    crawler = Kleinanzeigen(config)
+    with config.browser_pool().lease() as driver:
+        config.browser_pool().load(driver, 'https://www.kleinanzeigen.de/s-anzeige/1')
+        assert len(crawler.performance_log(driver)) == 4
+        assert crawler.performance_log(driver) == []
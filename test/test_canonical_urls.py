@@ -0,0 +1,79 @@
+import pytest
+
+from flathunter.crawler.immobiliare import Immobiliare
+from flathunter.crawler.immobilienscout import Immobilienscout
+from flathunter.crawler.immowelt import Immowelt
+from flathunter.crawler.kleinanzeigen import Kleinanzeigen
+from flathunter.crawler.subito import Subito
+from flathunter.crawler.vrmimmo import VrmImmo
+from flathunter.crawler.wggesucht import WgGesucht
+from flathunter.utils.urls import normalize_url
+from test.utils.config import StringConfig
+
+def test_normalize_url():
+    assert normalize_url('HTTPS://WWW.Example.com/Search?b=2&utm_source=mail&a=1&fbclid=x#top') \
+        == 'https://www.example.com/Search?a=1&b=2'
+    assert normalize_url('https://www.example.com/search?a=1&a=0&pf=') \
+        == 'https://www.example.com/search?a=1&a=0&pf='
+    assert normalize_url('https://www.example.com/search?sort=price&x=1', remove=['x'],
+                         replace={ 'sort': 'date' }) \
+        == 'https://www.example.com/search?sort=date'
+
+@pytest.mark.parametrize("crawler_class, url, canonical", [
+    (Immobilienscout,
+     'https://www.immobilienscout24.de/Suche/de/berlin/berlin/wohnung-mieten'
+     '?enteredFrom=one_step_search&sorting=4&numberofrooms=2.0-',
+     'https://www.immobilienscout24.de/Suche/de/berlin/berlin/wohnung-mieten'
+     '?numberofrooms=2.0-&sorting=2'),
+    (Immobilienscout,
+     'https://www.immobilienscout24.de/expose/123?utm_campaign=x',
+     'https://www.immobilienscout24.de/expose/123'),
+    (WgGesucht,
+     'https://www.wg-gesucht.de/wohnungen-in-Berlin.8.2.1.0.html?offer_filter=1&sort_column=1&sort_order=0',
+     'https://www.wg-gesucht.de/wohnungen-in-Berlin.8.2.1.0.html?offer_filter=1'),
+    (Kleinanzeigen,
+     'https://www.kleinanzeigen.de/s-wohnung-mieten/berlin/sortierung:preis/preis:1000:1500/c203l3331',
+     'https://www.kleinanzeigen.de/s-wohnung-mieten/berlin/preis:1000:1500/c203l3331'),
+    (Immowelt,
+     'https://www.immowelt.de/classified-search?locations=AD08DE8634&order=PriceAsc',
+     'https://www.immowelt.de/classified-search?locations=AD08DE8634&order=DateDesc'),
+    (Immowelt,
+     'https://www.immowelt.de/liste/berlin/wohnungen/mieten?roomi=2&sort=relevanz',
+     'https://www.immowelt.de/liste/berlin/wohnungen/mieten?roomi=2&sort=createdate%2Bdesc'),
+    (Immobiliare,
+     'https://www.immobiliare.it/affitto-case/milano/?criterio=prezzo&ordine=asc',
+     'https://www.immobiliare.it/affitto-case/milano/?criterio=dataModifica&ordine=desc'),
+    (VrmImmo,
+     'https://vrm-immo.de/suchergebnisse?l=Darmstadt&pf=&s=price_asc',
+     'https://vrm-immo.de/suchergebnisse?l=Darmstadt&pf=&s=most_recently_updated_first'),
+    (Subito,
+     'https://www.subito.it/annunci-lombardia/affitto/appartamenti/milano/?utm_medium=x',
+     'https://www.subito.it/annunci-lombardia/affitto/appartamenti/milano/'),
+])
+def test_canonical_urls(crawler_class, url, canonical):
+    crawler = crawler_class(StringConfig(string=""))
+    assert crawler.canonical_url(url) == canonical
+    assert crawler.canonical_url(canonical) == canonical
+
+URLS_CONFIG = """
+urls:
+  - https://www.wg-gesucht.de/wohnungen-in-Berlin.8.2.1.0.html?sort_column=1&sort_order=0
+  - https://www.immowelt.de/classified-search?locations=AD08DE8634&order=DateDesc
+  - https://www.wg-gesucht.de/wohnungen-in-Berlin.8.2.1.0.html?utm_source=newsletter
+  - https://www.example.com/search?utm_source=newsletter
+"""
+
+def test_config_crawls_canonical_urls_once():
+    config = StringConfig(string=URLS_CONFIG)
+    config.init_searchers()
+    assert config.crawl_urls() == [
+        'https://www.wg-gesucht.de/wohnungen-in-Berlin.8.2.1.0.html',
+        'https://www.immowelt.de/classified-search?locations=AD08DE8634&order=DateDesc',
+        'https://www.example.com/search?utm_source=newsletter',
+    ]
+    assert config.target_urls()[0].endswith('?sort_column=1&sort_order=0')
+
+def test_canonicalization_can_be_disabled():
+    config = StringConfig(string=URLS_CONFIG + "crawl:\n  canonicalize_urls: false\n")
+    config.init_searchers()
+    assert config.crawl_urls() == config.target_urls()
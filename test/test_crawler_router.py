@@ -0,0 +1,59 @@
+import re
+
+from flathunter.crawler.immowelt import Immowelt
+from flathunter.crawler.wggesucht import WgGesucht
+from flathunter.crawler_router import CrawlerRouter
+from test.dummy_crawler import DummyCrawler
+from test.utils.config import StringConfig
+
+class PathDummyCrawler(DummyCrawler):
+    URL_PATTERN = re.compile(r'https://www\.example\.org/wohnungen')
+
+class HousesDummyCrawler(DummyCrawler):
+    URL_PATTERN = re.compile(r'https://www\.example\.org/haeuser')
+
+class AllButHousesDummyCrawler(DummyCrawler):
+    URL_PATTERN = re.compile(r'https://www\.example\.org/(?!haeuser)')
+
+def test_urls_are_routed_to_crawlers():
+    config = StringConfig(string="""
+urls:
+  - https://www.immowelt.de/classified-search?locations=AD08DE8634
+  - https://www.wg-gesucht.de/wohnungen-in-Berlin.8.2.1.0.html
+""")
+    config.init_searchers()
+    router = config.crawler_router()
+    assert isinstance(router.crawler_for('https://www.immowelt.de/classified-search?x=1'), Immowelt)
+    assert isinstance(router.crawler_for('https://WWW.WG-GESUCHT.DE/wg-zimmer.html'), WgGesucht)
+    assert router.crawler_for('https://www.example.com/liste') is None
+    assert router.crawlers_for('http://www.immowelt.de/') == []
+
+def test_routes_are_memoized_by_host():
+    dummy = DummyCrawler()
+    by_path = PathDummyCrawler()
+    router = CrawlerRouter([dummy, by_path])
+    for page in range(5):
+        assert router.crawlers_for(f'https://www.example.com/liste?page={page}') == [dummy]
+    assert list(router.by_host) == ['https://www.example.com']
+    # patterns that match beyond the hostname are checked against the full URL
+    assert router.crawlers_for('https://www.example.org/wohnungen/berlin') == [by_path]
+    assert router.crawlers_for('https://www.example.org/haeuser') == []
+    stats = router.cycle_stats()
+    assert stats.dispatches == 7
+    assert stats.seconds >= 0
+    assert router.cycle_stats().dispatches == 0
+
+def test_crawlers_on_the_same_host_are_told_apart_by_path():
+    houses = HousesDummyCrawler()
+    flats = AllButHousesDummyCrawler()
+    router = CrawlerRouter([flats, houses])
+    assert router.crawlers_for('https://www.example.org/wohnungen/berlin') == [flats]
+    assert router.crawlers_for('https://www.example.org/haeuser/berlin') == [houses]
+    assert router.crawler_for('https://www.example.org/wohnungen/hamburg') is flats
+    assert list(router.by_host) == ['https://www.example.org']
+
+def test_set_searchers_rebuilds_router():
+    config = StringConfig(string="")
+    dummy = DummyCrawler()
+    config.set_searchers([dummy])
+    assert config.crawler_router().crawlers_for('https://www.example.com/x') == [dummy]
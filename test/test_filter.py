@@ -0,0 +1,95 @@
+import datetime
+import time
+
+import yaml
+
+from flathunter.filter import Filter, AbstractFilter, AlreadySeenFilter, TitleFilter, \
+    MaxPriceFilter, ExposeRecord, PPSFilter
+from flathunter.idmaintainer import IdMaintainer
+from test.utils.config import StringConfig
+from test.utils.exposes import synthetic_exposes
+from test.utils.legacy import legacy_filter
+
+class CountingFilter(AbstractFilter):
+
+    def __init__(self, interesting=True, delay=0):
+        self.interesting = interesting
+        self.delay = delay
+        self.calls = 0
+
+    def is_interesting(self, _expose):
+        self.calls += 1
+        if self.delay:
+            time.sleep(self.delay)
+        return self.interesting
+
+def exposes(count):
+    return [{ 'id': i, 'crawler': 'Dummy', 'title': 'Flat %d' % i, 'price': '%d EUR' % (i * 100),
+              'size': '50 m2', 'rooms': '2' } for i in range(count)]
+
+def test_single_expose_check_short_circuits():
+    rejecting = CountingFilter(interesting=False)
+    accepting = CountingFilter()
+    filter_set = Filter([rejecting, accepting])
+    assert not filter_set.is_interesting_expose(exposes(1)[0])
+    assert rejecting.calls == 1
+    assert accepting.calls == 0
+
+def test_filters_are_reordered_by_cost_and_rejection_rate():
+    slow = CountingFilter(delay=0.0005)
+    cheap = MaxPriceFilter(500)
+    filter_set = Filter([slow, cheap])
+    result = list(filter_set.filter(exposes(200)))
+    assert [expose['id'] for expose in result] == [0, 1, 2, 3, 4, 5]
+    assert filter_set.filters == [cheap, slow]
+    # only the first batch goes through the slow filter in full
+    assert slow.calls < Filter.BATCH_SIZE + 10
+
+def test_already_seen_filter_runs_last():
+    id_watch = IdMaintainer(":memory:")
+    filter_set = Filter.builder() \
+                       .filter_already_seen(id_watch) \
+                       .read_config(StringConfig('{"filters":{"max_price":500}}')) \
+                       .build()
+    assert isinstance(filter_set.filters[-1], AlreadySeenFilter)
+    assert len(list(filter_set.filter(exposes(20)))) == 6
+    # exposes rejected by the price filter are not marked as processed
+    assert id_watch.filter_unprocessed(list(range(20))) == list(range(6, 20))
+
+def test_title_filter_uses_compiled_pattern():
+    title_filter = TitleFilter(["wg", "tausch"])
+    assert not title_filter.is_interesting({ 'title': 'Schöne WG in Mitte' })
+    assert not title_filter.is_interesting({ 'title': 'Wohnungstausch' })
+    assert title_filter.is_interesting({ 'title': 'Altbau mit Balkon' })
+
+def test_price_per_square_filter_passes_exposes_of_unknown_size():
+    pps_filter = PPSFilter(20)
+    assert pps_filter.is_interesting({ 'price': '900 €', 'size': '0 m²' })
+    assert pps_filter.is_interesting({ 'price': '900 €', 'size': '' })
+    assert not pps_filter.is_interesting({ 'price': '900 €', 'size': '40 m²' })
+
+def test_price_per_square_filter_in_sql_passes_exposes_of_unknown_size():
+    id_watch = IdMaintainer(":memory:")
+    id_watch.save_exposes([{ 'id': 1, 'crawler': 'Dummy', 'price': '900 €', 'size': '0 m²' },
+                           { 'id': 2, 'crawler': 'Dummy', 'price': '900 €', 'size': '40 m²' }],
+                          datetime.datetime.now())
+    filter_set = Filter([PPSFilter(20)])
+    assert [expose['id'] for expose in id_watch.get_recent_exposes(10, filter_set)] == [1]
+
+FILTERS = {'excluded_titles': ["wg", "tausch"], 'min_price': 400, 'max_price': 1500,
+           'min_size': 30, 'max_size': 120, 'min_rooms': 1, 'max_rooms': 4,
+           'max_price_per_square': 25}
+
+def build_filter(filters):
+    return Filter.builder().read_config(StringConfig(yaml.safe_dump({'filters': filters}))) \
+                           .build()
+
+def test_parse_once_filter_matches_legacy_filter():
+    exposes = list(synthetic_exposes(2000))
+    legacy = list(filter(legacy_filter(FILTERS), exposes))
+    assert len(legacy) > 0
+    assert list(build_filter(FILTERS).filter(exposes)) == legacy
+    records = [ExposeRecord.from_expose(expose) for expose in exposes]
+    for filters in [{'max_price': 800, 'min_rooms': 2}, {'max_price': 1600, 'min_rooms': 3}]:
+        assert list(build_filter(filters).filter_records(records)) \
+            == list(filter(legacy_filter(filters), exposes))
@@ -1,7 +1,10 @@
+import datetime
 import unittest
+from urllib.parse import parse_qs, urlparse
 import yaml
 import re
 import requests_mock
+from flathunter.gmaps_duration_processor import GMapsDurationProcessor
 from flathunter.hunter import Hunter
 from flathunter.idmaintainer import IdMaintainer
 from test.dummy_crawler import DummyCrawler
@@ -47,4 +50,86 @@ durations:
         if len(without_durations) > 0:
             for expose in without_durations:
                 print("Got expose: ", expose)
-        self.assertTrue(len(without_durations) == 0, "Expected durations to be calculated")
\ No newline at end of file
+        self.assertTrue(len(without_durations) == 0, "Expected durations to be calculated")
+def distance_matrix(request, context):
+    """Answers a Distance Matrix request with a route for every origin and destination"""
+    origins = parse_qs(urlparse(request.url).query)['origins'][0].split('|')
+    destinations = parse_qs(urlparse(request.url).query)['destinations'][0].split('|')
+    return { 'status': 'OK', 'rows': [
+        { 'elements': [{ 'status': 'OK',
+                         'distance': { 'text': f'{len(origin)} km', 'value': len(origin) },
+                         'duration': { 'text': f'{len(dest)} mins', 'value': len(dest) } }
+                       for dest in destinations] }
+        for origin in origins] }
+
+@requests_mock.Mocker(kw='m')
+def test_durations_are_cached(**kwargs):
+    m = kwargs['m']
+    m.get(re.compile('maps.googleapis.com/maps/api/distancematrix/json'), json=distance_matrix)
+    config = StringConfig(string=GMapsDurationProcessorTest.DUMMY_CONFIG)
+    id_watch = IdMaintainer(":memory:")
+    processor = GMapsDurationProcessor(config, id_watch)
+    exposes = [{ 'address': 'Unter den Linden 1, Berlin' },
+               { 'address': ' unter den  Linden 1,  berlin' }]
+    results = list(processor.process_exposes(exposes))
+    assert results[0]['durations'] == results[1]['durations']
+    assert 'None' not in results[0]['durations']
+    # one request per mode
+    assert m.call_count == 3
+    assert (processor.cache.hits, processor.cache.misses) == (0, 3)
+    processor = GMapsDurationProcessor(config, id_watch)
+    assert list(processor.process_exposes([{ 'address': 'Unter den Linden 1, BERLIN' }])) \
+        == [{ 'address': 'Unter den Linden 1, BERLIN', 'durations': results[0]['durations'] }]
+    assert m.call_count == 3
+    assert (processor.cache.hits, processor.cache.misses) == (3, 0)
+
+@requests_mock.Mocker(kw='m')
+def test_durations_are_requested_in_batches(**kwargs):
+    m = kwargs['m']
+    m.get(re.compile('maps.googleapis.com/maps/api/distancematrix/json'), json=distance_matrix)
+    config = StringConfig(string="""
+google_maps_api:
+  key: SOME_KEY
+  url: https://maps.googleapis.com/maps/api/distancematrix/json?origins={origin}&destinations={dest}&mode={mode}&sensor=true&key={key}&arrival_time={arrival}
+  enable: true
+durations:
+  - destination: Alexanderplatz
+    name: Alex
+    modes:
+      - gm_id: transit
+        title: Public transport
+  - destination: Flughafen BER
+    name: Airport
+    modes:
+      - gm_id: transit
+        title: Public transport
+  - destination: Potsdam Hbf
+    name: Potsdam
+    modes:
+      - gm_id: transit
+        title: Public transport
+""")
+    processor = GMapsDurationProcessor(config)
+    exposes = [{ 'address': f'Street {number}, Berlin' } for number in range(30)]
+    results = list(processor.process_exposes(exposes))
+    # 30 origins x 3 destinations, in chunks of at most 25 origins and 100 elements
+    assert m.call_count == 2
+    for expose in results:
+        origin_km = len(expose['address'])
+        assert expose['durations'] == '\n'.join([
+            f"> Alex (Public transport): 14 mins ({origin_km} km)",
+            f"> Airport (Public transport): 13 mins ({origin_km} km)",
+            f"> Potsdam (Public transport): 11 mins ({origin_km} km)"])
+
+def test_cache_expires_and_evicts_entries():
+    id_watch = IdMaintainer(":memory:")
+    now = datetime.datetime.now()
+    id_watch.cache_durations({ 'a': '1 min', 'b': '2 min' }, now - datetime.timedelta(days=1), 10)
+    assert id_watch.get_cached_durations(['a', 'b', 'c'], now - datetime.timedelta(days=1)) \
+        == { 'a': '1 min', 'b': '2 min' }
+    assert id_watch.get_cached_durations(['a'], now + datetime.timedelta(seconds=1)) == {}
+    id_watch.get_cached_durations(['a'], now - datetime.timedelta(days=1))
+    # 'b' is the least recently used entry
+    id_watch.cache_durations({ 'c': '3 min' }, now - datetime.timedelta(days=1), 2)
+    assert id_watch.get_cached_durations(['a', 'b', 'c'], now - datetime.timedelta(days=1)) \
+        == { 'a': '1 min', 'c': '3 min' }
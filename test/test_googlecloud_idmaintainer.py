@@ -1,21 +1,32 @@
 import pytest
 import datetime
+import pytz
 import re
 from typing import Dict
 from mockfirestore import MockFirestore
+from mockfirestore.transaction import Transaction
 
 from flathunter.googlecloud_idmaintainer import GoogleCloudIdMaintainer
 from flathunter.hunter import Hunter
+from flathunter.idmaintainer import IdMaintainer, SaveAllExposesProcessor
 from flathunter.web_hunter import WebHunter
 from flathunter.filter import Filter
 from test.dummy_crawler import DummyCrawler
 from test.test_util import count
 from test.utils.config import StringConfig
 
+class MockFirestoreWithBatch(MockFirestore):
+    """MockFirestore does not implement write batches - a transaction has the same API"""
+
+    def batch(self):
+        batch = Transaction(self)
+        batch._begin()
+        return batch
+
 class MockGoogleCloudIdMaintainer(GoogleCloudIdMaintainer):
 
     def __init__(self):
-        self.database = MockFirestore()
+        self.database = MockFirestoreWithBatch()
 
 CONFIG_WITH_FILTERS = """
 urls:
@@ -33,6 +44,78 @@ def test_read_after_write(id_watch):
     id_watch.mark_processed(12345)
     assert id_watch.is_processed(12345)
 
+def test_filter_unprocessed(id_watch):
+    id_watch.mark_processed_many([1, 2, 3])
+    assert id_watch.is_processed(2)
+    assert id_watch.filter_unprocessed([5, 3, 4, 1, 5, 6]) == [5, 4, 6]
+
+def test_filter_unknown(id_watch):
+    id_watch.save_exposes([{ 'id': 1, 'crawler': 'Dummy' }, { 'id': 3, 'crawler': 'Dummy' }],
+                          datetime.datetime.now())
+    assert id_watch.filter_unknown([1, 2, 3, 4], 'Dummy') == [2, 4]
+
+def test_unchanged_exposes_are_not_rewritten(id_watch):
+    first_seen = datetime.datetime(2024, 1, 1, 12, 0)
+    assert id_watch.save_exposes([{ 'id': 1, 'crawler': 'Dummy', 'price': '500' },
+                                  { 'id': 2, 'crawler': 'Dummy', 'price': '600' }],
+                                 first_seen) == []
+    last_seen = datetime.datetime(2024, 1, 1, 12, 5)
+    assert id_watch.save_exposes([{ 'id': 1, 'crawler': 'Dummy', 'price': '500' },
+                                  { 'id': 2, 'crawler': 'Dummy', 'price': '550' }],
+                                 last_seen) == [(1, 'Dummy')]
+    id_watch.update_last_seen([(1, 'Dummy')], last_seen)
+    for expose_id, price in [('1', '500'), ('2', '550')]:
+        saved = id_watch.database.collection('exposes').document(expose_id).get().to_dict()
+        assert saved['price'] == price
+        assert saved['created_at'] == pytz.utc.localize(first_seen)
+        assert saved['last_seen'] == pytz.utc.localize(last_seen)
+
+def test_changed_exposes_are_replaced(id_watch):
+    first_seen = datetime.datetime(2024, 1, 1, 12, 0)
+    id_watch.save_exposes([{ 'id': 1, 'crawler': 'Dummy', 'price': '500',
+                             'images': ['https://example.com/1.jpg'] }], first_seen)
+    last_seen = datetime.datetime(2024, 1, 1, 12, 5)
+    id_watch.save_exposes([{ 'id': 1, 'crawler': 'Dummy', 'price': '450' }], last_seen)
+    saved = id_watch.database.collection('exposes').document('1').get().to_dict()
+    assert saved['price'] == '450'
+    assert 'images' not in saved
+    assert saved['created_at'] == saved['first_seen'] == pytz.utc.localize(first_seen)
+    assert saved['last_seen'] == pytz.utc.localize(last_seen)
+
+def test_unchanged_expose_keys_match_sqlite(id_watch):
+    sqlite_id_watch = IdMaintainer(":memory:")
+    exposes = [{ 'id': 1, 'crawler': 'Dummy', 'price': '500' },
+               { 'id': '2', 'crawler': 'Other', 'price': '600' }]
+    first_seen = datetime.datetime(2024, 1, 1, 12, 0)
+    for backend in [id_watch, sqlite_id_watch]:
+        backend.save_exposes(exposes, first_seen)
+    last_seen = datetime.datetime(2024, 1, 1, 12, 5)
+    assert id_watch.save_exposes(exposes, last_seen) \
+        == sqlite_id_watch.save_exposes(exposes, last_seen) \
+        == [(1, 'Dummy'), (2, 'Other')]
+
+def test_save_all_exposes_processor_updates_last_seen(id_watch):
+    processor = SaveAllExposesProcessor(StringConfig(string=""), id_watch)
+    exposes = [{ 'id': 1, 'crawler': 'Dummy', 'price': '500' }]
+    assert list(processor.process_exposes(exposes)) == exposes
+    first = id_watch.database.collection('exposes').document('1').get().to_dict()
+    assert list(processor.process_exposes(exposes)) == exposes
+    saved = id_watch.database.collection('exposes').document('1').get().to_dict()
+    assert saved['first_seen'] == first['first_seen']
+    assert saved['last_seen'] >= first['last_seen']
+
+def test_notifications_are_queued_and_acknowledged(id_watch):
+    exposes = [{ 'id': expose_id, 'crawler': 'Dummy', 'title': 'Flat' } for expose_id in [1, 2]]
+    id_watch.queue_notifications(exposes, [('telegram', None, exposes[0]),
+                                           ('telegram', [7], exposes[1])])
+    assert id_watch.filter_unprocessed([1, 2, 3]) == [3]
+    due = id_watch.get_due_notifications(10)
+    assert [(n['receivers'], n['expose']) for n in due] == [(None, exposes[0]), ([7], exposes[1])]
+    id_watch.retry_notifications([(due[0]['id'], 1, datetime.datetime.now()
+                                   + datetime.timedelta(hours=1))])
+    id_watch.acknowledge_notifications([due[1]['id']])
+    assert id_watch.get_due_notifications(10) == []
+
 def test_get_last_run_time_none_by_default(id_watch):
     assert id_watch.get_last_run_time() == None
 
@@ -0,0 +1,87 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from flathunter.crawler.immowelt import Immowelt
+from flathunter.crawler.wggesucht import WgGesucht
+from flathunter.http_sessions import HttpSessions
+from test.utils.config import StringConfig
+
+class OkHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        body = b"ok"
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def server_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), OkHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/"
+    server.shutdown()
+    server.server_close()
+
+def test_connections_are_reused(server_url):
+    sessions = HttpSessions()
+    for _ in range(3):
+        assert sessions.session.get(server_url, timeout=5).text == "ok"
+    stats = sessions.cycle_stats()
+    assert stats.opened == 1
+    assert stats.reused == 2
+    # counters are reset for the next cycle
+    sessions.session.get(server_url, timeout=5)
+    stats = sessions.cycle_stats()
+    assert stats.opened == 0
+    assert stats.reused == 1
+
+def test_new_sessions_share_the_pool(server_url):
+    sessions = HttpSessions()
+    sessions.session.get(server_url, timeout=5)
+    sessions.new_session().get(server_url, timeout=5)
+    assert sessions.cycle_stats().opened == 1
+
+def test_connections_are_closed_without_keep_alive(server_url):
+    sessions = HttpSessions(keep_alive=False)
+    for _ in range(2):
+        sessions.session.get(server_url, timeout=5)
+    assert sessions.cycle_stats().opened == 2
+
+def test_config_owns_a_single_pool():
+    config = StringConfig(string="""
+http:
+  pool_maxsize: 4
+  max_retries: 0
+""")
+    assert config.http_sessions() is config.http_sessions()
+    assert config.http_sessions().adapter._pool_maxsize == 4
+    assert config.http_sessions().adapter.max_retries.total == 0
+
+def test_requests_per_host_are_limited():
+    sessions = HttpSessions(max_requests_per_host=2)
+    slot = sessions.host_slot('https://api.example.com/search?page=1')
+    assert slot is sessions.host_slot('https://API.example.com/search?page=2')
+    assert slot is not sessions.host_slot('https://www.example.com/')
+    assert slot.acquire(blocking=False) and slot.acquire(blocking=False)
+    assert not slot.acquire(blocking=False)
+
+def test_crawlers_have_sessions_of_their_own(server_url):
+    config = StringConfig(string="")
+    immowelt = Immowelt(config)
+    wggesucht = WgGesucht(config)
+    assert immowelt.session is not wggesucht.session
+    assert immowelt.session is not config.http_session()
+    assert immowelt.session.cookies is not wggesucht.session.cookies
+    # the sessions share the connection pools
+    immowelt.session.get(server_url, timeout=5)
+    wggesucht.session.get(server_url, timeout=5)
+    config.http_session().get(server_url, timeout=5)
+    assert config.http_sessions().cycle_stats().opened == 1
@@ -1,9 +1,15 @@
 import unittest
 import re
+import threading
+import time
+
+import pytest
 from typing import Optional, Dict, List
 from flathunter.crawler.immowelt import Immowelt
+from flathunter.filter import Filter
 from flathunter.hunter import Hunter 
 from flathunter.idmaintainer import IdMaintainer
+from flathunter.processor import ProcessorChain
 from test.dummy_crawler import DummyCrawler
 from test.test_util import count
 from test.utils.config import StringConfig
@@ -227,3 +233,117 @@ excluded_titles:
             for expose in unfiltered:
                 print("Got unfiltered expose: ", expose)
         self.assertTrue(len(unfiltered) == 0, "Expected flats with too few rooms to be filtered")
+
+class SlowDummyCrawler(DummyCrawler):
+    """Dummy crawler that takes a while to respond and records its concurrency"""
+
+    def __init__(self, url_pattern):
+        super().__init__()
+        self.URL_PATTERN = re.compile(url_pattern)
+        self.lock = threading.Lock()
+        self.active = 0
+        self.max_active = 0
+
+    def get_results(self, search_url, max_pages=None, pagination=None):
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(0.2)
+        with self.lock:
+            self.active -= 1
+        return super().get_results(search_url, max_pages, pagination)
+
+CONCURRENT_CONFIG = """
+urls:
+  - https://www.example.com/search/1
+  - https://www.example.com/search/2
+  - https://www.example.org/search/1
+  - https://www.example.org/search/2
+
+crawl:
+  max_workers: 4
+  max_workers_per_crawler: 1
+"""
+
+def test_crawl_runs_portals_concurrently():
+    config = StringConfig(string=CONCURRENT_CONFIG)
+    crawlers = [SlowDummyCrawler(r'https://www\.example\.com'),
+                SlowDummyCrawler(r'https://www\.example\.org')]
+    config.set_searchers(crawlers)
+    hunter = Hunter(config, IdMaintainer(":memory:"))
+    start = time.time()
+    exposes = list(hunter.crawl_for_exposes())
+    elapsed = time.time() - start
+    assert len(exposes) > 4
+    # two portals crawled in parallel, each portal limited to one request at a time
+    assert elapsed < 0.7
+    for crawler in crawlers:
+        assert crawler.max_active == 1
+
+class StreamingDummyCrawler(DummyCrawler):
+    """Dummy crawler that streams its results, and holds back all but the first until
+       the first has been through the processors"""
+
+    def __init__(self):
+        super().__init__()
+        self.first_processed = threading.Event()
+        self.released_before_end = False
+
+    def get_results(self, search_url, max_pages=None, pagination=None):
+        entries = super().get_results(search_url, max_pages, pagination)
+        yield entries[0]
+        self.released_before_end = self.first_processed.wait(timeout=5)
+        yield from entries[1:]
+
+STREAMING_CONFIG = """
+urls:
+  - https://www.example.com/search/1
+"""
+
+def test_first_expose_is_processed_before_the_crawl_ends():
+    config = StringConfig(string=STREAMING_CONFIG)
+    crawler = StreamingDummyCrawler()
+    config.set_searchers([crawler])
+    id_watch = IdMaintainer(":memory:")
+    hunter = Hunter(config, id_watch)
+    filter_set = Filter.builder() \
+                       .read_config(config) \
+                       .filter_already_seen(id_watch, mark_processed=False) \
+                       .build()
+    processor_chain = ProcessorChain.builder(config) \
+                                    .save_all_exposes(id_watch) \
+                                    .apply_filter(filter_set) \
+                                    .queue_notifications(id_watch) \
+                                    .build()
+    exposes = []
+    for expose in processor_chain.process(hunter.crawl_for_exposes()):
+        crawler.first_processed.set()
+        exposes.append(expose)
+    assert crawler.released_before_end
+    assert len(exposes) > 1
+
+class FailingDummyCrawler(DummyCrawler):
+    """Dummy crawler that fails with an unexpected error"""
+
+    def get_results(self, search_url, max_pages=None, pagination=None):
+        raise RuntimeError("crawler bug")
+
+FAILING_CONFIG = """
+urls:
+  - https://www.example.com/search/1
+  - https://www.example.com/search/2
+  - https://www.example.com/search/3
+
+crawl:
+  max_workers: 1
+"""
+
+def test_crawl_error_shuts_down_the_crawl_workers():
+    config = StringConfig(string=FAILING_CONFIG)
+    config.set_searchers([FailingDummyCrawler()])
+    hunter = Hunter(config, IdMaintainer(":memory:"))
+    results = hunter.crawl_for_exposes()
+    with pytest.raises(RuntimeError):
+        list(results)
+    # the executor is shut down although not all crawl jobs have reported back
+    assert results.executor._shutdown
@@ -1,8 +1,12 @@
 import unittest
+import pytest
 import datetime
+import json
 import re
+import sqlite3
 from typing import Dict
 
+from flathunter import idmaintainer
 from flathunter.idmaintainer import IdMaintainer
 from flathunter.hunter import Hunter
 from flathunter.web_hunter import WebHunter
@@ -57,11 +61,84 @@ def test_ids_are_added_to_maintainer(mocker):
     config = StringConfig(string=IdMaintainerTest.DUMMY_CONFIG)
     config.set_searchers([DummyCrawler()])
     id_watch = IdMaintainer(":memory:")
-    spy = mocker.spy(id_watch, "mark_processed")
+    spy = mocker.spy(id_watch, "queue_notifications")
     hunter = Hunter(config, id_watch)
     exposes = hunter.hunt_flats()
     assert count(exposes) > 4
-    assert spy.call_count == 24
+    assert sum(len(call.args[0]) for call in spy.call_args_list) == 24
+    assert id_watch.filter_unprocessed([expose['id'] for expose in exposes]) == []
+
+def test_processed_ids_are_looked_up_in_batches(mocker):
+    config = StringConfig(string=IdMaintainerTest.DUMMY_CONFIG)
+    config.set_searchers([DummyCrawler()])
+    id_watch = IdMaintainer(":memory:")
+    spy = mocker.spy(id_watch, "filter_unprocessed")
+    hunter = Hunter(config, id_watch)
+    exposes = hunter.hunt_flats()
+    assert count(exposes) == 24
+    assert spy.call_count == 1
+
+def test_filter_unprocessed():
+    id_watch = IdMaintainer(":memory:")
+    id_watch.mark_processed_many([1, 2, 3])
+    assert id_watch.filter_unprocessed([5, 3, 4, 1, 5, 6]) == [5, 4, 6]
+    assert id_watch.filter_unprocessed([]) == []
+
+def test_filter_unprocessed_with_many_ids():
+    id_watch = IdMaintainer(":memory:")
+    id_watch.mark_processed_many(list(range(0, 2000, 2)))
+    assert id_watch.filter_unprocessed(list(range(2000))) == list(range(1, 2000, 2))
+
+def test_filter_unprocessed_with_string_ids():
+    id_watch = IdMaintainer(":memory:")
+    id_watch.mark_processed("123")
+    assert id_watch.filter_unprocessed(["123", "456"]) == ["456"]
+
+def test_processed_ids_are_crawler_aware():
+    id_watch = IdMaintainer(":memory:")
+    id_watch.mark_processed(123, "Immowelt")
+    id_watch.mark_processed(456)
+    assert id_watch.is_processed(123, "Immowelt")
+    assert not id_watch.is_processed(123, "Kleinanzeigen")
+    assert id_watch.is_processed(123)
+    assert id_watch.is_processed(456, "Kleinanzeigen")
+    assert id_watch.filter_unprocessed([123, 456, 789], "Kleinanzeigen") == [123, 789]
+
+def test_legacy_database_is_upgraded(tmp_path):
+    db_name = str(tmp_path / "legacy.db")
+    legacy = sqlite3.connect(db_name)
+    legacy.execute('CREATE TABLE processed (ID INTEGER)')
+    legacy.execute('CREATE TABLE executions (timestamp timestamp)')
+    legacy.execute('CREATE TABLE exposes (id INTEGER, created TIMESTAMP, \
+                    crawler STRING, details BLOB, PRIMARY KEY (id, crawler))')
+    legacy.execute('CREATE TABLE users (id INTEGER PRIMARY KEY, settings BLOB)')
+    legacy.executemany('INSERT INTO processed VALUES (?)', [(1,), (2,), (2,), (3,)])
+    legacy.execute('INSERT INTO exposes VALUES (?, ?, ?, ?)',
+                   (1, datetime.datetime.now(), 'Dummy',
+                    json.dumps({ 'id': 1, 'price': '1.200 EUR', 'size': '45 m^2' })))
+    legacy.commit()
+    legacy.close()
+
+    id_watch = IdMaintainer(db_name)
+    connection = id_watch.get_connection()
+    assert IdMaintainer.get_schema_version(connection) == len(IdMaintainer.MIGRATIONS)
+    assert connection.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    assert connection.execute('SELECT COUNT(*) FROM processed').fetchone()[0] == 3
+    assert id_watch.is_processed(2, "Immowelt")
+    assert id_watch.filter_unprocessed([1, 2, 3, 4]) == [4]
+    plan = connection.execute('EXPLAIN QUERY PLAN SELECT id FROM processed WHERE id = 2') \
+        .fetchall()
+    assert 'SCAN' not in plan[0][3]
+    indexes = [row[0] for row in connection.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'index'")]
+    assert 'exposes_created' in indexes
+    assert 'executions_timestamp' in indexes
+    assert connection.execute('SELECT price, size, rooms FROM exposes').fetchall() == \
+        [(1200.0, 45.0, None)]
+
+    # Opening the upgraded database again leaves it unchanged
+    id_watch = IdMaintainer(db_name)
+    assert id_watch.filter_unprocessed([1, 2, 3, 4]) == [4]
 
 def test_exposes_are_saved_to_maintainer():
     config = StringConfig(string=IdMaintainerTest.CONFIG_WITH_FILTERS)
@@ -74,6 +151,72 @@ def test_exposes_are_saved_to_maintainer():
     assert len(saved) > 0
     assert count(exposes) < len(saved)
 
+def test_unchanged_exposes_are_not_rewritten():
+    id_watch = IdMaintainer(":memory:")
+    expose = { 'id': 1, 'crawler': 'Dummy', 'title': 'Flat' }
+    first_seen = datetime.datetime(2024, 1, 1, 12, 0)
+    assert id_watch.save_exposes([expose, { 'id': 2, 'crawler': 'Dummy' }], first_seen) == []
+    changes = id_watch.get_connection().total_changes
+    last_seen = datetime.datetime(2024, 1, 1, 12, 5)
+    assert id_watch.save_exposes([expose], last_seen) == [(1, 'Dummy')]
+    assert id_watch.get_connection().total_changes == changes
+    id_watch.update_last_seen([(1, 'Dummy')], last_seen)
+    cur = id_watch.get_connection().cursor()
+    cur.execute('SELECT created, first_seen, last_seen FROM exposes WHERE id = 1')
+    assert cur.fetchone() == (str(first_seen), str(first_seen), str(last_seen))
+
+def test_changed_exposes_are_rewritten():
+    id_watch = IdMaintainer(":memory:")
+    first_seen = datetime.datetime(2024, 1, 1, 12, 0)
+    id_watch.save_exposes([{ 'id': 1, 'crawler': 'Dummy', 'price': '500' }], first_seen)
+    last_seen = datetime.datetime(2024, 1, 1, 12, 5)
+    assert id_watch.save_exposes([{ 'id': 1, 'crawler': 'Dummy', 'price': '450' }],
+                                 last_seen) == []
+    cur = id_watch.get_connection().cursor()
+    cur.execute('SELECT created, last_seen, details FROM exposes WHERE id = 1')
+    (created, saved_last_seen, details) = cur.fetchone()
+    assert created == str(first_seen)
+    assert saved_last_seen == str(last_seen)
+    assert '450' in details
+
+def test_exposes_saved_by_an_overlapping_hunt_are_updated(tmp_path, mocker):
+    path = str(tmp_path / 'processed_ids.db')
+    (id_watch, other_hunt) = (IdMaintainer(path), IdMaintainer(path))
+    first_seen = datetime.datetime(2024, 1, 1, 12, 0)
+    numeric_fields = mocker.patch('flathunter.idmaintainer.numeric_fields',
+                                  wraps=idmaintainer.numeric_fields)
+    def save_meanwhile(expose):
+        # the other hunt saves the expose after this one has looked it up
+        numeric_fields.side_effect = None
+        other_hunt.save_exposes([{ 'id': 1, 'crawler': 'Dummy', 'price': '500' }], first_seen)
+        return idmaintainer.numeric_fields(expose)
+    numeric_fields.side_effect = save_meanwhile
+    last_seen = datetime.datetime(2024, 1, 1, 12, 5)
+    assert id_watch.save_exposes([{ 'id': 1, 'crawler': 'Dummy', 'price': '450' }],
+                                 last_seen) == []
+    cur = id_watch.get_connection().cursor()
+    cur.execute('SELECT created, last_seen, price FROM exposes WHERE id = 1')
+    assert cur.fetchone() == (str(first_seen), str(last_seen), 450)
+
+def test_repeated_hunts_keep_creation_time():
+    config = StringConfig(string=IdMaintainerTest.DUMMY_CONFIG)
+    crawler = DummyCrawler()
+    config.set_searchers([crawler])
+    id_watch = IdMaintainer(":memory:")
+    hunter = Hunter(config, id_watch)
+    hunter.hunt_flats()
+    cur = id_watch.get_connection().cursor()
+    cur.execute('SELECT id, created, content_hash FROM exposes')
+    before = cur.fetchall()
+    cur.execute('SELECT details FROM exposes')
+    crawled = [json.loads(row[0]) for row in cur.fetchall()]
+    crawler.get_results = lambda url, max_pages=None, pagination=None: crawled
+    hunter.hunt_flats()
+    cur.execute('SELECT id, created, content_hash FROM exposes')
+    assert cur.fetchall() == before
+    cur.execute('SELECT COUNT(*) FROM exposes WHERE last_seen > created')
+    assert cur.fetchone()[0] == len(before)
+
 def test_exposes_are_returned_as_dictionaries():
     config = StringConfig(string=IdMaintainerTest.CONFIG_WITH_FILTERS)
     config.set_searchers([DummyCrawler()])
@@ -117,6 +260,36 @@ def test_exposes_are_returned_filtered():
     for expose in saved:
         assert compare_int_less_equal(expose, 'size', 70)
 
+@pytest.mark.parametrize('filters', [
+    { 'max_size': 70 },
+    { 'min_price': 1000, 'max_price': 2000, 'min_rooms': 2, 'max_rooms': 4 },
+    { 'min_size': 40, 'max_price_per_square': 30 },
+    { 'max_price': 1500, 'excluded_titles': [ 'wg', 'tausch' ] },
+])
+def test_filters_are_applied_in_sql(filters):
+    config = StringConfig(string=IdMaintainerTest.DUMMY_CONFIG)
+    config.set_searchers([DummyCrawler()])
+    id_watch = IdMaintainer(":memory:")
+    hunter = Hunter(config, id_watch)
+    hunter.hunt_flats()
+    hunter.hunt_flats()
+    filter_set = Filter.builder().read_config(StringConfig(json.dumps({ 'filters': filters }))) \
+                                 .build()
+    expected = [expose for expose in id_watch.get_recent_exposes(1000)
+                if filter_set.is_interesting_expose(expose)]
+    assert len(expected) > 0
+    assert id_watch.get_recent_exposes(1000, filter_set=filter_set) == expected
+    assert id_watch.get_recent_exposes(3, filter_set=filter_set) == expected[:3]
+
+def test_filter_is_translated_to_sql():
+    filter_set = Filter.builder().read_config(StringConfig(json.dumps(
+        { 'filters': { 'max_price': 1500, 'min_rooms': 2, 'excluded_titles': [ 'wg' ] } }))) \
+                                 .build()
+    (condition, parameters, remaining) = filter_set.sql_conditions()
+    assert condition == '(price IS NULL OR price <= ?) AND (rooms IS NULL OR rooms >= ?)'
+    assert parameters == [1500, 2]
+    assert [type(f).__name__ for f in remaining.filters] == [ 'TitleFilter' ]
+
 def test_filters_for_user_are_saved():
     config = StringConfig(string=IdMaintainerTest.CONFIG_WITH_FILTERS)
     id_watch = IdMaintainer(":memory:")
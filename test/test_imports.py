@@ -0,0 +1,53 @@
+"""Crawler modules - and selenium, undetected_chromedriver and the pydantic schemas
+they depend on - must only be imported once a configured URL needs them, and
+captcha solvers only once one is configured"""
+import json
+import os
+import subprocess
+import sys
+
+from flathunter.crawler import CRAWLER_PLUGINS
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# Modules that are slow to import, and only needed by some crawlers
+HEAVY_MODULES = ['selenium.webdriver', 'undetected_chromedriver', 'pydantic',
+                 'flathunter.schemas.immobilienscout', 'flathunter.chrome_wrapper']
+
+def loaded_modules(code):
+    """Runs the code in a fresh interpreter, and returns the modules loaded at the end"""
+    code += "\nimport sys, json\nprint(json.dumps(sorted(sys.modules)))"
+    result = subprocess.run([sys.executable, '-c', code],
+                            cwd=ROOT, capture_output=True, text=True, check=True)
+    return set(json.loads(result.stdout.splitlines()[-1]))
+
+def crawler_modules(modules):
+    """The crawler modules among the loaded modules"""
+    return sorted(plugin.module for plugin in CRAWLER_PLUGINS if plugin.module in modules)
+
+def test_config_import_does_not_load_crawlers():
+    modules = loaded_modules('import flathunter.config')
+    assert crawler_modules(modules) == []
+    assert [module for module in HEAVY_MODULES if module in modules] == []
+    assert [module for module in modules if module.startswith('flathunter.captcha.')] == []
+
+def test_only_crawlers_for_configured_urls_are_loaded():
+    modules = loaded_modules(
+        "from flathunter.config import YamlConfig\n"
+        "config = YamlConfig({'urls': ['https://www.wg-gesucht.de/wohnungen-in-Berlin.8.2.1.0.html']})\n"
+        "config.init_searchers()\n"
+        "assert [type(searcher).__name__ for searcher in config.searchers()] == ['WgGesucht']")
+    assert crawler_modules(modules) == ['flathunter.crawler.wggesucht']
+    assert [module for module in HEAVY_MODULES if module in modules] == []
+
+def test_captcha_solver_is_loaded_when_configured():
+    modules = loaded_modules(
+        "from flathunter.config import YamlConfig\n"
+        "config = YamlConfig({'captcha': {'2captcha': {'api_key': 'key'}}})\n"
+        "assert type(config.get_captcha_solver()).__name__ == 'TwoCaptchaSolver'")
+    assert 'flathunter.captcha.twocaptcha_solver' in modules
+    assert 'flathunter.captcha.capmonster_solver' not in modules
+
+def test_registry_matches_crawler_classes():
+    for plugin in CRAWLER_PLUGINS:
+        assert plugin.load().URL_PATTERN.pattern == plugin.url_pattern.pattern
@@ -0,0 +1,136 @@
+import datetime
+
+import pytest
+from requests_mock import Mocker
+
+from flathunter.exceptions import BotBlockedException
+from flathunter.hunter import Hunter
+from flathunter.idmaintainer import IdMaintainer
+from flathunter.notification_outbox import NotificationDispatcher
+from test.dummy_crawler import DummyCrawler
+from test.utils.config import StringConfig
+
+CONFIG = """
+urls:
+  - https://www.example.com/liste/berlin/wohnungen/mieten?roomi=2&prima=1500&wflmi=70&sort=createdate%2Bdesc
+notifiers:
+  - telegram
+telegram:
+  bot_token: dummy
+  receiver_ids:
+    - 12345
+"""
+
+class RecordingSender:
+    """Stands in for SenderTelegram. Fails for the exposes in 'failing'"""
+    sent = []
+    failing = set()
+    blocked = set()
+
+    def __init__(self, config, receivers=None):
+        self.receivers = receivers
+
+    def process_expose(self, expose):
+        if expose['id'] in self.failing:
+            raise ConnectionError("Timed out")
+        for receiver in self.receivers or []:
+            if receiver in self.blocked:
+                raise BotBlockedException(f"User {receiver} blocked the bot")
+        self.sent.append((self.receivers, expose['id']))
+        return expose
+
+@pytest.fixture
+def sender(mocker):
+    RecordingSender.sent = []
+    RecordingSender.failing = set()
+    RecordingSender.blocked = set()
+    mocker.patch('flathunter.notification_outbox.SenderTelegram', RecordingSender)
+    return RecordingSender
+
+def hunter_for(id_watch):
+    config = StringConfig(string=CONFIG)
+    config.set_searchers([DummyCrawler()])
+    return Hunter(config, id_watch)
+
+def test_hunt_queues_and_delivers_notifications(sender):
+    id_watch = IdMaintainer(":memory:")
+    exposes = hunter_for(id_watch).hunt_flats()
+    assert len(exposes) > 0
+    assert sender.sent == [(None, expose['id']) for expose in exposes]
+    assert id_watch.get_due_notifications(100) == []
+
+def test_exposes_are_not_lost_if_queueing_fails(sender, mocker):
+    id_watch = IdMaintainer(":memory:")
+    hunter = hunter_for(id_watch)
+    mocker.patch.object(id_watch, 'queue_notifications', side_effect=RuntimeError("crash"))
+    with pytest.raises(RuntimeError):
+        hunter.hunt_flats()
+    mocker.stopall()
+    mocker.patch('flathunter.notification_outbox.SenderTelegram', RecordingSender)
+    exposes = hunter.hunt_flats()
+    assert len(exposes) > 0
+    assert sender.sent == [(None, expose['id']) for expose in exposes]
+
+def test_failed_notifications_are_retried(sender):
+    id_watch = IdMaintainer(":memory:")
+    hunter = hunter_for(id_watch)
+    dispatcher = hunter.notification_dispatcher
+    dispatcher.RETRY_DELAY = datetime.timedelta(0)
+    exposes = list(hunter.crawl_for_exposes())
+    sender.failing = {exposes[0]['id']}
+    id_watch.queue_notifications(exposes[:3], [('telegram', None, expose)
+                                               for expose in exposes[:3]])
+    # the failed notification is retried in the same drain, until it is given up
+    assert dispatcher.drain() == 2
+    assert sender.sent == [(None, expose['id']) for expose in exposes[1:3]]
+
+    dispatcher.RETRY_DELAY = datetime.timedelta(hours=1)
+    id_watch.queue_notifications(exposes[:1], [('telegram', None, exposes[0])])
+    assert dispatcher.drain() == 0
+    (pending,) = id_watch.get_connection().execute('SELECT attempts FROM outbox').fetchall()
+    assert pending == (1,)
+    sender.failing = set()
+    id_watch.get_connection().execute('UPDATE outbox SET next_attempt = ?',
+                                      (datetime.datetime.now(),))
+    assert dispatcher.drain() == 1
+    assert sender.sent[-1] == (None, exposes[0]['id'])
+    assert id_watch.get_due_notifications(100) == []
+
+def test_notifications_rejected_by_the_api_are_retried():
+    id_watch = IdMaintainer(":memory:")
+    dispatcher = NotificationDispatcher(StringConfig(string=CONFIG), id_watch)
+    expose = { 'id': 1, 'crawler': 'Dummy', 'title': 'Flat' }
+    id_watch.queue_notifications([expose], [('telegram', None, expose)])
+    with Mocker() as m:
+        m.post('https://api.telegram.org/botdummy/sendMessage', status_code=500,
+               json={"ok": False, "description": "Internal Server Error"})
+        assert dispatcher.drain() == 0
+    (pending,) = id_watch.get_connection().execute('SELECT attempts FROM outbox').fetchall()
+    assert pending == (1,)
+
+def test_unreachable_receivers_are_reported(sender):
+    id_watch = IdMaintainer(":memory:")
+    unreachable = []
+    dispatcher = NotificationDispatcher(StringConfig(string=CONFIG), id_watch,
+                                        on_undeliverable=unreachable.append)
+    sender.blocked = {2}
+    expose = { 'id': 1, 'crawler': 'Dummy', 'title': 'Flat' }
+    id_watch.queue_notifications([expose], [('telegram', [1], expose),
+                                            ('telegram', [2], expose)])
+    assert dispatcher.drain() == 2
+    assert sender.sent == [([1], 1)]
+    assert unreachable == [2]
+    assert id_watch.is_processed(1, 'Dummy')
+
+def test_background_dispatcher_delivers_notifications(sender, tmp_path):
+    id_watch = IdMaintainer(str(tmp_path / 'processed_ids.db'))
+    hunter = hunter_for(id_watch)
+    hunter.notification_dispatcher.start()
+    try:
+        exposes = hunter.hunt_flats()
+    finally:
+        hunter.notification_dispatcher.stop()
+    assert len(exposes) > 0
+    assert sorted(expose_id for (_, expose_id) in sender.sent) \
+        == sorted(expose['id'] for expose in exposes)
+    assert id_watch.get_due_notifications(100) == []
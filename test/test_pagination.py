@@ -0,0 +1,134 @@
+import re
+import threading
+import time
+
+import requests_mock
+
+from flathunter.crawler.immobilienscout import Immobilienscout
+from flathunter.idmaintainer import IdMaintainer
+from flathunter.pagination import IncrementalPagination, PaginationStats
+from test.utils.config import StringConfig
+
+SEARCH_URL = "https://www.immobilienscout24.de/Suche/de/berlin/berlin/wohnung-mieten"
+API_URL = re.compile(r'https://api\.mobile\.immobilienscout24\.de/search/list\?.*')
+
+def api_page(page_no, per_page=10, total=120):
+    """A page of API results, with IDs counting down from the newest"""
+    first_id = 1000 - (page_no - 1) * per_page
+    return {
+        'totalResults': total,
+        'resultListItems': [{
+            'type': 'EXPOSE_RESULT',
+            'item': {
+                'id': str(expose_id),
+                'title': f"Flat {expose_id}",
+                'address': { 'line': 'Berlin' },
+                'attributes': [{ 'value': '1.000\xa0€' }]
+            }
+        } for expose_id in range(first_id, first_id - per_page, -1)]
+    }
+
+def mock_api(m):
+    def respond(request, context):
+        return api_page(int(request.qs['pagenumber'][0]))
+    m.post(API_URL, json=respond)
+
+def crawler_and_pagination(known_ids, config=""):
+    crawler = Immobilienscout(StringConfig(string=config))
+    id_watch = IdMaintainer(":memory:")
+    for expose_id in known_ids:
+        id_watch.save_expose({ 'id': expose_id, 'crawler': 'Immobilienscout' })
+    return (crawler, IncrementalPagination(id_watch))
+
+@requests_mock.Mocker(kw='m')
+def test_pagination_stops_at_first_known_page(**kwargs):
+    mock_api(kwargs['m'])
+    (crawler, pagination) = crawler_and_pagination(range(981, 1001))
+    entries = crawler.get_results(SEARCH_URL, pagination=pagination)
+    assert [entry['id'] for entry in entries] == list(range(1000, 990, -1))
+    assert kwargs['m'].call_count == 1
+    assert pagination.cycle_stats() == { SEARCH_URL: PaginationStats(1, 4) }
+    assert pagination.cycle_stats() == {}
+
+@requests_mock.Mocker(kw='m')
+def test_pagination_continues_while_pages_hold_new_exposes(**kwargs):
+    mock_api(kwargs['m'])
+    # only the first page holds a new expose; fetch one page at a time
+    (crawler, pagination) = crawler_and_pagination(
+        range(981, 1000), config="http:\n  max_requests_per_host: 1\n")
+    entries = crawler.get_results(SEARCH_URL, pagination=pagination)
+    assert len(entries) == 20
+    assert kwargs['m'].call_count == 2
+    assert pagination.cycle_stats() == { SEARCH_URL: PaginationStats(2, 3) }
+
+@requests_mock.Mocker(kw='m')
+def test_pagination_is_not_incremental_for_other_sort_orders(**kwargs):
+    mock_api(kwargs['m'])
+    (crawler, pagination) = crawler_and_pagination(range(901, 1001))
+    entries = crawler.get_results(SEARCH_URL + "?sorting=3", pagination=pagination)
+    assert len(entries) == 50
+    assert kwargs['m'].call_count == 5
+    assert pagination.cycle_stats() == { SEARCH_URL + "?sorting=3": PaginationStats(5, 0) }
+
+def test_unknown_exposes_are_filtered_per_crawler():
+    id_watch = IdMaintainer(":memory:")
+    id_watch.save_expose({ 'id': 1, 'crawler': 'Immobilienscout' })
+    assert id_watch.filter_unknown([1, 2], 'Immobilienscout') == [2]
+    assert id_watch.filter_unknown([1, 2], 'WgGesucht') == [1, 2]
+    assert not IncrementalPagination(id_watch).all_known([])
+
+class SlowApi:
+    """Stands in for fetch_api_data, recording the number of concurrent requests.
+       Every page repeats the last expose of the previous page"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.active = 0
+        self.max_active = 0
+        self.requested = []
+
+    def fetch(self, api_url, page_no=None):
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+            self.requested.append(page_no)
+        time.sleep(0.05)
+        with self.lock:
+            self.active -= 1
+        page = api_page(page_no, per_page=11, total=200)
+        for item in page['resultListItems']:
+            item['item']['id'] = str(int(item['item']['id']) + page_no - 1)
+        return MockResponse(page)
+
+class MockResponse:
+    def __init__(self, body):
+        self.body = body
+
+    def json(self):
+        return self.body
+
+def test_pages_are_fetched_in_parallel_and_merged_in_order(mocker):
+    crawler = Immobilienscout(StringConfig(string="http:\n  max_requests_per_host: 2\n"))
+    api = SlowApi()
+    mocker.patch.object(crawler, 'fetch_api_data', api.fetch)
+    entries = crawler.get_results(SEARCH_URL + "?sorting=3")
+    assert sorted(api.requested) == [1, 2, 3, 4, 5]
+    assert api.max_active == 2
+    ids = [entry['id'] for entry in entries]
+    assert ids == sorted(set(ids), reverse=True)
+    assert len(ids) == 5 * 11 - 4
+
+def test_parallel_fetching_stops_at_max_pages(mocker):
+    crawler = Immobilienscout(StringConfig(string=""))
+    api = SlowApi()
+    mocker.patch.object(crawler, 'fetch_api_data', api.fetch)
+    crawler.get_results(SEARCH_URL, max_pages=3)
+    assert sorted(api.requested) == [1, 2, 3]
+
+def test_queries_are_compiled_once_per_search_url():
+    crawler = Immobilienscout(StringConfig(string=""))
+    compiled = crawler.compile_query(SEARCH_URL)
+    assert crawler.compile_query(SEARCH_URL) is compiled
+    assert '&pagenumber={0}' in compiled.api_url
+    assert crawler.compile_query(SEARCH_URL + "?sorting=3") is not compiled
+    assert len(crawler.compiled_queries) == 2
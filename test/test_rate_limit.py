@@ -0,0 +1,56 @@
+import pytest
+
+from flathunter.utils.rate_limit import TokenBucket, KeyedRateLimiter
+from test.utils.clock import FakeClock
+
+def test_token_bucket_allows_burst_then_rate():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=20, capacity=5, clock=clock.monotonic, sleep=clock.sleep)
+    for _ in range(5):
+        bucket.acquire()
+    assert clock.sleeps == []
+    assert bucket.tokens == 0
+    assert bucket.try_acquire() == pytest.approx(0.05)
+    for _ in range(4):
+        bucket.acquire()
+    assert clock.now == pytest.approx(0.2)
+    assert bucket.tokens == pytest.approx(0)
+
+def test_tokens_are_refilled_up_to_the_capacity():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=20, capacity=5, clock=clock.monotonic, sleep=clock.sleep)
+    bucket.acquire()
+    clock.sleep(10)
+    assert bucket.try_acquire() == 0
+    assert bucket.tokens == 4
+
+def test_pausing_a_key_does_not_hold_back_other_keys():
+    clock = FakeClock()
+    limiter = KeyedRateLimiter(rate=100, capacity=100, rate_per_key=100, capacity_per_key=10,
+                               clock=clock.monotonic, sleep=clock.sleep)
+    limiter.pause('paused', 0.5)
+    assert limiter.bucket_for('paused').try_acquire() == 0.5
+    limiter.acquire('other')
+    assert clock.sleeps == []
+    limiter.acquire('paused')
+    assert clock.sleeps == [0.5]
+    # the global bucket refilled while the paused key waited
+    assert limiter.bucket.tokens == 99
+
+def test_idle_buckets_are_dropped():
+    clock = FakeClock()
+    limiter = KeyedRateLimiter(rate=1000, capacity=1000, rate_per_key=1, capacity_per_key=3,
+                               clock=clock.monotonic, sleep=clock.sleep)
+    limiter.MIN_SWEEP_SIZE = limiter.sweep_size = 4
+    for key in range(4):
+        limiter.acquire(key)
+    limiter.pause(0, 10)
+    clock.sleep(5)
+    # buckets 1 to 3 have refilled, and are dropped when the next key comes in
+    limiter.acquire('new')
+    assert list(limiter.buckets) == [0, 'new']
+    for key in range(100):
+        limiter.acquire(key)
+        clock.sleep(3)
+    assert len(limiter.buckets) <= 4
+
@@ -0,0 +1,96 @@
+import random
+
+from flathunter.config import YamlConfig
+from flathunter.filter import Filter, ExposeRecord
+from flathunter.idmaintainer import IdMaintainer
+from flathunter.subscription_index import SubscriptionIndex
+from flathunter.web_hunter import WebHunter
+from test.dummy_crawler import DummyCrawler
+from test.utils.config import StringConfig
+from test.utils.exposes import synthetic_exposes
+
+CONFIG = """
+urls:
+  - https://www.example.com/liste/berlin/wohnungen/mieten?roomi=2&prima=1500&wflmi=70&sort=createdate%2Bdesc
+notifiers:
+  - telegram
+telegram:
+  bot_token: dummy
+"""
+
+def random_settings(rng):
+    filters = {}
+    for (name, low, high) in [('min_price', 300, 1500), ('max_price', 800, 3000),
+                              ('min_size', 15, 60), ('max_size', 50, 150),
+                              ('min_rooms', 1, 3), ('max_rooms', 2, 5),
+                              ('max_price_per_square', 10, 40)]:
+        if rng.random() < 0.4:
+            filters[name] = rng.randint(low, high)
+    if rng.random() < 0.3:
+        filters['excluded_titles'] = rng.sample(["wg", "tausch", "altbau", "balk.n"], 2)
+    return { 'filters': filters }
+
+def filter_for(settings):
+    return Filter.builder().read_config(YamlConfig(settings)).build()
+
+def test_index_matches_user_filters():
+    rng = random.Random(7)
+    users = [(user_id, random_settings(rng)) for user_id in range(60)]
+    index = SubscriptionIndex.from_user_settings(users)
+    filters = [(user_id, filter_for(settings)) for (user_id, settings) in users]
+    for expose in synthetic_exposes(500):
+        expected = [user_id for (user_id, filter_set) in filters
+                    if filter_set.is_interesting_expose(expose)]
+        assert index.matching_users(ExposeRecord.from_expose(expose)) == expected
+
+def test_index_is_updated_incrementally():
+    index = SubscriptionIndex.from_user_settings([
+        (1, { 'filters': { 'max_price': 1000, 'excluded_titles': ['wg'] } }),
+        (2, { 'filters': { 'max_price': 2000 } }),
+        (3, { 'filters': {}, 'mute_notifications': True }),
+    ])
+    expose = ExposeRecord.from_expose({ 'title': 'Schöne WG', 'price': '900 €' })
+    assert index.matching_users(expose) == [2]
+    index.update_user(1, { 'filters': { 'max_price': 1000 } })
+    index.update_user(2, { 'filters': { 'max_price': 800 } })
+    index.update_user(3, { 'filters': {} })
+    assert index.matching_users(expose) == [1, 3]
+    index.update_user(1, { 'filters': {}, 'mute_notifications': True })
+    assert index.matching_users(expose) == [3]
+    assert index.bounds['max_price'].entries == [(800, 2)]
+    assert index.titles.users_by_pattern == {}
+
+def test_web_hunter_notifies_matching_users(mocker):
+    sent = {}
+    class RecordingSender:
+        def __init__(self, config, receivers=None):
+            self.receivers = receivers
+        def process_expose(self, expose):
+            for receiver in self.receivers or []:
+                sent.setdefault(receiver, []).append(expose['id'])
+            return expose
+    mocker.patch('flathunter.notification_outbox.SenderTelegram', RecordingSender)
+    config = StringConfig(string=CONFIG)
+    config.set_searchers([DummyCrawler()])
+    hunter = WebHunter(config, IdMaintainer(":memory:"))
+    hunter.set_filters_for_user(1, { 'max_price': 1000 })
+    hunter.set_filters_for_user(2, {})
+    hunter.set_notification_status(3, False)
+    hunter.set_filters_for_user(2, { 'min_price': 1000 })
+    exposes = hunter.hunt_flats()
+    by_price = {expose['id']: int(expose['price'].split()[0]) for expose in exposes}
+    assert sent[1] == [expose_id for expose_id in by_price if by_price[expose_id] <= 1000]
+    assert sent[2] == [expose_id for expose_id in by_price if by_price[expose_id] >= 1000]
+    assert 3 not in sent
+
+def test_web_hunter_sees_settings_saved_by_other_processes():
+    config = StringConfig(string=CONFIG)
+    config.set_searchers([DummyCrawler()])
+    id_watch = IdMaintainer(":memory:")
+    (hunter, other_worker) = (WebHunter(config, id_watch), WebHunter(config, id_watch))
+    hunter.set_filters_for_user(1, { 'max_price': 1000 })
+    expose = ExposeRecord.from_expose({ 'title': 'Flat', 'price': '900 €' })
+    assert hunter.subscription_index().matching_users(expose) == [1]
+    other_worker.set_filters_for_user(2, {})
+    other_worker.set_notification_status(1, False)
+    assert hunter.subscription_index().matching_users(expose) == [2]
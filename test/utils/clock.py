@@ -0,0 +1,22 @@
+"""Fake clock for tests of code that waits"""
+import threading
+
+class FakeClock:
+    """A monotonic clock that only advances when something sleeps. The sleeps are
+       recorded instead of waited for"""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+        self.lock = threading.Lock()
+
+    def monotonic(self):
+        """The current time on the clock, in seconds"""
+        with self.lock:
+            return self.now
+
+    def sleep(self, seconds):
+        """Advance the clock by the given number of seconds"""
+        with self.lock:
+            self.sleeps.append(seconds)
+            self.now += seconds
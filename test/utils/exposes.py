@@ -0,0 +1,17 @@
+"""Generate exposes for tests"""
+import random
+
+def synthetic_exposes(count, seed=42):
+    """Generates exposes with the kind of text found in crawled listings"""
+    rng = random.Random(seed)
+    words = ["wg", "tausch", "ruhig", "hell", "altbau", "balkon", "zentral"]
+    for expose_id in range(count):
+        yield {
+            'id': expose_id,
+            'crawler': 'Synthetic',
+            'title': f"Schöne Wohnung, {rng.choice(words)} und {rng.choice(words)}",
+            'price': f"{rng.randint(300, 3000):,}.{rng.randint(0, 99):02d} €"
+                     .replace(",", "X").replace(".", ",").replace("X", "."),
+            'size': f"{rng.randint(15, 150)},{rng.randint(0, 9)} m²",
+            'rooms': rng.choice(["1", "1,5", "2", "2,5", "3", "4", "5"]),
+        }
@@ -0,0 +1,60 @@
+"""Implementations that faster code has replaced, to check that the replacements
+give the same results, and to compare their timings in benchmarks/benchmark.py"""
+from functools import reduce
+import operator
+import re
+
+def legacy_get_number(text, thousands_separator=False):
+    """Number parsing as done by every filter before ExposeRecord existed"""
+    match = re.search(r'\d+([\.,]\d+)?', text)
+    if match is None:
+        return None
+    number = match[0].replace(".", "") if thousands_separator else match[0]
+    return float(number.replace(",", "."))
+
+def legacy_filter(filters):
+    """The filter chain before ExposeRecord: every filter re-parses the text it needs,
+       and every filter is applied to every expose"""
+    def bound(field, thousands_separator, check, limit):
+        def is_interesting(expose):
+            value = legacy_get_number(expose[field], thousands_separator)
+            return value is None or check(value, limit)
+        return is_interesting
+
+    def excluded_titles(titles):
+        def is_interesting(expose):
+            return not re.search("(" + ")|(".join(titles) + ")", expose['title'],
+                                 re.IGNORECASE)
+        return is_interesting
+
+    def max_price_per_square(limit):
+        def is_interesting(expose):
+            size = legacy_get_number(expose['size'])
+            price = legacy_get_number(expose['price'], thousands_separator=True)
+            return size is None or price is None or price / size <= limit
+        return is_interesting
+
+    checks = []
+    if 'excluded_titles' in filters:
+        checks.append(excluded_titles(filters['excluded_titles']))
+    for field, thousands_separator in [('price', True), ('size', False), ('rooms', False)]:
+        if f'min_{field}' in filters:
+            checks.append(bound(field, thousands_separator, operator.ge,
+                                filters[f'min_{field}']))
+        if f'max_{field}' in filters:
+            checks.append(bound(field, thousands_separator, operator.le,
+                                filters[f'max_{field}']))
+    if 'max_price_per_square' in filters:
+        checks.append(max_price_per_square(filters['max_price_per_square']))
+
+    def is_interesting_expose(expose):
+        return reduce((lambda x, y: x and y), map((lambda x: x(expose)), checks), True)
+    return is_interesting_expose
+
+def uncached_api_url(crawler, search_url):
+    """ImmobilienScout API URL template as built before queries were compiled once
+       per search URL"""
+    api_url = crawler.compose_api_url(crawler.get_immoscout_query(search_url))
+    if '&pagenumber' in api_url:
+        return re.sub(r"&pagenumber=[0-9]", "&pagenumber={0}", api_url)
+    return api_url + '&pagenumber={0}'
@@ -0,0 +1,75 @@
+"""Results pages of the portals, for tests"""
+import json
+import os
+
+FIXTURES = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))),
+                        "crawler", "fixtures")
+
+def wggesucht_page():
+    """The saved WG-Gesucht page. It predates the titles of the offers moving from
+       h3 to h2 elements, which the crawler expects"""
+    with open(os.path.join(FIXTURES, "wg-gesucht-spotahome.html"), 'rb') as fixture:
+        return fixture.read() \
+            .replace(b'<h3 class="truncate_title', b'<h2 class="truncate_title') \
+            .replace(b'</h3>', b'</h2>')
+
+def page_chrome(results):
+    """A page around the results, with the navigation and scripts of a portal page"""
+    links = "".join(f'<li><a href="/links/{link}" class="nav-link">Link {link}</a></li>'
+                    for link in range(300))
+    script = "var state = {" + ",".join(f'"k{key}": {key}' for key in range(3000)) + "};"
+    return (f'<!DOCTYPE html><html><head><meta charset="utf-8"><script>{script}</script>'
+            f'</head><body><nav><ul>{links}</ul></nav><main>{results}</main>'
+            f'<footer><ul>{links}</ul></footer></body></html>').encode('utf-8')
+
+def immowelt_page(count=30):
+    """An Immowelt results page with 'count' advertisements"""
+    cards = "".join(f"""
+      <div class="css-79elbk">
+        <a href="https://www.immowelt.de/expose/{ad_id:x}"><span>Zum Exposé</span></a>
+        <img src="https://ms.immowelt.org/{ad_id:x}.jpg" alt="">
+        <div class="css-1cbj9xw"> Helle Wohnung {ad_id} mit Balkon </div>
+        <div data-testid="cardmfe-price-testid">1.{ad_id % 1000:03d} €</div>
+        <div data-testid="cardmfe-keyfacts-testid"><div>{ad_id % 5 + 1} Zimmer</div>
+          <div>·</div><div>{ad_id % 90 + 30} m²</div><div>2. Geschoss</div></div>
+        <div data-testid="cardmfe-description-box-address">Berlin (Mitte)</div>
+      </div>""" for ad_id in range(100_000, 100_000 + count))
+    return page_chrome('<div data-testid="serp-core-scrollablelistview-testid">'
+                       f'{cards}</div>')
+
+def vrmimmo_page(count=30):
+    """A VRM Immo results page with 'count' search results"""
+    cards = "".join(f"""
+      <div class="item-wrap js-serp-item" id="item-{item_id}">
+        <a class="js-item-title-link ci-search-result__link" href="/immobilien/{item_id}"
+           title="Wohnung {item_id}"><img src="https://vrm-immo.de/img/{item_id}.jpg"></a>
+        <div class="item__spec item-spec-price"> {item_id % 1000 + 500} € </div>
+        <div class="item__spec item-spec-area"> {item_id % 90 + 30} m² </div>
+        <div class="item__spec item-spec-rooms"> {item_id % 5 + 1} </div>
+        <div class="item__locality"> Darmstadt </div>
+      </div>""" for item_id in range(5000, 5000 + count))
+    return page_chrome(f'<div class="ci-search-results">{cards}</div>')
+
+def subito_search_state(count):
+    """The Next.js state of a Subito results page with 'count' results"""
+    items = [{'item': {
+        'urn': f"id:ad:{item_id}:list:{item_id * 7}",
+        'subject': f"Bilocale arredato {item_id}",
+        'body': "Appartamento luminoso, vicino alla metropolitana. " * 20,
+        'urls': {'default': f"https://www.subito.it/appartamenti/{item_id}.htm"},
+        'images': [{'scale': [{'secureuri': f"https://images.sbito.it/{item_id}/{size}.jpg"}
+                              for size in range(6)]} for _ in range(6)],
+        'features': {'/price': {'values': [{'key': f"{item_id % 1000 + 500} €"}]},
+                     '/room': {'values': [{'key': str(item_id % 5 + 1)}]},
+                     '/size': {'values': [{'key': f"{item_id % 90 + 30} mq"}]}},
+        'geo': {'town': {'value': 'Milano'}, 'city': {'shortName': 'MI'},
+                'region': {'value': 'Lombardia'}},
+    }} for item_id in range(1000, 1000 + count)]
+    return {'props': {'state': {'items': {'list': items}}}}
+
+def subito_page(count=30):
+    """A Subito results page with the search state in a __NEXT_DATA__ script"""
+    page = page_chrome('<div class="items">Annunci</div>')
+    script = ('<script id="__NEXT_DATA__" type="application/json">'
+              f'{json.dumps(subito_search_state(count))}</script>').encode('utf-8')
+    return page.replace(b'</body>', script + b'</body>')